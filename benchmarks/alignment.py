@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+alignment.py
+Compares the NumPy aligners in scoring.alignment (full matrix and anchored)
+with string2string's NeedlemanWunsch across document lengths, reporting
+wall-clock time and peak traced memory.
+
+Run from the repository root:
+    python -m benchmarks.alignment --lengths 100 500 1000
+"""
+
+import random
+import time
+import tracemalloc
+from typing import List
+
+from tap import Tap
+
+import scoring.alignment
+from benchmarks.synthetic import synthetic_pair
+
+class BenchmarkArguments(Tap):
+    lengths: List[int] = [50, 100, 250, 500, 1000]
+    """Source document lengths (in tokens) to benchmark"""
+    repeats: int = 3
+    """How many times to time each aligner; the fastest run is reported"""
+    seed: int = 0
+    """Seed for the synthetic documents"""
+    skip_reference: bool = False
+    """Only time the NumPy aligner (string2string is slow on long documents)"""
+
+def time_best(fn, repeats: int) -> float:
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def peak_memory(fn) -> float:
+    """peak_memory returns the peak traced allocation of fn in MB."""
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / 2**20
+
+def main(args: BenchmarkArguments):
+    rng = random.Random(args.seed)
+    print(f"{'tokens':>8} {'full (s)':>10} {'full (MB)':>10} {'anchored (s)':>13} {'anchored (MB)':>14} {'string2string (s)':>18} {'speedup':>8}")
+    for length in args.lengths:
+        source, response = synthetic_pair(length, rng)
+        full = lambda: scoring.alignment.align_tokens(source, response)
+        anchored = lambda: scoring.alignment.align_tokens_anchored(source, response)
+        fast = time_best(full, args.repeats)
+        fast_anchored = time_best(anchored, args.repeats)
+        columns = f"{length:>8} {fast:>10.4f} {peak_memory(full):>10.1f} {fast_anchored:>13.4f} {peak_memory(anchored):>14.1f}"
+        if args.skip_reference:
+            print(f"{columns} {'-':>18} {'-':>8}")
+            continue
+        import string2string.alignment
+        nw = string2string.alignment.NeedlemanWunsch(gap_char='~')
+        reference = time_best(lambda: nw.get_alignment(source, response), 1)
+        print(f"{columns} {reference:>18.4f} {reference / fast:>7.1f}x")
+
+if __name__ == '__main__':
+    args = BenchmarkArguments().parse_args()
+    main(args)
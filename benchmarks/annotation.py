@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+annotation.py
+Compares spacy.scorer.Scorer with the annotate-mode Scorer in scoring/,
+which counts the entities of many documents at once as integer arrays,
+on synthetic annotate-mode answers. The scores are checked to be equal.
+
+The time of the Scorer is split into reading the token attributes of the
+examples into arrays (add) and counting the entities in every variant
+from the arrays (count), which includes aligning the answers whose tokens
+differ from the reference.
+
+Run from the repository root:
+    python -m benchmarks.annotation --documents 10000 100000
+"""
+
+import time
+from typing import List, Tuple
+
+from tap import Tap
+import spacy
+import spacy.scorer
+
+import scoring.annotation
+from benchmarks.synthetic import synthetic_examples
+
+class BenchmarkArguments(Tap):
+    documents: List[int] = [10000, 100000]
+    """Corpus sizes to benchmark"""
+    length: int = 100
+    """Tokens per document"""
+    retokenized: float = 0.05
+    """Fraction of the answers which are tokenized differently from the reference"""
+
+def score_spacy(examples: List[spacy.training.Example], nlp: spacy.Language) -> dict:
+    return spacy.scorer.Scorer(nlp).score(examples)
+
+def score_arrays(examples: List[spacy.training.Example], nlp: spacy.Language) -> Tuple[dict, float, float]:
+    # Count all the examples at once, to time the counting separately
+    scorer = scoring.annotation.Scorer(nlp, chunk_size=len(examples) + 1)
+    start = time.perf_counter()
+    for example in examples:
+        scorer.add(example)
+    added = time.perf_counter()
+    scores = scorer.scores()
+    return scores, added - start, time.perf_counter() - added
+
+def main(args: BenchmarkArguments):
+    nlp = spacy.blank('nb')
+    nlp.add_pipe('ner')
+    print(f"{'documents':>10} {'spaCy (s)':>10} {'add (s)':>8} {'count (s)':>10} {'speedup':>8} {'counting speedup':>17}")
+    for documents in args.documents:
+        examples = synthetic_examples(nlp.vocab, documents, args.length, retokenized=args.retokenized)
+        start = time.perf_counter()
+        expected = score_spacy(examples, nlp)
+        baseline = time.perf_counter() - start
+        # Score copies of the examples, so neither scorer reuses the alignments of the other
+        examples = [spacy.training.Example(example.predicted, example.reference) for example in examples]
+        scores, add, count = score_arrays(examples, nlp)
+        assert scores == expected, 'The scores differ from spaCy'
+        print(f"{documents:>10} {baseline:>10.2f} {add:>8.2f} {count:>10.2f} {baseline / (add + count):>7.1f}x {baseline / count:>16.1f}x")
+
+if __name__ == '__main__':
+    args = BenchmarkArguments().parse_args()
+    main(args)
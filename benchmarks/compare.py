@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+compare.py
+Compares the results of two runs of benchmarks.suite, benchmark by
+benchmark, and flags the benchmarks which got slower than the baseline by
+more than a threshold. It exits with status 1 if any did, so it can gate
+a change in CI. The fastest run of each benchmark is compared, as it is
+the least affected by noise.
+
+Run from the repository root:
+    python -m benchmarks.compare benchmarks/results/baseline.json current.json --threshold 0.1
+"""
+
+import json
+import sys
+from typing import List
+
+from tap import Tap
+
+class CompareArguments(Tap):
+    baseline: str
+    """The results of benchmarks.suite to compare with"""
+    current: str
+    """The results of benchmarks.suite to check for regressions"""
+    threshold: float = 0.1
+    """Flag benchmarks which take more than this fraction longer than the baseline"""
+
+    def configure(self):
+        self.add_argument('baseline')
+        self.add_argument('current')
+
+def compare(baseline: dict, current: dict, threshold: float = 0.1) -> List[dict]:
+    """compare returns the change of every benchmark in both results: the seconds in each,
+    their ratio (current / baseline), and whether it is a regression (a ratio above
+    1 + threshold) or an improvement (a ratio below 1 / (1 + threshold))."""
+    changes = []
+    for name, result in current['results'].items():
+        previous = baseline['results'].get(name)
+        if previous is None or 'seconds' not in previous or 'seconds' not in result:
+            continue
+        ratio = result['seconds'] / previous['seconds'] if previous['seconds'] > 0 else float('inf')
+        changes.append({
+            'name': name,
+            'baseline_seconds': previous['seconds'],
+            'seconds': result['seconds'],
+            'ratio': ratio,
+            'regression': ratio > 1 + threshold,
+            'improvement': ratio < 1 / (1 + threshold),
+        })
+    return changes
+
+def main(args: CompareArguments) -> int:
+    with open(args.baseline, 'r', encoding='utf8') as baseline_file:
+        baseline = json.load(baseline_file)
+    with open(args.current, 'r', encoding='utf8') as current_file:
+        current = json.load(current_file)
+    if baseline.get('scale') != current.get('scale'):
+        print(f"Warning: the runs have different scales ({baseline.get('scale')} and {current.get('scale')})")
+    changes = compare(baseline, current, args.threshold)
+    print(f"{'benchmark':<28} {'baseline (s)':>12} {'current (s)':>12} {'change':>8}")
+    for change in changes:
+        flag = 'REGRESSION' if change['regression'] else 'faster' if change['improvement'] else ''
+        print(f"{change['name']:<28} {change['baseline_seconds']:>12.4f} {change['seconds']:>12.4f} {change['ratio'] - 1:>+8.1%} {flag}")
+    missing = sorted(set(baseline['results']) - set(current['results']))
+    if missing:
+        print(f"Not in the current results: {', '.join(missing)}")
+    regressions = [change['name'] for change in changes if change['regression']]
+    if regressions:
+        print(f"{len(regressions)} regressions beyond {args.threshold:.0%}: {', '.join(regressions)}")
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    args = CompareArguments().parse_args()
+    sys.exit(main(args))
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+decoding.py
+Compares free greedy decoding in HFTransformerModel with prompt lookup
+decoding and source-constrained decoding in annotate mode, reporting the
+time, the number of forward passes and how many answers do not match the
+source text once the tags are removed.
+
+Without --modelName, a tiny randomly initialized GPT-2 is built in a
+temporary directory, so the benchmark runs offline on CPU.
+
+Run from the repository root:
+    python -m benchmarks.decoding --documents 16 --lookup_tokens 10
+"""
+
+import random
+import tempfile
+import time
+
+from tap import Tap
+
+from benchmarks.generation import make_tiny_causal_lm
+from benchmarks.synthetic import VOCABULARY
+from models.utilities.tags import remove_tags
+
+class BenchmarkArguments(Tap):
+    modelName: str = None
+    """Path to a local causal LM checkpoint (default: build a tiny random GPT-2)"""
+    prompt_path: str = 'prompts/gpt_annotate.txt'
+    """Prompt template to use"""
+    documents: int = 16
+    """Number of synthetic documents"""
+    max_length: int = 40
+    """Maximum document length in words (lengths are uniform from 5)"""
+    lookup_tokens: int = 10
+    """Number of tokens to draft with prompt lookup"""
+    layers: int = 2
+    """Number of layers in the random GPT-2"""
+    hidden: int = 64
+    """Hidden size of the random GPT-2"""
+    seed: int = 0
+
+def main(args: BenchmarkArguments):
+    import models.hf_transformer
+
+    rng = random.Random(args.seed)
+    with open(args.prompt_path, 'r', encoding='utf8') as prompt_file:
+        prompt = prompt_file.read()
+    sources = [' '.join(rng.choice(VOCABULARY) for _ in range(rng.randint(5, args.max_length))) for _ in range(args.documents)]
+
+    with tempfile.TemporaryDirectory() as directory:
+        model_name = args.modelName or make_tiny_causal_lm(directory, [prompt] + sources, args.layers, args.hidden)
+        model = models.hf_transformer.HFTransformerModel(prompt, model_name)
+        # Leave room for the tags, but stop free decoding from running on forever
+        model.max_new_tokens = 4 * max(len(model._encode(source)) for source in sources)
+        forward_passes = 0
+        def count_forward_pass(*_):
+            nonlocal forward_passes
+            forward_passes += 1
+        model.model.register_forward_hook(count_forward_pass)
+        model.predict_task(sources[0])
+
+        print(f"{'mode':>24} {'time (s)':>10} {'passes/doc':>12} {'misaligned':>12}")
+        for name, lookup_tokens, constrain in [('greedy', None, False), ('prompt lookup', args.lookup_tokens, False),
+                                               ('constrained', None, True), ('constrained + lookup', args.lookup_tokens, True)]:
+            model.prompt_lookup_tokens = lookup_tokens
+            model.constrain_to_source = constrain
+            forward_passes = 0
+            start = time.perf_counter()
+            answers = [model.predict_task(source) for source in sources]
+            elapsed = time.perf_counter() - start
+            misaligned = sum(remove_tags(answer) != source for answer, source in zip(answers, sources))
+            print(f"{name:>24} {elapsed:>10.2f} {forward_passes / len(sources):>12.1f} {misaligned:>12}")
+
+if __name__ == '__main__':
+    args = BenchmarkArguments().parse_args()
+    main(args)
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+generation.py
+Compares generating one document at a time with length-bucketed batches
+in HFTransformerModel, reporting documents per second, and measures the
+time to first token with and without the cached prompt prefix.
+
+Without --modelName, a tiny randomly initialized GPT-2 is built in a
+temporary directory, so the benchmark runs offline on CPU.
+
+Run from the repository root:
+    python -m benchmarks.generation --documents 32 --budgets 2048 8192
+    python -m benchmarks.generation --prompt_path prompts/gpt_annotate_example.txt --layers 6 --hidden 256
+"""
+
+import random
+import statistics
+import tempfile
+import time
+from typing import List
+
+from tap import Tap
+
+from benchmarks.synthetic import VOCABULARY
+
+class BenchmarkArguments(Tap):
+    modelName: str = None
+    """Path to a local causal LM checkpoint (default: build a tiny random GPT-2)"""
+    prompt_path: str = 'prompts/gpt_annotate.txt'
+    """Prompt template to use"""
+    documents: int = 32
+    """Number of synthetic documents"""
+    max_length: int = 60
+    """Maximum document length in words (lengths are uniform from 5)"""
+    max_new_tokens: int = 32
+    """Tokens to generate per document"""
+    budgets: List[int] = [2048, 8192]
+    """Token budgets to benchmark batched generation with"""
+    layers: int = 2
+    """Number of layers in the random GPT-2"""
+    hidden: int = 64
+    """Hidden size of the random GPT-2"""
+    seed: int = 0
+
+def make_tiny_causal_lm(directory: str, texts: List[str], layers: int = 2, hidden: int = 64) -> str:
+    """make_tiny_causal_lm trains a small byte-level BPE tokenizer on texts and saves it
+    with a randomly initialized GPT-2 (two layers by default) in directory."""
+    import tokenizers
+    import transformers
+
+    bpe = tokenizers.ByteLevelBPETokenizer()
+    bpe.train_from_iterator(texts, vocab_size=1000, special_tokens=['<|endoftext|>'])
+    tokenizer = transformers.PreTrainedTokenizerFast(tokenizer_object=bpe, eos_token='<|endoftext|>')
+    tokenizer.save_pretrained(directory)
+    config = transformers.GPT2Config(vocab_size=len(tokenizer), n_positions=2048, n_embd=hidden, n_layer=layers, n_head=2,
+                                     eos_token_id=tokenizer.eos_token_id, bos_token_id=tokenizer.eos_token_id)
+    transformers.GPT2LMHeadModel(config).save_pretrained(directory)
+    return directory
+
+def time_to_first_token(model, sources: List[str]) -> float:
+    """time_to_first_token returns the median time to generate one token for a single document."""
+    max_new_tokens = model.max_new_tokens
+    model.max_new_tokens = 1
+    timings = []
+    for source in sources:
+        start = time.perf_counter()
+        model.predict_task(source)
+        timings.append(time.perf_counter() - start)
+    model.max_new_tokens = max_new_tokens
+    return statistics.median(timings)
+
+def main(args: BenchmarkArguments):
+    import models.hf_transformer
+
+    rng = random.Random(args.seed)
+    with open(args.prompt_path, 'r', encoding='utf8') as prompt_file:
+        prompt = prompt_file.read()
+    sources = [' '.join(rng.choice(VOCABULARY) for _ in range(rng.randint(5, args.max_length))) for _ in range(args.documents)]
+
+    with tempfile.TemporaryDirectory() as directory:
+        model_name = args.modelName or make_tiny_causal_lm(directory, [prompt] + sources, args.layers, args.hidden)
+        model = models.hf_transformer.HFTransformerModel(prompt, model_name, max_new_tokens=args.max_new_tokens)
+        print(f"Prompt prefix: {len(model.prefix_ids)} tokens")
+
+        # The first call runs the prefix through the model and is left out of the timings
+        model.predict_task(sources[0])
+        for prefix_cache in [False, True]:
+            model.prefix_cache = prefix_cache
+            print(f"Time to first token (prefix cache {'on' if prefix_cache else 'off'}): {1000 * time_to_first_token(model, sources):.1f} ms")
+
+        print(f"{'mode':>16} {'time (s)':>10} {'docs/s':>10}")
+        start = time.perf_counter()
+        for source in sources:
+            model.predict_task(source)
+        elapsed = time.perf_counter() - start
+        print(f"{'one at a time':>16} {elapsed:>10.2f} {args.documents / elapsed:>10.2f}")
+
+        for budget in args.budgets:
+            model.batch_token_budget = budget
+            start = time.perf_counter()
+            model.predict_batch(sources)
+            elapsed = time.perf_counter() - start
+            print(f"{f'budget {budget}':>16} {elapsed:>10.2f} {args.documents / elapsed:>10.2f}")
+
+if __name__ == '__main__':
+    args = BenchmarkArguments().parse_args()
+    main(args)
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+n2c2.py
+Compares the streaming n2c2 loaders in datasets.loaders.n2c2 with the
+previous loaders (ET.parse on the whole file, string concatenation, one
+2014 file after another) on the training split, reporting wall-clock time
+and peak traced memory. The loaders are run without the dataset cache.
+Only the memory of the main process is traced, so the peak of the parallel
+2014 loader leaves out its worker processes.
+
+The n2c2 datasets cannot be shared, so by default the benchmark writes
+synthetic files with the same layout to a temporary directory. Point
+--directory at a copy of the real datasets to time those instead.
+
+Run from the repository root:
+    python -m benchmarks.n2c2 --records 2000
+"""
+
+import os
+import pathlib
+import random
+import tempfile
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape
+
+from tap import Tap
+import spacy
+
+import datasets.loaders.n2c2
+from benchmarks.alignment import peak_memory, time_best
+from benchmarks.synthetic import LABELS, VOCABULARY
+
+class BenchmarkArguments(Tap):
+    directory: str = None
+    """Directory holding 2006/ and 2014/ as in datasets/n2c2 (default: synthetic files)"""
+    records: int = 2000
+    """Number of synthetic records in the 2006 file, and documents in each 2014 folder"""
+    length: int = 300
+    """Tokens per synthetic record"""
+    workers: int = None
+    """Processes to load the 2014 documents with (default: one per CPU)"""
+    repeats: int = 1
+    """How many times to time each loader; the fastest run is reported"""
+    seed: int = 0
+    """Seed for the synthetic files"""
+
+def _synthetic_text(rng: random.Random, length: int):
+    """_synthetic_text returns a record as 2006-style XML with inline PHI elements, as plain
+    text, and its PHI as (start, end, type) in the plain text."""
+    parts, tags, plain = [], [], []
+    position = 0
+    for i in range(length):
+        word = rng.choice(VOCABULARY) + (' ' if i % 17 else '\n')
+        if rng.random() < 0.05:
+            label = rng.choice(LABELS)
+            parts.append(f'<PHI TYPE="{label}">{escape(word.strip())}</PHI>{word[len(word.strip()):]}')
+            tags.append((position, position + len(word.strip()), label))
+        else:
+            parts.append(escape(word))
+        plain.append(word)
+        position += len(word)
+    return ''.join(parts), ''.join(plain), tags
+
+def write_synthetic(directory: pathlib.Path, records: int, length: int, seed: int):
+    rng = random.Random(seed)
+    folder = directory / '2006' / 'deid_surrogate_train_all_version2'
+    folder.mkdir(parents=True)
+    with open(folder / 'deid_surrogate_train_all_version2.xml', 'w', encoding='utf8') as xml_file:
+        xml_file.write('<ROOT>\n')
+        for i in range(records):
+            text, _, _ = _synthetic_text(rng, length)
+            xml_file.write(f'<RECORD ID="{i}">\n<TEXT>\n{text}\n</TEXT>\n</RECORD>\n')
+        xml_file.write('</ROOT>\n')
+    for name in ['training-PHI-Gold-Set1', 'training-PHI-Gold-Set2']:
+        folder = directory / '2014' / name
+        folder.mkdir(parents=True)
+        for i in range(records):
+            _, plain, tags = _synthetic_text(rng, length)
+            tag_elements = ''.join(f'<{label} id="P{j}" start="{start}" end="{end}" text="" TYPE="{label}" comment="" />\n'
+                                   for j, (start, end, label) in enumerate(tags))
+            with open(folder / f'{i:04}.xml', 'w', encoding='utf8') as xml_file:
+                xml_file.write(f'<?xml version="1.0" encoding="UTF-8" ?>\n<deIdi2b2>\n<TEXT><![CDATA[{plain}]]></TEXT>\n<TAGS>\n{tag_elements}</TAGS>\n</deIdi2b2>\n')
+
+def previous_2006(path: pathlib.Path, nlp: spacy.language.Language) -> spacy.tokens.DocBin:
+    """previous_2006 is load_2006_from_file before it streamed the XML."""
+    xml_tree = ET.parse(path)
+    doc_bin = spacy.tokens.DocBin()
+    for record in xml_tree.findall('RECORD'):
+        contents = ""
+        spans = []
+        for elem in record.find('TEXT').iter():
+            cleaned_text = elem.text.replace('\n', ' ')
+            if elem.tag == 'PHI':
+                spans.append((len(contents), len(contents) + len(cleaned_text), elem.attrib['TYPE']))
+            contents += cleaned_text
+            contents += elem.tail.replace('\n', ' ')
+        doc = nlp.make_doc(contents)
+        doc.set_ents([doc.char_span(s[0], s[1], label=s[2], alignment_mode='expand') for s in spans])
+        doc_bin.add(doc)
+    return doc_bin
+
+def previous_2014(directory: pathlib.Path, nlp: spacy.language.Language) -> spacy.tokens.DocBin:
+    """previous_2014 is the 2014 training split loaded one file after another with ET.parse."""
+    docs = spacy.tokens.DocBin()
+    for folder in ['training-PHI-Gold-Set1', 'training-PHI-Gold-Set2']:
+        for name in os.listdir(directory / folder):
+            if not name.endswith('.xml'):
+                continue
+            root = ET.parse(directory / folder / name).getroot()
+            doc = nlp.make_doc(root.find('TEXT').text)
+            spans = [doc.char_span(int(elem.attrib['start']), int(elem.attrib['end']), label=elem.attrib['TYPE'])
+                     for elem in root.find('TAGS').iter() if elem.tag != 'TAGS']
+            doc.set_ents([span for span in spans if span is not None])
+            docs.add(doc)
+    return docs
+
+def main(args: BenchmarkArguments):
+    nlp = spacy.blank('nb')
+    with tempfile.TemporaryDirectory() as temporary:
+        directory = pathlib.Path(args.directory or temporary)
+        if args.directory is None:
+            write_synthetic(directory, args.records, args.length, args.seed)
+        path_2006 = directory / '2006' / 'deid_surrogate_train_all_version2' / 'deid_surrogate_train_all_version2.xml'
+        runs = {
+            '2006 previous': lambda: previous_2006(path_2006, nlp),
+            '2006 streaming': lambda: datasets.loaders.n2c2.load_2006(nlp, directory / '2006', 'train', cache_directory=None),
+            '2014 previous': lambda: previous_2014(directory / '2014', nlp),
+            '2014 parallel': lambda: datasets.loaders.n2c2.load_2014(nlp, directory / '2014', 'train', cache_directory=None, workers=args.workers),
+        }
+        print(f"{'loader':<16} {'documents':>10} {'time (s)':>10} {'peak (MB)':>10}")
+        for name, load in runs.items():
+            documents = len(load())
+            print(f"{name:<16} {documents:>10} {time_best(load, args.repeats):>10.2f} {peak_memory(load):>10.1f}")
+
+if __name__ == '__main__':
+    args = BenchmarkArguments().parse_args()
+    main(args)
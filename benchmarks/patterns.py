@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+patterns.py
+Compares the single-scan PatternMatcher in models.utilities.patterns with
+the previous matching in the spaCy baseline (one re.finditer pass per
+pattern, and one for ages) on the texts of the synthdeid dataset, reporting
+wall-clock time. Only the regular expressions are timed, not the pipeline.
+
+Run from the repository root:
+    python -m benchmarks.patterns --split holdout
+"""
+
+import re
+from typing import List, Tuple
+
+from tap import Tap
+import spacy
+
+import datasets.loaders.synthdeid
+from benchmarks.alignment import time_best
+from models.utilities.patterns import PATTERNS_PATH, PatternMatcher, load_rules
+
+class BenchmarkArguments(Tap):
+    split: str = 'holdout'
+    """The synthdeid split to match"""
+    patterns: str = PATTERNS_PATH
+    """YAML file with the rules to match"""
+    repeats: int = 5
+    """How many times to time each matcher; the fastest run is reported"""
+
+def previous_matches(compiled: List[Tuple[re.Pattern, str, int]], text: str) -> List[Tuple[int, int, str]]:
+    """previous_matches is the matching in the spaCy baseline before it used PatternMatcher."""
+    return [(match.start(group), match.end(group), label) for pattern, label, group in compiled for match in pattern.finditer(text)]
+
+def main(args: BenchmarkArguments):
+    vocab = spacy.blank('nb').vocab
+    texts = [doc.text for doc in datasets.loaders.synthdeid.load_synthdeid(vocab, args.split).get_docs(vocab)]
+    rules = load_rules(args.patterns)
+    compiled = [(re.compile(rule.pattern, re.IGNORECASE), rule.label, rule.group) for rule in rules]
+    matcher = PatternMatcher(rules)
+
+    previous = [previous_matches(compiled, text) for text in texts]
+    if previous != [matcher.matches(text) for text in texts]:
+        raise AssertionError("PatternMatcher does not find the same matches as the separate passes")
+
+    runs = {
+        'separate passes': lambda: [previous_matches(compiled, text) for text in texts],
+        'single scan': lambda: [matcher.matches(text) for text in texts],
+    }
+    print(f"{len(texts)} documents, {sum(len(text) for text in texts)} characters, {sum(len(m) for m in previous)} matches")
+    print(f"{'matcher':<16} {'time (s)':>10} {'speedup':>8}")
+    baseline = None
+    for name, run in runs.items():
+        elapsed = time_best(run, args.repeats)
+        baseline = baseline or elapsed
+        print(f"{name:<16} {elapsed:>10.4f} {baseline / elapsed:>8.2f}")
+
+if __name__ == '__main__':
+    args = BenchmarkArguments().parse_args()
+    main(args)
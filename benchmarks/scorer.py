@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+scorer.py
+Times the replace-mode Scorer on a synthetic corpus with different
+numbers of worker processes.
+
+Run from the repository root:
+    python -m benchmarks.scorer --workers 1 2 4 8
+"""
+
+import time
+from typing import List
+
+from tap import Tap
+import spacy
+
+import scoring.replacement
+from benchmarks.synthetic import synthetic_docbin
+
+class BenchmarkArguments(Tap):
+    documents: int = 200
+    """Number of synthetic documents"""
+    length: int = 500
+    """Tokens per document"""
+    workers: List[int] = [1, 2, 4]
+    """Worker counts to time the scorer with"""
+
+def main(args: BenchmarkArguments):
+    nlp = spacy.blank('nb')
+    doc_bin, answers = synthetic_docbin(nlp.vocab, args.documents, args.length)
+    print(f"{'workers':>8} {'time (s)':>10} {'docs/s':>10} {'speedup':>8}")
+    serial = None
+    for workers in args.workers:
+        scorer = scoring.replacement.Scorer(nlp, workers=workers)
+        start = time.perf_counter()
+        scorer.score(doc_bin, answers)
+        elapsed = time.perf_counter() - start
+        serial = serial or elapsed
+        print(f"{workers:>8} {elapsed:>10.3f} {args.documents / elapsed:>10.1f} {serial / elapsed:>7.1f}x")
+
+if __name__ == '__main__':
+    args = BenchmarkArguments().parse_args()
+    main(args)
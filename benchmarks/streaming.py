@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+streaming.py
+Compares the peak memory and time of predicting the whole corpus before
+scoring it (predict + spacy.scorer.Scorer) with scoring the answers as
+they arrive (predict_iter + scoring.annotation.Scorer), in annotate mode
+with the dummy model.
+
+Run from the repository root:
+    python -m benchmarks.streaming --documents 1000 5000
+"""
+
+import time
+import tracemalloc
+from typing import List
+
+from tap import Tap
+import spacy
+import spacy.scorer
+
+import models.dummy
+import scoring.annotation
+from benchmarks.synthetic import synthetic_docbin
+
+class BenchmarkArguments(Tap):
+    documents: List[int] = [1000, 5000]
+    """Corpus sizes to benchmark"""
+    length: int = 200
+    """Tokens per document"""
+
+def score_all(doc_bin: spacy.tokens.DocBin, nlp: spacy.Language) -> dict:
+    answers = models.dummy.DummyModel().predict(doc_bin, nlp, 'annotate')
+    return spacy.scorer.Scorer(nlp).score(answers)
+
+def score_stream(doc_bin: spacy.tokens.DocBin, nlp: spacy.Language) -> dict:
+    scorer = scoring.annotation.Scorer(nlp)
+    for _, answer in models.dummy.DummyModel().predict_iter(doc_bin, nlp, 'annotate'):
+        scorer.add(answer)
+    return scorer.scores()
+
+def main(args: BenchmarkArguments):
+    nlp = spacy.blank('nb')
+    nlp.add_pipe('ner')
+    print(f"{'documents':>10} {'mode':>8} {'time (s)':>10} {'peak (MB)':>10}")
+    for documents in args.documents:
+        doc_bin, _ = synthetic_docbin(nlp.vocab, documents, args.length)
+        for name, score in [('list', score_all), ('stream', score_stream)]:
+            tracemalloc.start()
+            start = time.perf_counter()
+            score(doc_bin, nlp)
+            elapsed = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f"{documents:>10} {name:>8} {elapsed:>10.2f} {peak / 2**20:>10.1f}")
+
+if __name__ == '__main__':
+    args = BenchmarkArguments().parse_args()
+    main(args)
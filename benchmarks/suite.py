@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+"""
+suite.py
+Runs the benchmark suite of the harness on synthetic corpora of a given
+scale (documents, tokens per document and PHI density) and writes the
+results as JSON, so that any performance change can be compared with a
+stored baseline with benchmarks.compare.
+
+The micro benchmarks time single functions on the hot paths over the whole
+corpus (aligning replace-mode answers, parsing the tags of annotate-mode
+answers, projecting the annotations of misaligned answers onto the source,
+fixing the orthography of answers and matching the rules of the spaCy
+baseline), and the macro benchmarks time whole stages (the scorers, the
+bootstrap of scoring.stats, the spaCy baseline, the dataset loaders and
+loading the spaCy pipeline at startup, with only its tokenizer and in
+full). The n2c2 loaders read
+synthetic files written by benchmarks.n2c2, and the other loaders their
+real sources, without the dataset cache. Benchmarks whose data or models
+are missing are skipped.
+
+Run from the repository root:
+    python -m benchmarks.suite --output benchmarks/results/baseline.json
+    python -m benchmarks.suite --only align tags --documents 2000 --output current.json
+"""
+
+import datetime
+import functools
+import json
+import os
+import pathlib
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+from typing import Callable, Dict, List, Tuple
+
+from tap import Tap
+import numpy as np
+import spacy
+
+import datasets.loaders.cache
+import datasets.loaders.n2c2
+import datasets.loaders.norsynth
+import datasets.loaders.synthdeid
+import eval
+import scoring.annotation
+import scoring.replacement
+import scoring.stats
+from benchmarks.n2c2 import write_synthetic
+from benchmarks.synthetic import synthetic_annotated, synthetic_docbin, synthetic_examples
+from models.utilities.alignment import fix_orthography
+from models.utilities.patterns import PatternMatcher
+from models.utilities.projection import project_spans
+from models.utilities.tags import list_annotations, parse_tags, remove_tags
+
+EXPECTED_TAGS = ['First_Name', 'Last_Name', 'Location', 'Health_Care_Unit', 'Age', 'Phone_Number', 'Social_Security_Number', 'Date']
+
+class BenchmarkArguments(Tap):
+    documents: int = 500
+    """Number of synthetic documents"""
+    length: int = 300
+    """Tokens per synthetic document"""
+    phi_density: float = 0.05
+    """Fraction of the synthetic tokens which are entities"""
+    repeats: int = 5
+    """How many times to time each benchmark; the fastest and the median run are reported"""
+    seed: int = 0
+    """Seed for the synthetic corpora"""
+    pipeline: str = 'nb_core_news_sm'
+    """spaCy pipeline to time loading at startup"""
+    resamples: int = 10000
+    """Bootstrap resamples of the scores"""
+    only: List[str] = []
+    """Only run the benchmarks whose names start with one of these"""
+    output: str = None
+    """File to write the results to as JSON"""
+
+class Skipped(Exception):
+    """Skipped is raised by the setup of a benchmark which cannot run here."""
+
+class Corpus:
+    """Corpus holds the synthetic data of a run of the suite, built the first time a
+    benchmark needs it, so that a run of a few benchmarks only builds what they use."""
+    def __init__(self, args: BenchmarkArguments, directory: pathlib.Path):
+        self.args = args
+        self.directory = directory
+        self.nlp = spacy.blank('nb')
+
+    @functools.cached_property
+    def docs(self) -> Tuple[spacy.tokens.DocBin, List[str]]:
+        """The documents, with replace-mode answers."""
+        return synthetic_docbin(self.nlp.vocab, self.args.documents, self.args.length, self.args.phi_density, self.args.seed)
+
+    @functools.cached_property
+    def annotated(self) -> List[str]:
+        return synthetic_annotated(self.nlp.vocab, self.docs[0])
+
+    @functools.cached_property
+    def examples(self) -> List[spacy.training.Example]:
+        return synthetic_examples(self.nlp.vocab, self.args.documents, self.args.length, self.args.phi_density, seed=self.args.seed)
+
+    @functools.cached_property
+    def n2c2(self) -> pathlib.Path:
+        """The directory of the synthetic n2c2 files."""
+        directory = self.directory / 'n2c2'
+        write_synthetic(directory, self.args.documents, self.args.length, self.args.seed)
+        return directory
+
+# Every benchmark by name: whether it is a micro or macro benchmark, and its setup, which
+# returns the function to time and the number of documents it processes
+BENCHMARKS: Dict[str, Tuple[str, Callable[[Corpus], Tuple[Callable[[], object], int]]]] = {}
+
+def benchmark(name: str, kind: str):
+    def register(setup):
+        BENCHMARKS[name] = (kind, setup)
+        return setup
+    return register
+
+@benchmark('align_answer', 'micro')
+def _align_answer(corpus: Corpus):
+    doc_bin, answers = corpus.docs
+    docs = list(doc_bin.get_docs(corpus.nlp.vocab))
+    return lambda: [scoring.replacement.align_answer(doc, answer) for doc, answer in zip(docs, answers)], len(docs)
+
+@benchmark('align_answer.anchored', 'micro')
+def _align_answer_anchored(corpus: Corpus):
+    doc_bin, answers = corpus.docs
+    docs = list(doc_bin.get_docs(corpus.nlp.vocab))
+    return lambda: [scoring.replacement.align_answer(doc, answer, anchored=True) for doc, answer in zip(docs, answers)], len(docs)
+
+@benchmark('tags.remove_tags', 'micro')
+def _remove_tags(corpus: Corpus):
+    return lambda: [remove_tags(answer) for answer in corpus.annotated], len(corpus.annotated)
+
+@benchmark('tags.list_annotations', 'micro')
+def _list_annotations(corpus: Corpus):
+    return lambda: [list_annotations(answer, EXPECTED_TAGS) for answer in corpus.annotated], len(corpus.annotated)
+
+@benchmark('tags.parse_tags', 'micro')
+def _parse_tags(corpus: Corpus):
+    return lambda: [parse_tags(answer, EXPECTED_TAGS) for answer in corpus.annotated], len(corpus.annotated)
+
+@benchmark('projection.project_spans', 'micro')
+def _project_spans(corpus: Corpus):
+    """Projects the annotations of answers which dropped the space before every comma
+    onto the source texts."""
+    sources = [doc.text for doc in corpus.docs[0].get_docs(corpus.nlp.vocab)]
+    misaligned = [parse_tags(answer.replace(' ,', ','), EXPECTED_TAGS) for answer in corpus.annotated]
+    return lambda: [project_spans(parsed.text, source, parsed.annotations) for parsed, source in zip(misaligned, sources)], len(sources)
+
+@benchmark('fix_orthography', 'micro')
+def _fix_orthography(corpus: Corpus):
+    return lambda: [fix_orthography(answer) for answer in corpus.annotated], len(corpus.annotated)
+
+@benchmark('patterns.matches', 'micro')
+def _patterns(corpus: Corpus):
+    matcher = PatternMatcher.from_file()
+    texts = [doc.text for doc in corpus.docs[0].get_docs(corpus.nlp.vocab)]
+    return lambda: [matcher.matches(text) for text in texts], len(texts)
+
+@benchmark('replacement.Scorer.score', 'macro')
+def _replacement_scorer(corpus: Corpus):
+    doc_bin, answers = corpus.docs
+    return lambda: scoring.replacement.Scorer(corpus.nlp).score(doc_bin, answers), len(answers)
+
+@benchmark('annotation.Scorer', 'macro')
+def _annotation_scorer(corpus: Corpus):
+    """Adds the examples and scores them in every variant (which replaced splitting and
+    relabelling the examples for each variant). The examples are copied in every run, so
+    no run reuses the alignments of another."""
+    def score():
+        scorer = scoring.annotation.Scorer(corpus.nlp, has_ner=True)
+        for example in corpus.examples:
+            scorer.add(spacy.training.Example(example.predicted, example.reference))
+        return scorer.variants()
+    return score, len(corpus.examples)
+
+@benchmark('stats.bootstrap', 'macro')
+def _bootstrap(corpus: Corpus):
+    """Resamples the per-document counts of the annotate-mode scorer."""
+    scorer = scoring.annotation.Scorer(corpus.nlp, has_ner=True)
+    for example in corpus.examples:
+        scorer.add(example)
+    counts = scoring.stats.load_counts({'document_counts': scorer.document_counts()})
+    return lambda: scoring.stats.bootstrap(counts, resamples=corpus.args.resamples), len(corpus.examples)
+
+@benchmark('SpacyModel.predict', 'macro')
+def _spacy_model(corpus: Corpus):
+    if not spacy.util.is_package('nb_core_news_lg'):
+        raise Skipped('nb_core_news_lg is not installed')
+    import models.spacy
+    model = models.spacy.SpacyModel()
+    doc_bin = corpus.docs[0]
+    return lambda: model.predict(doc_bin, corpus.nlp, 'annotate'), len(doc_bin)
+
+@benchmark('loader.n2c2-2006', 'macro')
+def _n2c2_2006(corpus: Corpus):
+    directory = corpus.n2c2 / '2006'
+    return lambda: datasets.loaders.n2c2.load_2006(corpus.nlp, directory, 'train', cache_directory=None), corpus.args.documents
+
+@benchmark('loader.n2c2-2014', 'macro')
+def _n2c2_2014(corpus: Corpus):
+    directory = corpus.n2c2 / '2014'
+    return lambda: datasets.loaders.n2c2.load_2014(corpus.nlp, directory, 'train', cache_directory=None), 2 * corpus.args.documents
+
+@benchmark('loader.norsynth', 'macro')
+def _norsynth(corpus: Corpus):
+    if not os.path.exists(datasets.loaders.norsynth.SOURCE_PATH):
+        raise Skipped(f'{datasets.loaders.norsynth.SOURCE_PATH} is missing')
+    documents = len(datasets.loaders.norsynth.load_norsynth(corpus.nlp.vocab, None))
+    return lambda: datasets.loaders.norsynth.load_norsynth(corpus.nlp.vocab, None), documents
+
+@benchmark('loader.synthdeid', 'macro')
+def _synthdeid(corpus: Corpus):
+    if not os.path.exists('datasets/nor-deid-synthdata/holdout.spacy'):
+        raise Skipped('datasets/nor-deid-synthdata/holdout.spacy is missing')
+    documents = len(datasets.loaders.synthdeid.load_synthdeid(corpus.nlp.vocab, 'holdout', None))
+    return lambda: datasets.loaders.synthdeid.load_synthdeid(corpus.nlp.vocab, 'holdout', None), documents
+
+@benchmark('loader.dataset_cache', 'macro')
+def _dataset_cache(corpus: Corpus):
+    """Reads the synthetic documents back from the dataset cache."""
+    doc_bin = corpus.docs[0]
+    directory = str(corpus.directory / 'dataset_cache')
+    key = {'loader': 'benchmark', 'documents': len(doc_bin)}
+    datasets.loaders.cache.cached_docbin('benchmark', key, lambda: doc_bin, directory)
+    return lambda: datasets.loaders.cache.cached_docbin('benchmark', key, lambda: doc_bin, directory), len(doc_bin)
+
+def _installed_pipeline(name: str):
+    if not name.startswith('blank:') and not spacy.util.is_package(name) and not os.path.isdir(name):
+        raise Skipped(f'{name} is not installed')
+
+@benchmark('startup.tokenizer', 'macro')
+def _startup_tokenizer(corpus: Corpus):
+    """Loads the pipeline like eval.py does, with only its tokenizer (one load per run)."""
+    _installed_pipeline(corpus.args.pipeline)
+    return lambda: eval.load_pipeline(corpus.args.pipeline), 1
+
+@benchmark('startup.full_pipeline', 'macro')
+def _startup_full_pipeline(corpus: Corpus):
+    """Loads the pipeline with its ner component, as eval.py does for --fullPipeline."""
+    _installed_pipeline(corpus.args.pipeline)
+    return lambda: eval.load_pipeline(corpus.args.pipeline, full=True), 1
+
+def time_runs(fn: Callable[[], object], repeats: int) -> List[float]:
+    runs = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        runs.append(time.perf_counter() - start)
+    return runs
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'date': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpus': os.cpu_count(),
+        'spacy': spacy.__version__,
+        'numpy': np.__version__,
+    }
+
+def run_suite(args: BenchmarkArguments) -> dict:
+    """run_suite runs the benchmarks selected by args, and returns the results with the
+    scale of the corpus and the environment they ran in."""
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        corpus = Corpus(args, pathlib.Path(directory))
+        for name, (kind, setup) in BENCHMARKS.items():
+            if args.only and not any(name.startswith(prefix) for prefix in args.only):
+                continue
+            try:
+                fn, documents = setup(corpus)
+            except Skipped as skipped:
+                print(f"{name:<28} skipped: {skipped}")
+                results[name] = {'kind': kind, 'skipped': str(skipped)}
+                continue
+            runs = time_runs(fn, args.repeats)
+            best = min(runs)
+            results[name] = {
+                'kind': kind,
+                'documents': documents,
+                'seconds': best,
+                'median_seconds': statistics.median(runs),
+                'documents_per_second': documents / best if best > 0 else None,
+                'repeats': args.repeats,
+            }
+            print(f"{name:<28} {kind:<6} {best:>10.4f} {statistics.median(runs):>10.4f} {results[name]['documents_per_second'] or 0:>12.1f}")
+    scale = {'documents': args.documents, 'length': args.length, 'phi_density': args.phi_density, 'seed': args.seed}
+    return {'scale': scale, 'environment': environment(), 'results': results}
+
+def main(args: BenchmarkArguments):
+    print(f"{'benchmark':<28} {'kind':<6} {'best (s)':>10} {'median (s)':>10} {'docs/s':>12}")
+    suite = run_suite(args)
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+        with open(args.output, 'w', encoding='utf8') as output_file:
+            json.dump(suite, output_file, indent=2)
+
+if __name__ == '__main__':
+    args = BenchmarkArguments().parse_args()
+    main(args)
@@ -0,0 +1,94 @@
+"""
+synthetic.py
+Generates synthetic documents and model answers for the benchmarks.
+"""
+
+import random
+from typing import List, Tuple
+
+import spacy
+import spacy.training
+
+VOCABULARY = ['Pasienten', 'er', 'innlagt', 'på', 'siden', '.', ',', 'og', 'med', 'Ola', 'Olsen', '47', 'år']
+LABELS = ['First_Name', 'Last_Name', 'Location', 'Age', 'Date']
+
+def synthetic_pair(length: int, rng: random.Random) -> Tuple[List[str], List[str]]:
+    """synthetic_pair generates a source document and a response which
+    replaces, removes and inserts a few tokens, like a replace-mode answer."""
+    source = [rng.choice(VOCABULARY) for _ in range(length)]
+    response = []
+    for token in source:
+        roll = rng.random()
+        if roll < 0.05:
+            response.append('<First_Name>')
+        elif roll < 0.08:
+            continue
+        elif roll < 0.1:
+            response.extend([token, rng.choice(VOCABULARY)])
+        else:
+            response.append(token)
+    return source, response
+
+def synthetic_docbin(vocab: spacy.vocab.Vocab, documents: int, length: int, phi_density: float = 0.05, seed: int = 0) -> Tuple[spacy.tokens.DocBin, List[str]]:
+    """synthetic_docbin generates a DocBin of pre-tokenized documents where about
+    phi_density of the tokens are single-token entities, together with
+    replace-mode answers which replace most of the entities with a marker."""
+    rng = random.Random(seed)
+    doc_bin = spacy.tokens.DocBin()
+    answers = []
+    for _ in range(documents):
+        words = [rng.choice(VOCABULARY) for _ in range(length)]
+        doc = spacy.tokens.Doc(vocab, words=words)
+        ents = [spacy.tokens.Span(doc, i, i + 1, rng.choice(LABELS)) for i in range(length) if rng.random() < phi_density]
+        doc.set_ents(ents)
+        doc_bin.add(doc)
+
+        answer = []
+        for token in doc:
+            if token.ent_type_ != "" and rng.random() < 0.9:
+                answer.append(f"<{token.ent_type_}>")
+            elif rng.random() < 0.02:
+                continue
+            else:
+                answer.append(token.text)
+        answers.append(' '.join(answer))
+    return doc_bin, answers
+
+def synthetic_examples(vocab: spacy.vocab.Vocab, documents: int, length: int, phi_density: float = 0.05,
+                       retokenized: float = 0.05, seed: int = 0) -> List[spacy.training.Example]:
+    """synthetic_examples generates annotate-mode answers for the documents of
+    synthetic_docbin: the predictions miss, relabel and invent a few entities,
+    and a fraction of them are tokenized differently from the reference."""
+    rng = random.Random(seed)
+    doc_bin, _ = synthetic_docbin(vocab, documents, length, phi_density, seed)
+    examples = []
+    for reference in doc_bin.get_docs(vocab):
+        predicted = spacy.tokens.Doc(vocab, words=[token.text for token in reference])
+        ents = []
+        for ent in reference.ents:
+            roll = rng.random()
+            if roll < 0.1:
+                continue
+            ents.append(spacy.tokens.Span(predicted, ent.start, ent.end, rng.choice(LABELS) if roll < 0.15 else ent.label_))
+        ents += [spacy.tokens.Span(predicted, i, i + 1, rng.choice(LABELS)) for i in range(length) if rng.random() < phi_density / 10]
+        predicted.set_ents(spacy.util.filter_spans(ents))
+        if rng.random() < retokenized:
+            with predicted.retokenize() as retokenizer:
+                retokenizer.merge(predicted[0:2])
+        examples.append(spacy.training.Example(predicted, reference))
+    return examples
+
+def synthetic_annotated(vocab: spacy.vocab.Vocab, doc_bin: spacy.tokens.DocBin) -> List[str]:
+    """synthetic_annotated returns annotate-mode answers for the documents of doc_bin
+    as the LLM backends get them back: the text with every entity enclosed in tags
+    of its label, e.g. '<Age>47</Age>'."""
+    answers = []
+    for doc in doc_bin.get_docs(vocab):
+        parts, position = [], 0
+        for ent in doc.ents:
+            parts.append(doc.text[position:ent.start_char])
+            parts.append(f'<{ent.label_}>{ent.text}</{ent.label_}>')
+            position = ent.end_char
+        parts.append(doc.text[position:])
+        answers.append(''.join(parts))
+    return answers
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+tags.py
+Compares reading annotate-mode answers with parse_tags in
+models.utilities.tags (one scan for the text, the annotations and the
+malformed tags) with the previous path in the API backends (remove_tags
+for the alignment check, again for logging, and list_annotations), on
+long n2c2-style answers. The texts and annotations are checked to be
+equal.
+
+Run from the repository root:
+    python -m benchmarks.tags --documents 200 --lengths 500 2000 5000
+"""
+
+from typing import List
+
+from tap import Tap
+import spacy
+
+from benchmarks.alignment import time_best
+from benchmarks.suite import EXPECTED_TAGS
+from benchmarks.synthetic import synthetic_annotated, synthetic_docbin
+from models.utilities.tags import list_annotations, parse_tags, remove_tags
+
+class BenchmarkArguments(Tap):
+    documents: int = 200
+    """Number of synthetic answers"""
+    lengths: List[int] = [500, 2000, 5000]
+    """Tokens per answer"""
+    phi_density: float = 0.05
+    """Fraction of the tokens which are annotated"""
+    repeats: int = 5
+    """How many times to time each parser; the fastest run is reported"""
+    seed: int = 0
+    """Seed for the synthetic answers"""
+
+def previous_parse(answer: str, source: str):
+    """previous_parse is what the API backends did with each answer before parse_tags."""
+    misaligned = remove_tags(answer) != source
+    returned = remove_tags(answer)
+    return returned, list_annotations(answer, EXPECTED_TAGS), misaligned
+
+def main(args: BenchmarkArguments):
+    vocab = spacy.blank('nb').vocab
+    print(f"{'tokens':>8} {'regex (s)':>10} {'parse_tags (s)':>15} {'speedup':>8}")
+    for length in args.lengths:
+        doc_bin, _ = synthetic_docbin(vocab, args.documents, length, args.phi_density, args.seed)
+        sources = [doc.text for doc in doc_bin.get_docs(vocab)]
+        answers = synthetic_annotated(vocab, doc_bin)
+        for answer, source in zip(answers, sources):
+            returned, annotations, _ = previous_parse(answer, source)
+            parsed = parse_tags(answer, EXPECTED_TAGS)
+            assert (parsed.text, parsed.annotations) == (returned, annotations), 'parse_tags differs from the regular expressions'
+        previous = time_best(lambda: [previous_parse(answer, source) for answer, source in zip(answers, sources)], args.repeats)
+        single = time_best(lambda: [parse_tags(answer, EXPECTED_TAGS) for answer in answers], args.repeats)
+        print(f"{length:>8} {previous:>10.4f} {single:>15.4f} {previous / single:>7.1f}x")
+
+if __name__ == '__main__':
+    args = BenchmarkArguments().parse_args()
+    main(args)
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+compare_runs.py
+Compares the scores of two eval.py runs on the same dataset, from the
+per-document counts in their --output files: the bootstrap confidence
+interval of every score in both runs and of their difference, and the
+approximate randomization p-value of the difference.
+
+    python eval.py --prompt_path prompts/null.txt --mode annotate --model spacy --output results/spacy-annotate.json
+    python eval.py --prompt_path prompts/gpt_annotate.txt --mode annotate --model gpt-chat --modelName gpt-4 --openAIKey $OPENAI_KEY --output results/gpt-4-annotate.json
+    python compare_runs.py results/spacy-annotate.json results/gpt-4-annotate.json
+
+The result files bundled with the harness in results/ were written before the
+per-document counts were added, so they cannot be compared.
+"""
+
+import json
+import sys
+
+from tap import Tap
+
+import scoring.stats
+
+class CompareArguments(Tap):
+    a: str
+    """The results of the first run"""
+    b: str
+    """The results of the second run, which is compared to the first"""
+    variant: str = None
+    """In annotate mode, compare the entities scored as in this variant (default: the reported scores)"""
+    resamples: int = 10000
+    """Number of bootstrap and randomization resamples"""
+    confidence: float = 0.95
+    """Confidence level of the intervals"""
+    seed: int = 0
+    """Seed for the resamples"""
+    output: str = None
+    """JSON file to write the comparison to"""
+
+    def configure(self):
+        self.add_argument('a')
+        self.add_argument('b')
+
+def load_results(path: str, variant: str = None) -> scoring.stats.DocumentCounts:
+    with open(path, 'r', encoding="utf8") as results_file:
+        return scoring.stats.load_counts(json.load(results_file), variant)
+
+def main(args: CompareArguments):
+    try:
+        a = load_results(args.a, args.variant)
+        b = load_results(args.b, args.variant)
+        comparison = scoring.stats.compare(a, b, args.resamples, args.confidence, args.seed)
+    except (KeyError, ValueError) as e:
+        # e.g. results without per-document counts, or runs in different modes
+        sys.exit(f"Cannot compare {args.a} and {args.b}: {e.args[0]}")
+
+    percent = f"{args.confidence:.0%}"
+    print(f"a: {args.a}\nb: {args.b}")
+    print(f"{'score':<40} {'a':>8} {percent + ' CI':>17} {'b':>8} {percent + ' CI':>17} {'b - a':>8} {percent + ' CI':>17} {'p':>7}")
+    for name, row in comparison.items():
+        print(f"{name:<40} {row['a']:>8.4f} {_interval(row['a_ci']):>17} {row['b']:>8.4f} {_interval(row['b_ci']):>17} "
+              f"{row['difference']:>+8.4f} {_interval(row['difference_ci']):>17} {row['p']:>7.4f}")
+
+    if args.output:
+        with open(args.output, 'w', encoding="utf8") as outfile:
+            json.dump(comparison, outfile)
+
+def _interval(interval) -> str:
+    return f"[{interval[0]:.4f}, {interval[1]:.4f}]"
+
+if __name__ == '__main__':
+    args = CompareArguments().parse_args()
+    main(args)
@@ -0,0 +1,98 @@
+"""
+cache.py
+Implements a cache of preprocessed datasets, so that the loaders only parse,
+tokenize and relabel a dataset once, and later loads read the final DocBin
+from a single file.
+
+Each cached DocBin is keyed on a fingerprint of the source files (their
+paths, sizes and modification times), the version of spaCy and of the
+tokenizer used, the label mapping and the version of the loader, so any
+change to them gives a new entry rather than a stale one. Writing a new
+entry for a dataset removes its older entries.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import re
+from typing import Callable, Iterable, List, Optional, Union
+
+import spacy
+import spacy.tokens
+
+from models.utilities.perf import count, timer
+
+CACHE_DIRECTORY = '.cache/datasets'
+
+PathLike = Union[str, pathlib.Path]
+
+def source_fingerprint(paths: Iterable[PathLike]) -> List[list]:
+    """source_fingerprint describes the source files of a dataset by their paths, sizes
+    and modification times. Directories are described by all the files in them."""
+    files = []
+    for path in paths:
+        path = pathlib.Path(path)
+        if path.is_dir():
+            files.extend(sorted(child for child in path.rglob('*') if child.is_file()))
+        else:
+            files.append(path)
+    fingerprint = []
+    for path in files:
+        stat = path.stat()
+        fingerprint.append([path.as_posix(), stat.st_size, stat.st_mtime_ns])
+    return fingerprint
+
+def tokenizer_fingerprint(nlp: spacy.language.Language) -> dict:
+    """tokenizer_fingerprint describes the tokenizer of a pipeline, for loaders which
+    tokenize raw text with nlp.make_doc."""
+    return {
+        'lang': nlp.lang,
+        'pipeline': f"{nlp.meta.get('name')}-{nlp.meta.get('version')}",
+        'tokenizer': hashlib.sha256(nlp.tokenizer.to_bytes(exclude=['vocab'])).hexdigest(),
+    }
+
+def fingerprint(key: dict) -> str:
+    """fingerprint hashes the key of a dataset, along with the version of spaCy."""
+    content = json.dumps({'spacy': spacy.__version__, **key}, sort_keys=True, default=str)
+    return hashlib.sha256(content.encode('utf8')).hexdigest()
+
+def cached_docbin(name: str, key: dict, build: Callable[[], spacy.tokens.DocBin], directory: Optional[str] = CACHE_DIRECTORY) -> spacy.tokens.DocBin:
+    """cached_docbin returns the DocBin stored for name and key in directory, or builds it
+    and stores it there, removing the entries stored for name with other keys. If directory
+    is None, the DocBin is always built."""
+    if directory is None:
+        with timer('dataset.build'):
+            return build()
+    path = pathlib.Path(directory) / f'{name}-{fingerprint(key)[:16]}.spacy'
+    if path.exists():
+        logging.debug(f'Loading preprocessed dataset from {path}')
+        count('dataset_cache.hits')
+        with timer('dataset.read_cache'):
+            return spacy.tokens.DocBin().from_disk(path)
+    count('dataset_cache.misses')
+    with timer('dataset.build'):
+        doc_bin = build()
+    os.makedirs(directory, exist_ok=True)
+    # Write to a temporary file first, so an interrupted run never leaves a partial entry
+    temporary = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+    with timer('dataset.write_cache'):
+        doc_bin.to_disk(temporary)
+    os.replace(temporary, path)
+    logging.debug(f'Saved preprocessed dataset to {path}')
+    _remove_stale_entries(pathlib.Path(directory), name, path)
+    return doc_bin
+
+def _remove_stale_entries(directory: pathlib.Path, name: str, current: pathlib.Path):
+    """_remove_stale_entries removes the entries for name other than current, which were
+    stored for sources, tokenizers or loaders which have since changed."""
+    entry = re.compile(re.escape(name) + r'-[0-9a-f]{16}\.spacy')
+    for path in directory.iterdir():
+        if path != current and entry.fullmatch(path.name):
+            logging.debug(f'Removing stale preprocessed dataset {path}')
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                # Removed by another process at the same time
+                pass
@@ -4,9 +4,10 @@ Implements the logic to load the 2006 and 2014 n2c2 challenge datasets
 as spaCy DocBins.
 """
 
+import concurrent.futures
 import logging
 import pathlib
-from typing import Literal
+from typing import Iterable, Iterator, List, Literal, Optional, Tuple
 import os
 import linecache 
 
@@ -14,6 +15,11 @@ import xml.etree.ElementTree as ET
 
 import spacy
 
+from datasets.loaders.cache import CACHE_DIRECTORY, cached_docbin, source_fingerprint, tokenizer_fingerprint
+
+# Bump to invalidate the cached datasets when the loading logic changes
+LOADER_VERSION = 2
+
 # Version 2 of the 2006 training set has an error on line 25722
 # which makes the XML malformed.
 # See fix_2006_training_set.
@@ -22,54 +28,67 @@ PATCH_LINE_INDEX = 25722
 # with a closing tag:
 PATCH_FIX = ('<PHI TYPE="DOCTOR">', '</PHI>')
 
-def load_2006(nlp: spacy.language.Language, directory: str = 'datasets/n2c2/2006/', split: Literal['train', 'test'] = 'test') -> spacy.tokens.DocBin:
-    """load_2006 returns the n2c2 2006 deidentification challenge dataset as a spaCy DocBin."""
+# How many 2014 documents each worker process parses and tokenizes per task
+CHUNK_SIZE = 32
+
+# A span of PHI as (start character, end character, type)
+Span = Tuple[int, int, str]
+
+def load_2006(nlp: spacy.language.Language, directory: str = 'datasets/n2c2/2006/', split: Literal['train', 'test'] = 'test',
+              cache_directory: Optional[str] = CACHE_DIRECTORY) -> spacy.tokens.DocBin:
+    """load_2006 returns the n2c2 2006 deidentification challenge dataset as a spaCy DocBin.
+    The parsed and tokenized dataset is cached in cache_directory (see datasets.loaders.cache)."""
     if split == 'test':
         path = pathlib.Path(directory) / 'deid_surrogate_test_all_groundtruth_version2' / 'deid_surrogate_test_all_groundtruth_version2.xml'
-        return load_2006_from_file(path, nlp)
+        build = lambda: load_2006_from_file(path, nlp)
     elif split == 'train': 
         path = pathlib.Path(directory) / 'deid_surrogate_train_all_version2' / 'deid_surrogate_train_all_version2.xml'
-        error_line = linecache.getline(str(path), PATCH_LINE_INDEX)
-        if PATCH_FIX[0] in error_line:
-            fixed_path = pathlib.Path(directory) / 'deid_surrogate_train_all_version2' / 'deid_surrogate_train_all_version2_fixed.xml.tmp'
-            logging.debug(f'Malformed XML in training set, patching and saving fixed version to {fixed_path}')
-            fix_2006_training_set(path, fixed_path)
-            return load_2006_from_file(fixed_path, nlp)
-        else:
-            return load_2006_from_file(path, nlp)
+        build = lambda: _load_2006_training_set(path, nlp)
+    else:
+        raise ValueError(f"Unknown dataset split '{split}' in n2c2 2006")
+    key = {'loader': 'n2c2-2006', 'version': LOADER_VERSION, 'sources': source_fingerprint([path]), 'tokenizer': tokenizer_fingerprint(nlp)}
+    return cached_docbin(f'n2c2-2006-{split}', key, build, cache_directory)
+
+def _load_2006_training_set(path: pathlib.Path, nlp: spacy.language.Language) -> spacy.tokens.DocBin:
+    error_line = linecache.getline(str(path), PATCH_LINE_INDEX)
+    if PATCH_FIX[0] in error_line:
+        logging.debug(f'Malformed XML in training set, patching line {PATCH_LINE_INDEX} while parsing')
+        with open(path, 'r', encoding='utf8') as source_file:
+            return _load_2006_from_lines(patch_2006_lines(source_file), nlp)
+    else:
+        return load_2006_from_file(path, nlp)
+
+def patch_2006_lines(lines: Iterable[str]) -> Iterator[str]:
+    """patch_2006_lines yields the lines of version 2 of the n2c2 2006 challenge training
+    set, with the line which makes the XML malformed fixed: the last PHI marker on the
+    line, which should have closed the one before it, is replaced with a closing tag."""
+    for i, line in enumerate(lines):
+        if i == PATCH_LINE_INDEX - 1:
+            logging.debug(f"Patching line {PATCH_LINE_INDEX}...")
+            before, marker, after = line.rpartition(PATCH_FIX[0])
+            if marker:
+                line = before + PATCH_FIX[1] + after
+        yield line
 
 def fix_2006_training_set(source: pathlib.Path, target: pathlib.Path):
     """fix_2006_training_set patches version 2 of the n2c2 2006 challenge training set
-    to make the XML well-formed, saving the fixed version in target."""
+    to make the XML well-formed, saving the fixed version in target. (load_2006 patches
+    the training set while parsing it instead.)"""
     if os.path.exists(target):
         logging.debug("Patched version already exists.")
         return
     with open(target, 'w', encoding='utf8') as target_file:
         with open(source, 'r', encoding='utf8') as source_file:
-            for i, line in enumerate(source_file.readlines()):
-                if i == PATCH_LINE_INDEX - 1:
-                    logging.debug(f"Patching line {PATCH_LINE_INDEX}...")
-                    fixed_line = line.replace(PATCH_FIX[0], PATCH_FIX[1])
-                    target_file.write(fixed_line)
-                else:
-                    target_file.write(line)
-
+            target_file.writelines(patch_2006_lines(source_file))
 
 def load_2006_from_file(path: pathlib.Path, nlp: spacy.language.Language) -> spacy.tokens.DocBin:
     """load_2006 returns a file from the n2c2 2006 deidentification challenge dataset as a spaCy DocBin."""
-    xml_tree = ET.parse(path)
-    records = xml_tree.findall('RECORD')
+    with open(path, 'r', encoding='utf8') as source_file:
+        return _load_2006_from_lines(source_file, nlp)
+
+def _load_2006_from_lines(lines: Iterable[str], nlp: spacy.language.Language) -> spacy.tokens.DocBin:
     doc_bin = spacy.tokens.DocBin()
-    for record in records:
-        contents = ""
-        spans = []
-        text_elem = record.find('TEXT')
-        for elem in text_elem.iter():
-            cleaned_text = elem.text.replace('\n', ' ')
-            if elem.tag == 'PHI':
-                spans.append((len(contents), len(contents) + len(cleaned_text), elem.attrib['TYPE']))
-            contents += cleaned_text
-            contents += elem.tail.replace('\n', ' ')
+    for contents, spans in iter_2006_records(lines):
         doc = nlp.make_doc(contents)
         # TODO: How do we handle the case where dates are only partly covered?
         ents = [doc.char_span(s[0], s[1], label=s[2], alignment_mode='expand') for s in spans]
@@ -77,43 +96,111 @@ def load_2006_from_file(path: pathlib.Path, nlp: spacy.language.Language) -> spa
         doc_bin.add(doc)
     return doc_bin
 
-def load_2014(nlp: spacy.language.Language, directory: str = 'datasets/n2c2/2014/', split: Literal['train', 'test'] = 'test') -> spacy.tokens.DocBin:
+def iter_2006_records(lines: Iterable[str]) -> Iterator[Tuple[str, List[Span]]]:
+    """iter_2006_records parses the records of the n2c2 2006 challenge XML as it is read,
+    yielding the text of each record with its PHI spans. Each record is dropped from the
+    tree once it has been read, so only one record is held at a time."""
+    parser = ET.XMLPullParser(events=('start', 'end'))
+    root = None
+    for line in lines:
+        parser.feed(line)
+        for event, elem in parser.read_events():
+            if event == 'start':
+                if root is None:
+                    root = elem
+            elif elem.tag == 'RECORD':
+                yield _2006_record(elem)
+                root.clear()
+    parser.close()
+
+def _2006_record(record: ET.Element) -> Tuple[str, List[Span]]:
+    parts = []
+    length = 0
+    spans = []
+    for elem in record.find('TEXT').iter():
+        cleaned_text = (elem.text or '').replace('\n', ' ')
+        if elem.tag == 'PHI':
+            spans.append((length, length + len(cleaned_text), elem.attrib['TYPE']))
+        cleaned_tail = (elem.tail or '').replace('\n', ' ')
+        parts.append(cleaned_text)
+        parts.append(cleaned_tail)
+        length += len(cleaned_text) + len(cleaned_tail)
+    return ''.join(parts), spans
+
+def load_2014(nlp: spacy.language.Language, directory: str = 'datasets/n2c2/2014/', split: Literal['train', 'test'] = 'test',
+              cache_directory: Optional[str] = CACHE_DIRECTORY, workers: int = None) -> spacy.tokens.DocBin:
+    """load_2014 returns the n2c2 2014 deidentification challenge dataset as a spaCy DocBin,
+    with the documents in the order of their file names. The documents are parsed and
+    tokenized in workers processes (by default, one per CPU). The parsed and tokenized
+    dataset is cached in cache_directory (see datasets.loaders.cache)."""
     if split == 'test':
-        test_set_path = pathlib.Path(directory) / 'testing-PHI-Gold-fixed/'
-        return _load_2014_from_folder(test_set_path, nlp)
+        paths = [pathlib.Path(directory) / 'testing-PHI-Gold-fixed/']
     elif split == 'train':
-        train_set1_path = pathlib.Path(directory) / 'training-PHI-Gold-Set1/'
-        set1 = _load_2014_from_folder(train_set1_path, nlp)
-        train_set2_path = pathlib.Path(directory) / 'training-PHI-Gold-Set2/'
-        set2 = _load_2014_from_folder(train_set2_path, nlp)
-        set1.merge(set2)
-        return set1
+        paths = [pathlib.Path(directory) / 'training-PHI-Gold-Set1/', pathlib.Path(directory) / 'training-PHI-Gold-Set2/']
     else:
         raise ValueError(f"Unknown dataset split '{split}' in n2c2 2014")
 
-def _load_2014_from_folder(path: pathlib.Path, nlp: spacy.language.Language) -> spacy.tokens.DocBin:
+    def build():
+        files = [path / name for path in paths for name in sorted(os.listdir(path)) if name.endswith('.xml')]
+        return _load_2014_from_files(files, nlp, workers)
+    key = {'loader': 'n2c2-2014', 'version': LOADER_VERSION, 'sources': source_fingerprint(paths), 'tokenizer': tokenizer_fingerprint(nlp)}
+    return cached_docbin(f'n2c2-2014-{split}', key, build, cache_directory)
+
+def _load_2014_from_files(files: List[pathlib.Path], nlp: spacy.language.Language, workers: int = None) -> spacy.tokens.DocBin:
+    """_load_2014_from_files loads the documents in files, in order. The files are split into
+    chunks which are loaded in worker processes, and the DocBins of the chunks are merged in
+    the order of the files."""
+    workers = min(workers or os.cpu_count() or 1, (len(files) + CHUNK_SIZE - 1) // CHUNK_SIZE)
+    if workers <= 1:
+        return _load_2014_chunk(files, nlp.tokenizer)
+    chunks = [files[i:i + CHUNK_SIZE] for i in range(0, len(files), CHUNK_SIZE)]
+    docs = spacy.tokens.DocBin()
+    # Only the tokenizer is sent to the workers, not the whole pipeline
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_init_2014_worker, initargs=(nlp.tokenizer,)) as pool:
+        for chunk in pool.map(_load_2014_chunk_bytes, chunks):
+            docs.merge(spacy.tokens.DocBin().from_bytes(chunk))
+    return docs
+
+_worker_tokenizer = None
+
+def _init_2014_worker(tokenizer):
+    global _worker_tokenizer
+    _worker_tokenizer = tokenizer
+
+def _load_2014_chunk_bytes(files: List[pathlib.Path]) -> bytes:
+    return _load_2014_chunk(files, _worker_tokenizer).to_bytes()
+
+def _load_2014_chunk(files: List[pathlib.Path], tokenizer) -> spacy.tokens.DocBin:
     docs = spacy.tokens.DocBin()
-    for doc_path in os.listdir(path):
-        if not doc_path.endswith('.xml'):
-            continue
-        full_path = path / doc_path
-        new_doc = _load_2014_from_document(full_path, nlp)
-        docs.add(new_doc)
+    for path in files:
+        docs.add(_load_2014_from_document(path, tokenizer))
     return docs
 
-def _load_2014_from_document(path: pathlib.Path, nlp: spacy.language.Language):
-    xml_tree = ET.parse(path)
-    root = xml_tree.getroot()
-    text = root.find('TEXT').text
-    doc = nlp.make_doc(text)
-    tags = root.find('TAGS')
+def _load_2014_from_document(path: pathlib.Path, tokenizer) -> spacy.tokens.Doc:
+    text, tags = _parse_2014_document(path)
+    doc = tokenizer(text)
     spans = []
-    for elem in tags.iter():
-        if elem.tag == 'TAGS':
-            continue
+    for start, end, label in tags:
         # TODO: How do we handle the case where dates are only partly covered?
-        span = doc.char_span(int(elem.attrib['start']), int(elem.attrib['end']), label=elem.attrib['TYPE'])
+        span = doc.char_span(start, end, label=label)
         if span is not None:
             spans.append(span)
     doc.set_ents(spans)
-    return doc
\ No newline at end of file
+    return doc
+
+def _parse_2014_document(path: pathlib.Path) -> Tuple[str, List[Span]]:
+    """_parse_2014_document reads the text and PHI tags of an n2c2 2014 document, clearing
+    each element once it has been read."""
+    text = None
+    tags = []
+    inside_tags = False
+    for event, elem in ET.iterparse(path, events=('start', 'end')):
+        if elem.tag == 'TAGS':
+            inside_tags = event == 'start'
+        elif event == 'end':
+            if elem.tag == 'TEXT':
+                text = elem.text
+            elif inside_tags:
+                tags.append((int(elem.attrib['start']), int(elem.attrib['end']), elem.attrib['TYPE']))
+            elem.clear()
+    return text, tags
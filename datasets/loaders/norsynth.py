@@ -5,30 +5,41 @@ as a spaCy DocBin.
 """
 
 import logging
-import os
+import tempfile
+from typing import Optional
+
 import spacy
 
-def load_norsynth(vocab) -> spacy.tokens.DocBin:
-    logging.debug(f'Converting CoNLL to SpaCy...')
-    if not os.path.exists('tmp/norsynth/reference_standard_annotated.spacy'):
-        os.makedirs('tmp/norsynth/', exist_ok=True)
-        spacy.cli.convert(
-            'datasets/NorSynthClinical-PHI/reference_standard_annotated.conll',
-            'tmp/norsynth/',
-            converter="conll",
-            file_type="spacy")
-    
+from datasets.loaders.cache import CACHE_DIRECTORY, cached_docbin, source_fingerprint
+
+# Bump to invalidate the cached dataset when the loading logic changes
+LOADER_VERSION = 1
+
+SOURCE_PATH = 'datasets/NorSynthClinical-PHI/reference_standard_annotated.conll'
+
+MAP_CATEGORIES = {
+    'Date_Part': 'Date',
+    'Date_Full': 'Date',
+    'Health_Care_Unit': 'Location'
+}
+
+def load_norsynth(vocab, cache_directory: Optional[str] = CACHE_DIRECTORY) -> spacy.tokens.DocBin:
+    """load_norsynth returns NorSynthClinical-PHI as a spaCy DocBin, with the labels mapped by
+    MAP_CATEGORIES. The converted and relabelled dataset is cached in cache_directory (see
+    datasets.loaders.cache)."""
     logging.debug(f'Retrieving NorSynthClinical-PHI...')
-    examples = spacy.tokens.DocBin().from_disk('tmp/norsynth/reference_standard_annotated.spacy')
-    map_categories = {
-        'Date_Part': 'Date',
-        'Date_Full': 'Date',
-        'Health_Care_Unit': 'Location'
-    }
-    mapped_label = lambda l: map_categories[l] if l in map_categories else l
+    key = {'loader': 'norsynth', 'version': LOADER_VERSION, 'sources': source_fingerprint([SOURCE_PATH]), 'labels': MAP_CATEGORIES}
+    return cached_docbin('norsynth', key, lambda: _convert_norsynth(vocab), cache_directory)
+
+def _convert_norsynth(vocab) -> spacy.tokens.DocBin:
+    logging.debug(f'Converting CoNLL to SpaCy...')
+    with tempfile.TemporaryDirectory() as directory:
+        spacy.cli.convert(SOURCE_PATH, directory, converter="conll", file_type="spacy")
+        examples = spacy.tokens.DocBin().from_disk(f'{directory}/reference_standard_annotated.spacy')
+    mapped_label = lambda l: MAP_CATEGORIES[l] if l in MAP_CATEGORIES else l
     fixed_docs = []
     for doc in examples.get_docs(vocab):
         fixed_labels = [spacy.tokens.span.Span(doc, s.start, s.end, mapped_label(s.label_)) for s in doc.ents]
         doc.set_ents(fixed_labels)
         fixed_docs.append(doc)
-    return spacy.tokens.DocBin(docs=fixed_docs)
\ No newline at end of file
+    return spacy.tokens.DocBin(docs=fixed_docs)
@@ -4,11 +4,24 @@ Implements the logic to load our synthetic dataset.
 """
 
 import logging
-import os
 import pathlib
+from typing import Optional
+
 import spacy
 
-def load_synthdeid(vocab, split = 'holdout') -> spacy.tokens.DocBin:
+from datasets.loaders.cache import CACHE_DIRECTORY, cached_docbin, source_fingerprint
+
+# Bump to invalidate the cached dataset when the loading logic changes
+LOADER_VERSION = 1
+
+MAP_CATEGORIES = {
+    'Health_Care_Unit': 'Location'
+}
+
+def load_synthdeid(vocab, split = 'holdout', cache_directory: Optional[str] = CACHE_DIRECTORY) -> spacy.tokens.DocBin:
+    """load_synthdeid returns a split of our synthetic dataset as a spaCy DocBin, with the labels
+    mapped by MAP_CATEGORIES. The relabelled dataset is cached in cache_directory (see
+    datasets.loaders.cache)."""
     logging.debug(f'Retrieving NorSynthClinical-PHI...')
     path = pathlib.Path('datasets/nor-deid-synthdata')
     if split == 'holdout':
@@ -19,14 +32,15 @@ def load_synthdeid(vocab, split = 'holdout') -> spacy.tokens.DocBin:
         path = path / 'training.spacy'
     else:
         raise ValueError(f"Unknown split {split}")
+    key = {'loader': 'synthdeid', 'version': LOADER_VERSION, 'sources': source_fingerprint([path]), 'labels': MAP_CATEGORIES}
+    return cached_docbin(f'synthdeid-{split}', key, lambda: _relabel(path, vocab), cache_directory)
+
+def _relabel(path: pathlib.Path, vocab) -> spacy.tokens.DocBin:
     examples = spacy.tokens.DocBin().from_disk(path)
-    map_categories = {
-        'Health_Care_Unit': 'Location'
-    }
-    mapped_label = lambda l: map_categories[l] if l in map_categories else l
+    mapped_label = lambda l: MAP_CATEGORIES[l] if l in MAP_CATEGORIES else l
     fixed_docs = []
     for doc in examples.get_docs(vocab):
         fixed_labels = [spacy.tokens.span.Span(doc, s.start, s.end, mapped_label(s.label_)) for s in doc.ents]
         doc.set_ents(fixed_labels)
         fixed_docs.append(doc)
-    return spacy.tokens.DocBin(docs=fixed_docs)
\ No newline at end of file
+    return spacy.tokens.DocBin(docs=fixed_docs)
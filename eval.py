@@ -1,20 +1,31 @@
 #!/usr/bin/env python3
 
+import cProfile
 import time
 import os
 import logging
+import pathlib
 import json
-from typing import List, Literal
+import random
+import sys
+from typing import List, Literal, Tuple
 
 from tap import Tap
 import spacy
-import spacy.scorer
 
+import datasets.loaders.cache
 import datasets.loaders.n2c2
 import datasets.loaders.norsynth
 import datasets.loaders.synthdeid
 
+import models.utilities.cache
+import models.utilities.journal
+import models.utilities.metrics
+import models.utilities.patterns
+import models.utilities.perf
+import scoring.annotation
 import scoring.replacement
+import scoring.stats
 
 logging.basicConfig(level=logging.DEBUG)
 
@@ -31,52 +42,407 @@ class ExperimentArguments(Tap):
     """The identifier/path to the model"""
     spacyPipeline: str = 'nb_core_news_sm'
     """The SpaCy Language to use for tokenization"""
+    fullPipeline: bool = False
+    """Whether to load the trained components of spacyPipeline, not only its tokenizer (none of the bundled models need them)"""
     openAIKey: str = 'OPENAI_KEY_HERE'
     """OpenAI key for comparison models"""
     output: str = None
     """Which file to write results to"""
     singleClass: bool = False
     """Whether all entities should be put in a single PHI class"""
+    anchoredThreshold: int = scoring.replacement.ANCHORED_THRESHOLD
+    """Documents longer than this (in tokens) are aligned with the linear-memory aligner in replace mode"""
+    workers: int = 1
+    """Number of processes to score replace-mode answers with"""
+    progressEvery: int = 100
+    """Log the scores so far every this many documents (0 to turn off)"""
+    progress: bool = False
+    """Whether to show the progress on a single line on stderr instead of logging every document"""
+    logLevel: str = None
+    """The level to log at (default: DEBUG, or INFO with --progress)"""
+    metricsPort: int = None
+    """If set, serve live metrics in the OpenMetrics text format at http://127.0.0.1:<metricsPort>/metrics while predicting"""
+    metricsFile: str = None
+    """If set, write live metrics in the OpenMetrics text format to this file while predicting (e.g. for the textfile collector of the Prometheus node exporter)"""
+    metricsInterval: float = 5.0
+    """How often to rewrite metricsFile, in seconds"""
+    maxInFlight: int = 8
+    """Maximum number of concurrent requests for API-backed models"""
+    requestsPerSecond: float = 5.0
+    """Maximum request rate for API-backed models (adapted to the API's rate limit headers)"""
+    batchTokenBudget: int = None
+    """If set, local HuggingFace models generate in length-sorted batches of at most this many tokens"""
+    promptLookupTokens: int = None
+    """If set, local HuggingFace models draft this many tokens at a time by copying from the prompt (needs transformers 4.37)"""
+    constrainToSource: bool = False
+    """Whether local HuggingFace models may only copy the source and add tags in annotate mode"""
+    spacyBatchSize: int = 64
+    """How many documents the spacy baseline processes at a time"""
+    spacyProcesses: int = 1
+    """How many processes the spacy baseline runs its pipeline in"""
+    spacyPatterns: str = models.utilities.patterns.PATTERNS_PATH
+    """YAML file with the regular expression rules of the spacy baseline"""
+    cachePath: str = models.utilities.cache.CACHE_PATH
+    """SQLite file to cache completions from API-backed models in"""
+    cacheMaxEntries: int = None
+    """Evict the least recently used cached completions beyond this many"""
+    cacheMaxAgeDays: float = None
+    """Evict cached completions older than this many days"""
+    datasetCache: str = datasets.loaders.cache.CACHE_DIRECTORY
+    """Directory to cache the preprocessed datasets in ('' to always load them from the source files)"""
+    journalPath: str = models.utilities.journal.JOURNAL_PATH
+    """SQLite file to journal every answer in as it arrives"""
+    resume: bool = False
+    """Whether to resume an interrupted run, only predicting the documents without a journaled answer"""
+    scoreOnly: bool = False
+    """Whether to only score the journaled answers of an earlier run, without loading the model"""
+    sequential: bool = False
+    """Whether to predict the documents in random order, stopping once the confidence interval of targetMetric is narrower than targetWidth"""
+    targetMetric: str = None
+    """The score whose confidence interval decides when to stop with --sequential (default: ents_f in annotate mode, f1 in replace mode)"""
+    targetWidth: float = 0.05
+    """Stop a --sequential run once the confidence interval of targetMetric is narrower than this"""
+    maxDocuments: int = None
+    """Stop a --sequential run after this many documents, however wide the confidence interval"""
+    minDocuments: int = 30
+    """Always score at least this many documents before stopping a --sequential run"""
+    checkEvery: int = 10
+    """Check whether to stop a --sequential run every this many documents"""
+    confidence: float = 0.95
+    """Confidence level of the interval used by --sequential"""
+    resamples: int = 1000
+    """Number of bootstrap resamples used by --sequential"""
+    seed: int = 0
+    """Seed for the document order and resamples of --sequential"""
+    perfTrace: str = None
+    """Write every timed stage of the run to this file as a Chrome trace (see chrome://tracing)"""
+    profile: str = None
+    """Profile the run with cProfile and write the stats to this file (read them with pstats)"""
+
+    def process_args(self):
+        if self.checkEvery < 1:
+            raise ValueError("--checkEvery must be at least 1")
 
 def main(args: ExperimentArguments):
+    logging.getLogger().setLevel(args.logLevel.upper() if args.logLevel else logging.INFO if args.progress else logging.DEBUG)
+    models.utilities.perf.reset(trace=args.perfTrace is not None)
+    if args.profile is None:
+        return run(args)
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(run, args)
+    finally:
+        profiler.dump_stats(args.profile)
+
+def run(args: ExperimentArguments):
     with open(args.prompt_path, 'r', encoding="utf-8") as prompt_file:
         logging.debug(f'Using prompt {args.prompt_path}')
         prompt = prompt_file.read()
 
     logging.debug(f'Loading pipeline {args.spacyPipeline}')
-    nlp = spacy.load(args.spacyPipeline, enable=['ner'])
+    with models.utilities.perf.timer('eval.load_pipeline'):
+        nlp = load_pipeline(args.spacyPipeline, args.fullPipeline)
     
-    logging.debug(f'Loading model {args.model}')
-    model = load_model(args.model, prompt, args)
+    model = None
+    if not args.scoreOnly:
+        logging.debug(f'Loading model {args.model}')
+        with models.utilities.perf.timer('eval.load_model'):
+            model = load_model(args.model, prompt, args)
 
     logging.debug(f'Loading dataset {args.dataset}')
-    doc_bin = load_dataset(args.dataset, nlp)
+    with models.utilities.perf.timer('eval.load_dataset'):
+        doc_bin = load_dataset(args.dataset, nlp, args.datasetCache or None)
 
     if args.dataset in ['n2c2-2006', 'n2c2-2014'] and args.model in ['gpt-turbo-chat', 'davinci-edit']:
         raise ValueError("The N2C2 datasets cannot be shared with third parties.")
-    
-    logging.debug(f'Predicting...')
-    answers = model.predict(doc_bin, nlp, args.mode)
 
-    print(f"Results for model {args.model} on dataset {args.dataset}:")
+    evaluate(args, prompt, nlp, model, doc_bin)
+
+def evaluate(args: ExperimentArguments, prompt: str, nlp: spacy.language.Language, model, doc_bin: spacy.tokens.DocBin) -> dict:
+    """evaluate predicts and scores a loaded dataset with a loaded model, as set up by args,
+    writing the results to args.output. The pipeline, model and dataset can be shared
+    between calls (see run_experiments.py). With args.scoreOnly, the model is not used
+    and only the journaled answers are scored.
+
+    In annotate mode, the entities are scored in every variant in scoring.annotation.VARIANTS,
+    which are written under 'variants'. The top-level scores are the single class variant
+    with args.singleClass, and the per-label variant otherwise.
+
+    What models.utilities.perf recorded since it was last reset (see main) is written under
+    'perf', along with the throughput of the predicted documents."""
     if args.mode == 'annotate':
-        scorer = spacy.scorer.Scorer(nlp)
+        # The pipeline may only have its tokenizer, but the entities are always scored
+        scorer = scoring.annotation.Scorer(nlp, has_ner=True)
+        variant = scoring.annotation.SINGLE_CLASS_VARIANT if args.singleClass else scoring.annotation.DEFAULT_VARIANT
         if args.singleClass:
-            logging.debug("Putting all entities in the PHI class.")
-            answers = [_split_example(a) for a in _all_answers_to_label(answers, nlp, 'PHI')]
-        evaluation = scorer.score(answers)
-        print(evaluation)
+            logging.debug("Reporting the scores with all entities in the PHI class.")
     elif args.mode == 'replace':
-        scorer = scoring.replacement.Scorer(nlp)
-        evaluation = scorer.score(doc_bin, answers)
-        print(evaluation)
+        scorer = scoring.replacement.Scorer(nlp, args.anchoredThreshold, args.workers)
     else:
         logging.error(f"Unknown mode {args.mode}")
         return
+
+    # The index in the dataset of each scored answer, in the order they were scored
+    scored_indices = []
+    journal = models.utilities.journal.PredictionJournal(args.journalPath, journal_key(args, prompt), {
+        'dataset': args.dataset, 'model': args.model, 'modelName': args.modelName, 'prompt_path': args.prompt_path, 'mode': args.mode})
+    if args.resume or args.scoreOnly:
+        completed = journal.read_all()
+        if args.scoreOnly and not completed:
+            raise ValueError(f"There are no journaled answers for {args.model} on {args.dataset} in {args.journalPath}")
+        if not completed:
+            logging.warning(f"There are no journaled answers to resume for {args.model} on {args.dataset} in {args.journalPath} "
+                            f"(see JOURNAL_ARGUMENTS in eval.py for the settings a run is resumed on), predicting every document")
+        logging.debug(f'Resuming from {len(completed)} journaled answers')
+        # Score the journaled answers, and only predict the documents without one
+        remaining = spacy.tokens.DocBin(store_user_data=True)
+        remaining_indices = []
+        for i, doc in enumerate(doc_bin.get_docs(nlp.vocab)):
+            entry = completed.pop(i, None)
+            if entry is not None and entry.text_hash == models.utilities.cache.content_hash(doc.text):
+                with models.utilities.perf.timer('eval.score'):
+                    _add_answer(scorer, doc, entry.decode(nlp.vocab), args)
+                scored_indices.append(i)
+            else:
+                remaining.add(doc)
+                remaining_indices.append(i)
+        doc_bin = remaining
+    else:
+        journal.clear()
+        remaining_indices = range(len(doc_bin))
+
+    sequential = None
+    if args.sequential and not args.scoreOnly:
+        sequential = SequentialStop(scorer, args, variant if args.mode == 'annotate' else None, len(scored_indices) + len(doc_bin))
+        doc_bin, remaining_indices = _shuffled(doc_bin, list(remaining_indices), nlp.vocab, args.seed)
+
+    throughput = None
+    if args.scoreOnly:
+        if len(doc_bin) > 0:
+            logging.warning(f'{len(doc_bin)} documents have no journaled answer and are not scored')
+    else:
+        logging.debug(f'Predicting...')
+        total = len(scored_indices) + len(doc_bin)
+        if sequential is not None and args.maxDocuments is not None:
+            total = min(total, args.maxDocuments)
+        progress = models.utilities.metrics.Progress(total, len(scored_indices), sys.stderr if args.progress else None)
+        exporter = None
+        if args.metricsPort is not None or args.metricsFile:
+            exporter = models.utilities.metrics.MetricsExporter(progress, args.metricsPort, args.metricsFile or None, args.metricsInterval)
+        # Answers are scored as they arrive, so only a window of them is held at a time.
+        # The latency is the time spent waiting for each answer, so for backends which
+        # predict several documents at once it is spread over the answers.
+        predicted_documents, predicted_tokens = 0, 0
+        predicting = time.perf_counter()
+        start = predicting
+        predictions = model.predict_iter(doc_bin, nlp, args.mode)
+        if sequential is not None and sequential.done():
+            predictions = iter(())
+        try:
+            for i, (doc, answer) in zip(remaining_indices, predictions):
+                latency = time.perf_counter() - start
+                models.utilities.perf.add_time('eval.predict', start, latency)
+                models.utilities.perf.observe('eval.document_latency', latency)
+                predicted_documents += 1
+                predicted_tokens += len(doc)
+                with models.utilities.perf.timer('eval.journal'):
+                    journal.add(i, doc.text, answer, latency)
+                with models.utilities.perf.timer('eval.score'):
+                    _add_answer(scorer, doc, answer, args)
+                scored_indices.append(i)
+                progress.update(len(scored_indices))
+                if args.progressEvery and scorer.documents % args.progressEvery == 0:
+                    logging.info(f"Scores after {scorer.documents} documents: {scorer.scores(wait=False)}")
+                if sequential is not None and sequential.done():
+                    break
+                start = time.perf_counter()
+        finally:
+            # Stop the model from predicting the documents after the last one used
+            if hasattr(predictions, 'close'):
+                predictions.close()
+            progress.close()
+            if exporter is not None:
+                exporter.close()
+        predicting = time.perf_counter() - predicting
+        throughput = {
+            'documents': predicted_documents,
+            'tokens': predicted_tokens,
+            'seconds': predicting,
+            'documents_per_second': predicted_documents / predicting if predicting > 0 else None,
+            'tokens_per_second': predicted_tokens / predicting if predicting > 0 else None,
+        }
+    journal.close()
+
+    cache = getattr(model, 'cache', None)
+    if cache is not None:
+        print(f"Completion cache: {cache.stats()}")
+
+    print(f"Results for model {args.model} on dataset {args.dataset}:")
+    with models.utilities.perf.timer('eval.score'):
+        if args.mode == 'annotate':
+            evaluation = scorer.scores(variant=variant)
+            evaluation['variants'] = scorer.variants()
+        else:
+            evaluation = scorer.scores()
+    if sequential is not None:
+        evaluation['sequential'] = sequential.report()
+        print(f"Scored {scorer.documents} of {sequential.total} documents ({evaluation['sequential']['stopped']})")
+    print(evaluation)
+
+    # The per-document counts are written to the output file only, for compare_runs.py
+    if args.mode == 'annotate':
+        evaluation['document_counts'] = _in_dataset_order(scorer.document_counts(variant), scored_indices)
+        for name, scores in evaluation['variants'].items():
+            scores['document_counts'] = _in_dataset_order(scorer.document_counts(name), scored_indices)
+    else:
+        evaluation['document_counts'] = _in_dataset_order(scorer.document_counts(), scored_indices)
+
+    evaluation['perf'] = {**models.utilities.perf.report(), 'throughput': throughput}
+    stages = evaluation['perf']['stages']
+    print("Time per stage: " + ', '.join(f"{name} {stage['seconds']:.2f}s" for name, stage in stages.items() if name.startswith('eval.')))
+    if args.perfTrace:
+        models.utilities.perf.write_trace(args.perfTrace)
     
     if args.output:
         with open(args.output, 'w', encoding="utf8") as outfile:
             json.dump(evaluation, outfile)
+    return evaluation
+
+def _add_answer(scorer, doc: spacy.tokens.Doc, answer, args: ExperimentArguments):
+    if args.mode == 'annotate':
+        scorer.add(answer)
+    else:
+        scorer.add(doc, answer)
+
+class SequentialStop:
+    """SequentialStop decides when a --sequential run has scored enough documents: once
+    the bootstrap confidence interval of the target metric (see scoring.stats) is
+    narrower than args.targetWidth, or args.maxDocuments have been scored. The interval
+    is computed every args.checkEvery documents from the per-document counts of the
+    scorer."""
+    def __init__(self, scorer, args: ExperimentArguments, variant: str, total: int):
+        self.scorer = scorer
+        self.args = args
+        self.variant = variant
+        self.total = total
+        self.metric = args.targetMetric or ('ents_f' if args.mode == 'annotate' else 'f1')
+        self.interval = None
+        self.stopped = 'all documents'
+
+    def done(self) -> bool:
+        documents = self.scorer.documents
+        if self.args.maxDocuments is not None and documents >= self.args.maxDocuments:
+            self.stopped = 'maxDocuments'
+            return True
+        if documents < max(self.args.minDocuments, 1) or documents % self.args.checkEvery != 0:
+            return False
+        self.interval = self._interval()
+        logging.info(f"{self.metric} after {documents} documents: {self.args.confidence:.0%} CI [{self.interval[0]:.4f}, {self.interval[1]:.4f}]")
+        if self.interval[1] - self.interval[0] < self.args.targetWidth:
+            self.stopped = 'targetWidth'
+            return True
+        return False
+
+    def _interval(self) -> Tuple[float, float]:
+        if self.variant is not None:
+            document_counts = self.scorer.document_counts(self.variant)
+        else:
+            document_counts = self.scorer.document_counts()
+        if document_counts is None:
+            raise ValueError("--sequential needs entity scores, but the pipeline has no ner component")
+        counts = scoring.stats.load_counts({'document_counts': document_counts})
+        samples = scoring.stats.bootstrap(counts, self.args.resamples, self.args.seed)
+        if self.metric not in samples:
+            raise KeyError(f"Cannot find the score {self.metric} (try one of {sorted(samples)})")
+        return scoring.stats.confidence_interval(samples[self.metric], self.args.confidence)
+
+    def report(self) -> dict:
+        """report describes how many documents were used and why the run stopped."""
+        if self.interval is None and self.scorer.documents > 0:
+            self.interval = self._interval()
+        return {
+            'documents': self.scorer.documents,
+            'total_documents': self.total,
+            'stopped': self.stopped,
+            'target_metric': self.metric,
+            'confidence': self.args.confidence,
+            'interval': self.interval,
+            'width': self.interval[1] - self.interval[0] if self.interval is not None else None,
+            'seed': self.args.seed,
+        }
+
+def _shuffled(doc_bin: spacy.tokens.DocBin, indices: List[int], vocab: spacy.vocab.Vocab, seed: int) -> Tuple[spacy.tokens.DocBin, List[int]]:
+    """_shuffled returns the documents of doc_bin and their indices in the dataset in a random order."""
+    docs = list(doc_bin.get_docs(vocab))
+    order = list(range(len(docs)))
+    random.Random(seed).shuffle(order)
+    shuffled = spacy.tokens.DocBin(store_user_data=True)
+    for position in order:
+        shuffled.add(docs[position])
+    return shuffled, [indices[position] for position in order]
+
+def _in_dataset_order(document_counts: dict, indices: list) -> dict:
+    """_in_dataset_order sorts the rows of Scorer.document_counts by the index of their
+    document in the dataset, and lists the indices under 'documents'."""
+    if document_counts is None:
+        return None
+    order = sorted(range(len(indices)), key=lambda row: indices[row])
+    counts = document_counts['counts']
+    return {**document_counts, 'documents': [indices[row] for row in order], 'counts': [counts[row] for row in order]}
+
+def load_pipeline(pipeline_name: str, full: bool = False) -> spacy.language.Language:
+    """load_pipeline returns the pipeline with its ner component if full is set. Otherwise
+    it returns a Language with only the tokenizer of the pipeline (see load_tokenizer),
+    which is all the harness itself uses: the vocab, make_doc and the scorers."""
+    if full:
+        return spacy.load(pipeline_name, enable=['ner'])
+    return load_tokenizer(pipeline_name)
+
+def load_tokenizer(pipeline_name: str) -> spacy.language.Language:
+    """load_tokenizer returns a blank Language for the language of a pipeline, with the
+    tokenizer settings and meta name and version of the pipeline, so it tokenizes text
+    the same way without loading any trained components or vectors."""
+    if pipeline_name.startswith('blank:'):
+        return spacy.blank(pipeline_name[len('blank:'):])
+    path = _pipeline_path(pipeline_name)
+    config = spacy.util.load_config(path / 'config.cfg', interpolate=False)
+    if config['nlp']['tokenizer'].get('@tokenizers') != 'spacy.Tokenizer.v1':
+        # A custom tokenizer may need the code of the pipeline, so leave it to spaCy
+        return spacy.load(pipeline_name, exclude=config['nlp']['pipeline'])
+    meta = spacy.util.load_meta(path / 'meta.json')
+    nlp = spacy.blank(config['nlp']['lang'])
+    nlp.tokenizer.from_disk(path / 'tokenizer', exclude=['vocab'])
+    # The datasets are cached on the name and version (see datasets.loaders.cache)
+    nlp.meta['name'] = meta['name']
+    nlp.meta['version'] = meta['version']
+    return nlp
+
+def _pipeline_path(pipeline_name: str) -> pathlib.Path:
+    """_pipeline_path returns the directory holding the config and tokenizer of a pipeline,
+    which is either an installed package or a directory."""
+    if spacy.util.is_package(pipeline_name):
+        package = spacy.util.get_package_path(pipeline_name)
+        meta = spacy.util.load_meta(package / 'meta.json')
+        return package / f"{meta['lang']}_{meta['name']}-{meta['version']}"
+    return pathlib.Path(pipeline_name)
+
+# The arguments load_model reads (along with the prompt), so runs which agree
+# on these can share a model instance.
+MODEL_ARGUMENTS = ['model', 'modelName', 'openAIKey', 'maxInFlight', 'requestsPerSecond', 'batchTokenBudget',
+                   'promptLookupTokens', 'constrainToSource', 'spacyBatchSize', 'spacyProcesses', 'spacyPatterns', 'cachePath',
+                   'cacheMaxEntries', 'cacheMaxAgeDays']
+
+# The arguments which can change the answers of a run (along with the prompt), so its
+# journaled answers are keyed on them: the dataset and the pipeline it is tokenized
+# with, the mode, and the arguments of the model which change what it predicts. How
+# requests are sent and cached (e.g. maxInFlight or openAIKey) is left out, so a run
+# can be resumed with other settings for those.
+JOURNAL_ARGUMENTS = ['dataset', 'spacyPipeline', 'mode', 'model', 'modelName', 'batchTokenBudget', 'promptLookupTokens',
+                     'constrainToSource', 'spacyPatterns']
+
+def journal_key(args: ExperimentArguments, prompt: str) -> str:
+    """journal_key returns the key of the journaled answers of a run (see JOURNAL_ARGUMENTS)."""
+    return models.utilities.journal.run_key(prompt, {name: getattr(args, name) for name in JOURNAL_ARGUMENTS})
 
 def load_model(model_name: str, prompt: str, args: ExperimentArguments):
     if model_name == 'dummy':
@@ -84,73 +450,49 @@ def load_model(model_name: str, prompt: str, args: ExperimentArguments):
         return models.dummy.DummyModel()
     elif model_name == 'davinci-edit':
         import models.davinci_edit
-        return models.davinci_edit.DavinciEditModel(prompt, args.openAIKey)
+        return models.davinci_edit.DavinciEditModel(prompt, args.openAIKey, args.maxInFlight, args.requestsPerSecond, cache=load_cache(args))
     elif model_name == 'gpt-chat':
         import models.gpt_chat
-        return models.gpt_chat.GptChatModel(prompt, args.modelName, args.openAIKey)
+        return models.gpt_chat.GptChatModel(prompt, args.modelName, args.openAIKey, args.maxInFlight, args.requestsPerSecond, cache=load_cache(args))
     elif model_name == 'hf-transformer':
         import models.hf_transformer
-        return models.hf_transformer.HFTransformerModel(prompt, args.modelName)
+        return models.hf_transformer.HFTransformerModel(prompt, args.modelName, args.batchTokenBudget,
+                                                         prompt_lookup_tokens=args.promptLookupTokens, constrain_to_source=args.constrainToSource)
     elif model_name == 'hf-t5':
         import models.hf_t5
         return models.hf_t5.HFT5Model(prompt, args.modelName)
     elif model_name == 'replicate':
         import models.replicate
-        return models.replicate.ReplicateChatModel(args.modelName, prompt)
+        return models.replicate.ReplicateChatModel(args.modelName, prompt, cache=load_cache(args))
     elif model_name == 'spacy':
         import models.spacy
-        return models.spacy.SpacyModel()
+        return models.spacy.SpacyModel(args.spacyBatchSize, args.spacyProcesses, args.spacyPatterns)
     else:
         raise KeyError(f'Cannot find model {model_name}')
 
+def load_cache(args: ExperimentArguments) -> models.utilities.cache.CompletionCache:
+    return models.utilities.cache.CompletionCache(args.cachePath, args.cacheMaxEntries, args.cacheMaxAgeDays)
+
 def load_docbin(dataset_path: str) -> spacy.tokens.DocBin:
     logging.debug(f'Loading dataset from path: {dataset_path}')
-    return spacy.tokens.DocBin().from_disk(dataset_path)
+    with models.utilities.perf.timer('dataset.read'):
+        return spacy.tokens.DocBin().from_disk(dataset_path)
 
-def load_dataset(dataset_name: str, nlp: spacy.language.Language) -> spacy.tokens.DocBin:
+def load_dataset(dataset_name: str, nlp: spacy.language.Language, cache_directory: str = datasets.loaders.cache.CACHE_DIRECTORY) -> spacy.tokens.DocBin:
     if dataset_name == 'norsynthclinical':
-        return datasets.loaders.norsynth.load_norsynth(nlp.vocab)
+        return datasets.loaders.norsynth.load_norsynth(nlp.vocab, cache_directory=cache_directory)
     elif dataset_name == 'synthdeid':
-        return datasets.loaders.synthdeid.load_synthdeid(nlp.vocab)
+        return datasets.loaders.synthdeid.load_synthdeid(nlp.vocab, cache_directory=cache_directory)
     elif dataset_name == 'n2c2-2006':
-        return datasets.loaders.n2c2.load_2006(nlp)
+        return datasets.loaders.n2c2.load_2006(nlp, cache_directory=cache_directory)
     elif dataset_name == 'n2c2-2014':
-        return datasets.loaders.n2c2.load_2014(nlp)
+        return datasets.loaders.n2c2.load_2014(nlp, cache_directory=cache_directory)
     
     if os.path.exists(dataset_name) and dataset_name.endswith('.spacy'):
         return load_docbin(dataset_name)
     
     raise ValueError(f"Could not find dataset identifier and could not find a file at {dataset_name}")
 
-def _all_answers_to_label(answers: List[spacy.training.Example], nlp: spacy.language.Language, label: str = 'PHI') -> List[spacy.training.Example]:
-    fixed_examples = []
-    for answer in answers:
-        
-        fixed_labels = [spacy.tokens.span.Span(answer.reference, s.start, s.end, 'PHI') for s in answer.reference.ents]
-        fixed_prediction = [spacy.tokens.span.Span(answer.predicted, s.start, s.end, 'PHI') for s in answer.predicted.ents]
-        answer.reference.set_ents(fixed_labels)
-        answer.predicted.set_ents(fixed_prediction)
-        example = spacy.training.Example(answer.predicted, answer.reference)
-        fixed_examples.append(example)
-    return fixed_examples
-
-def _split_entities(doc):
-    """split_entities separates entities in a document into per-token entities."""
-    new_doc = doc.copy()
-    split_entities = []
-    for ent in doc.ents:
-        for token in range(ent.start, ent.end):
-            new_ent = doc[token:token+1]
-            new_ent.label = ent.label
-            split_entities.append(new_ent)
-    
-    new_doc.set_ents(split_entities)
-    return new_doc
-
-def _split_example(ex):
-    """split_example separates entities in a SpaCy example into individual token-level entities."""
-    return spacy.training.Example(_split_entities(ex.predicted), _split_entities(ex.reference))
-
 if __name__ == '__main__':
     args = ExperimentArguments().parse_args()
     main(args)
\ No newline at end of file
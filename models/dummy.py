@@ -1,14 +1,15 @@
-from typing import List, Union
+from typing import Iterator, List, Tuple, Union
 import spacy
 
 class DummyModel:
     def predict(self, doc_bin: spacy.tokens.DocBin, language: spacy.Language, mode: str) -> Union[List[spacy.training.Example], List[str]]:
-        examples = []
+        return [answer for _, answer in self.predict_iter(doc_bin, language, mode)]
+
+    def predict_iter(self, doc_bin: spacy.tokens.DocBin, language: spacy.Language, mode: str) -> Iterator[Tuple[spacy.tokens.Doc, Union[spacy.training.Example, str]]]:
         for doc in doc_bin.get_docs(language.vocab):
             if mode == 'replace':
-                examples.append(str(doc))
+                yield doc, str(doc)
             else:
                 annotations = {'entities': []}
                 example = spacy.training.Example.from_dict(doc, annotations)
-                examples.append(example)
-        return examples
\ No newline at end of file
+                yield doc, example
@@ -5,42 +5,37 @@ and the redaction and pseudonymization task phrased for the model.
 
 import logging
 import re
-import time
-from typing import List, Tuple, Union
+from typing import Iterator, List, Tuple, Union
 
 import requests
 import spacy
 
-from joblib import Memory
+from models.utilities.cache import CACHE_PATH, CompletionCache
+from models.utilities.dispatch import RequestEngine, TokenBucket, post
+from models.utilities.perf import count, timer
+from models.utilities.projection import source_annotations
 
-from models.utilities.tags import list_annotations, remove_tags
-
-CACHE_DIRECTORY = '.cache'
+API_BASE = 'https://api.openai.com/v1'
 
 IGNORE_STARTS = ['Input:', 'Output:']
 EXPECTED_TAGS = ['First_Name', 'Last_Name', 'Location', 'Health_Care_Unit', 'Age', 'Phone_Number', 'Social_Security_Number', 'Date', 'PHI']
 
-def get_chat_completion(prompt, source, model, openAIAPIKey, temperature, rate_limit = None):
-    if rate_limit:
-        time.sleep(rate_limit)
-    prologue = [
-        {'role': 'system', 'content': prompt}
-        # {'role': 'user', 'content': 'Input: Georg Nordmann er 47 år gammel og innlagt på Haukeland siden 3. april . Georgs kone Åshild ønsker at vi ringer henne på telefon 770 12345 når vi vet mer .: '},
-        # {'role': 'assistant', 'content': '<First_Name>Georg</First_Name> <Last_Name>Nordmann</Last_Name> er <Age>47 år gammel</Age> og innlagt på <Location>Haukeland</Location> siden <Date>3. april</Date> . <First_Name>Georgs</First_Name> kone <First_Name>Åshild</First_Name> ønsker at vi ringer henne på telefon <Phone_Number>770 12345</Phone_Number> når vi vet mer .'},
+def request_chat_completion(prompt, source, model, openAIAPIKey, temperature, limiter: TokenBucket = None, api_base = API_BASE):
+    messages = [
+        {'role': 'system', 'content': prompt},
+        {'role': 'user', 'content': 'Input: ' + source}
     ]
-    messages = prologue + [{
-        'role': 'user', 'content': 'Input: ' + source
-    }]
-    r = requests.post('https://api.openai.com/v1/chat/completions',
-                      json={
-                          'model': model,
-                          'messages': messages,
-                          'temperature': temperature
-                      },
-                      headers={
-                          'Authorization': f'Bearer {openAIAPIKey}',
-                          'Content-Type': 'application/json'
-                      })
+    r = post(f'{api_base}/chat/completions',
+             limiter,
+             json={
+                 'model': model,
+                 'messages': messages,
+                 'temperature': temperature
+             },
+             headers={
+                 'Authorization': f'Bearer {openAIAPIKey}',
+                 'Content-Type': 'application/json'
+             })
     if r.status_code != requests.codes.ok:
         logging.error(f"Got status code {r.status_code} from OpenAI.")
     response = r.json()
@@ -52,53 +47,65 @@ def fix_orthography(answer: str) -> str:
     return single_spaces
 
 class GptChatModel:
-    def __init__(self, prompt, model, openAIAPIKey, rate_limit=2, retries=5):
+    def __init__(self, prompt, model, openAIAPIKey, max_in_flight=8, requests_per_second=5.0, retries=5, cache=None, api_base=API_BASE):
         self._model = model
         self._prompt = prompt
         self._openAIAPIKey = openAIAPIKey
-        self._rate_limit = rate_limit
+        self._engine = RequestEngine(max_in_flight, requests_per_second)
         self._retries = retries
-        self._memory = Memory(CACHE_DIRECTORY)
+        self.cache = cache if cache is not None else CompletionCache(CACHE_PATH)
+        self._api_base = api_base
 
     def predict(self, doc_bin: spacy.tokens.DocBin, language: spacy.Language, mode: str) -> Union[List[spacy.training.Example], List[str]]:
-        examples = []
-        for doc in doc_bin.get_docs(language.vocab):
-            logging.debug(f"Task: {doc.text}")
-            prediction = self.predict_task(doc.text)
+        return [answer for _, answer in self.predict_iter(doc_bin, language, mode)]
+
+    def predict_iter(self, doc_bin: spacy.tokens.DocBin, language: spacy.Language, mode: str) -> Iterator[Tuple[spacy.tokens.Doc, Union[spacy.training.Example, str]]]:
+        """predict_iter yields each document with its answer, in order, as soon as the
+        requests for it are done, only requesting a window of documents at a time."""
+        predictions = self._engine.imap(lambda doc: (doc, self.predict_task(doc.text)), doc_bin.get_docs(language.vocab))
+        for doc, prediction in predictions:
+            logging.debug("Task: %s", doc.text)
             if prediction.split()[0] in IGNORE_STARTS:
                 prediction = ' '.join(prediction.split()[1:])
-            logging.debug(f"Predicted: {prediction}")
+            logging.debug("Predicted: %s", prediction)
 
             if mode == 'replace':
-                examples.append(prediction)
+                yield doc, prediction
                 continue
             
-            if remove_tags(prediction) != doc.text.rstrip():
-                logging.warning("Misaligned text!")
-                logging.warning(f"ORIGINAL: {doc.text}")
-                logging.warning(f"RETURNED: {remove_tags(prediction)}")
-            annotations = {'entities': list_annotations(prediction, EXPECTED_TAGS)}
-            logging.debug(f"Annotations: {annotations}")
+            annotations = {'entities': source_annotations(prediction, doc.text, EXPECTED_TAGS)}
+            logging.debug("Annotations: %s", annotations)
 
             example = spacy.training.Example.from_dict(doc, annotations)
-            examples.append(example)
-        return examples
+            yield doc, example
 
     def predict_task(self, source: str) -> str:
         tries = 0
         temperature = 0.0
         while tries < self._retries:
-            get_cached_completion = self._memory.cache(get_chat_completion)
-            response = get_cached_completion(self._prompt, source, self._model, self._openAIAPIKey, temperature, self._rate_limit)
+            response = self._get_completion(source, temperature)
             if 'choices' not in response:
                 logging.error(
                     "Unexpected answer from OpenAI - could not find \'choices\'")
                 temperature += 0.01
                 tries += 1
+                count('model.retries')
                 continue
 
             answer = response['choices'][0]['message']['content']
             return fix_orthography(answer)
 
         logging.error(f'Could not get an edit after {self._retries} tries.')
+        count('model.failed')
         return ''
+
+    def _get_completion(self, source: str, temperature: float) -> dict:
+        """_get_completion returns a cached completion if there is one, and otherwise
+        requests it through the rate limiter. Cached completions never wait on the limiter."""
+        response = self.cache.get('gpt-chat', self._model, self._prompt, source, temperature)
+        if response is None:
+            with timer('model.request'):
+                response = request_chat_completion(self._prompt, source, self._model, self._openAIAPIKey, temperature, self._engine.limiter, self._api_base)
+            if 'choices' in response:
+                self.cache.put('gpt-chat', self._model, self._prompt, source, temperature, response)
+        return response
@@ -6,15 +6,15 @@ loading a specified model which implements
 
 import logging
 import re
-import time
-from typing import List, Tuple
+from typing import Iterator, List, Tuple
 
 import spacy
 import transformers
 import accelerate
 
 from models.utilities.alignment import fix_orthography
-from models.utilities.tags import list_annotations
+from models.utilities.perf import timer
+from models.utilities.projection import source_annotations
 
 ANNOTATION_PROMPT = """
 What are the first names in the following sentence?
@@ -37,21 +37,21 @@ class HFT5Model:
         # )
     
     def predict(self, doc_bin: spacy.tokens.DocBin, language: spacy.Language, mode: str) -> List[spacy.training.Example]:
-        examples = []
+        return [example for _, example in self.predict_iter(doc_bin, language, mode)]
+
+    def predict_iter(self, doc_bin: spacy.tokens.DocBin, language: spacy.Language, mode: str) -> Iterator[Tuple[spacy.tokens.Doc, spacy.training.Example]]:
         for doc in doc_bin.get_docs(language.vocab):
-            logging.debug(f"Task: {doc.text}")
-            start = time.time()
-            prediction = fix_orthography(self.predict_task(doc.text))
-            inference_time = time.time() - start
-            logging.debug(f"Finished in {inference_time} seconds.")
+            logging.debug("Task: %s", doc.text)
+            with timer('model.generate') as inference:
+                prediction = fix_orthography(self.predict_task(doc.text))
+            logging.debug("Finished in %s seconds.", inference.seconds)
 
-            logging.debug(f"Predicted: {prediction}")
-            annotations = {'entities': list_annotations(prediction, EXPECTED_TAGS)}
-            logging.debug(f"Annotations: {annotations}")
+            logging.debug("Predicted: %s", prediction)
+            annotations = {'entities': source_annotations(prediction, doc.text, EXPECTED_TAGS)}
+            logging.debug("Annotations: %s", annotations)
 
             example = spacy.training.Example.from_dict(doc, annotations)
-            examples.append(example)
-        return examples
+            yield doc, example
     
     def predict_task(self, source: str) -> str:
         ANNOTATION_TASK = f"""Nedenfor er en instruksjon som beskriver en oppgave, sammen med et input som gir ytterligere kontekst. Skriv et svar som fullfører forespørselen på riktig måte.
@@ -4,74 +4,208 @@ loading a specified model which implements AutoModelForCausalLM
 (e.g. )
 """
 
+import copy
 import logging
 import re
-import time
-from typing import List, Tuple
+from typing import Iterator, List, Tuple
 
 import spacy
+import torch
 import transformers
 import accelerate
 
 from models.utilities.alignment import fix_orthography
-from models.utilities.tags import list_annotations
+from models.utilities.batching import length_buckets, windows
+from models.utilities.decoding import CopyConstrainedLogitsProcessor, move_spaces_out_of_tags, tag_token_ids
+from models.utilities.perf import count, timer
+from models.utilities.projection import source_annotations
 
 EXPECTED_TAGS = ['First_Name', 'Last_Name', 'Location', 'Health_Care_Unit', 'Age', 'Phone_Number', 'Social_Security_Number', 'Date']
 
+# The task is split in a prefix shared by all documents, which is only
+# tokenized (and, with prefix_cache, run through the model) once, and a
+# suffix holding the document itself.
+TASK_PREFIX = """Nedenfor er en instruksjon som beskriver en oppgave, sammen med et input som gir ytterligere kontekst. Skriv et svar som fullfører forespørselen på riktig måte.
+
+### Instruksjon:
+{prompt}
+
+### Input:
+"""
+TASK_SUFFIX = """{source}
+
+### Respons:"""
+
+# How many documents predict_iter reads at a time. In batched mode the
+# documents are sorted into length buckets within each window.
+STREAM_WINDOW = 256
+
+# Before transformers 4.36 (which added the Cache classes), most models only keep the
+# last input id when given past keys and values, so a cached prefix cannot be shared.
+SUPPORTS_PREFIX_CACHE = hasattr(transformers, 'DynamicCache')
+# Prompt lookup decoding was added to generate in transformers 4.37.
+SUPPORTS_PROMPT_LOOKUP = hasattr(transformers.GenerationConfig(), 'prompt_lookup_num_tokens')
+
 class HFTransformerModel:
-    def __init__(self, prompt: str, model_name: str):
+    def __init__(self, prompt: str, model_name: str, batch_token_budget: int = None, max_new_tokens: int = 256, prefix_cache: bool = True,
+                 prompt_lookup_tokens: int = None, constrain_to_source: bool = False):
+        """If batch_token_budget is set, documents are generated in batches of similar length,
+        each taking up at most batch_token_budget tokens (including the generated tokens).
+        If prefix_cache is set, the keys and values of the shared prefix are computed once
+        and reused for every document, so only the document itself is run through the model.
+
+        If prompt_lookup_tokens is set, up to that many tokens at a time are drafted by copying
+        from the prompt (prompt lookup decoding) and checked in a single forward pass. This only
+        works one document at a time, so batch_token_budget is then ignored.
+        If constrain_to_source is set, the answer can only copy the source and add EXPECTED_TAGS
+        tags (see CopyConstrainedLogitsProcessor), so it always matches the source text.
+
+        prefix_cache and prompt_lookup_tokens are ignored (with a warning) if the installed
+        transformers does not support them (see SUPPORTS_PREFIX_CACHE and SUPPORTS_PROMPT_LOOKUP)."""
+        if prefix_cache and not SUPPORTS_PREFIX_CACHE:
+            logging.warning("transformers %s cannot reuse the keys and values of the prompt prefix, so it is run for every document", transformers.__version__)
+        if prompt_lookup_tokens is not None and not SUPPORTS_PROMPT_LOOKUP:
+            logging.warning("transformers %s does not support prompt lookup decoding, ignoring prompt_lookup_tokens", transformers.__version__)
+            prompt_lookup_tokens = None
         self.prompt = prompt
         self.model_name = model_name
+        self.batch_token_budget = batch_token_budget
+        self.max_new_tokens = max_new_tokens
+        self.prefix_cache = prefix_cache
+        self.prompt_lookup_tokens = prompt_lookup_tokens
+        self.constrain_to_source = constrain_to_source
+        self._prefix_key_values = None
         self.tokenizer = transformers.AutoTokenizer.from_pretrained(pretrained_model_name_or_path=model_name)
         config = transformers.AutoConfig.from_pretrained(model_name)
         with accelerate.init_empty_weights():
            self.model = transformers.AutoModelForCausalLM.from_config(config)
-        
+
         self.model.tie_weights()
+        self.model.eval()
         accelerate.load_checkpoint_and_dispatch(
             self.model, model_name, device_map="auto", no_split_module_classes=["GPTJBlock"]
         )
-    
+        self.prefix_text = TASK_PREFIX.format(prompt=self.prompt)
+        self.prefix_ids = self.tokenizer(self.prefix_text)["input_ids"]
+        self.tag_ids = tag_token_ids(self.tokenizer, EXPECTED_TAGS)
+
     def predict(self, doc_bin: spacy.tokens.DocBin, language: spacy.Language, mode: str) -> List[spacy.training.Example]:
-        examples = []
-        for doc in doc_bin.get_docs(language.vocab):
-            logging.debug(f"Task: {doc.text}")
-            start = time.time()
-            prediction = fix_orthography(self.predict_task(doc.text))
-            inference_time = time.time() - start
-            logging.debug(f"Finished in {inference_time} seconds.")
-
-            logging.debug(f"Predicted: {prediction}")
-            annotations = {'entities': list_annotations(prediction, EXPECTED_TAGS)}
-            logging.debug(f"Annotations: {annotations}")
-
-            example = spacy.training.Example.from_dict(doc, annotations)
-            examples.append(example)
-        return examples
-    
+        return [example for _, example in self.predict_iter(doc_bin, language, mode)]
+
+    def predict_iter(self, doc_bin: spacy.tokens.DocBin, language: spacy.Language, mode: str) -> Iterator[Tuple[spacy.tokens.Doc, spacy.training.Example]]:
+        """predict_iter yields each document with its answer, in order. In batched mode,
+        documents are read and bucketed STREAM_WINDOW documents at a time."""
+        for docs in windows(doc_bin.get_docs(language.vocab), STREAM_WINDOW):
+            if self.batch_token_budget is None or self.prompt_lookup_tokens is not None:
+                predictions = []
+                for doc in docs:
+                    logging.debug("Task: %s", doc.text)
+                    with timer('model.generate') as inference:
+                        predictions.append(self.predict_task(doc.text))
+                    logging.debug("Finished in %s seconds.", inference.seconds)
+            else:
+                predictions = self.predict_batch([doc.text for doc in docs])
+
+            for doc, prediction in zip(docs, predictions):
+                prediction = fix_orthography(prediction)
+                logging.debug("Predicted: %s", prediction)
+                annotations = {'entities': source_annotations(prediction, doc.text, EXPECTED_TAGS)}
+                logging.debug("Annotations: %s", annotations)
+
+                example = spacy.training.Example.from_dict(doc, annotations)
+                yield doc, example
+
     def predict_task(self, source: str) -> str:
-        ANNOTATION_TASK = f"""Nedenfor er en instruksjon som beskriver en oppgave, sammen med et input som gir ytterligere kontekst. Skriv et svar som fullfører forespørselen på riktig måte.
+        return self._generate([self._encode(source)], [source])[0]
 
-### Instruksjon:
-{self.prompt}
+    def predict_batch(self, sources: List[str]) -> List[str]:
+        """predict_batch generates answers for all sources, sorting them by length into
+        left-padded batches under the token budget. The answers are returned in the
+        same order as the sources."""
+        encoded = [self._encode(source) for source in sources]
+        predictions = [None] * len(sources)
+        extra_tokens = len(self.prefix_ids) + self.max_new_tokens
+        for bucket in length_buckets([len(ids) for ids in encoded], self.batch_token_budget, extra_tokens):
+            with timer('model.generate') as inference:
+                outputs = self._generate([encoded[i] for i in bucket], [sources[i] for i in bucket])
+            logging.debug("Finished batch of %d in %s seconds.", len(bucket), inference.seconds)
+            for i, output in zip(bucket, outputs):
+                predictions[i] = output
+        return predictions
 
-### Input:
-{source}
+    def _encode(self, source: str) -> List[int]:
+        """_encode returns the token ids of the per-document suffix. The whole task is
+        tokenized and the prefix ids are cut off, so the ids are the same as if the task was
+        tokenized in one piece (tokenizing the suffix on its own can differ, e.g. a SentencePiece
+        tokenizer adds a space before its first word). If a token crosses from the prefix into
+        the document (e.g. a document starting with a newline), the suffix is tokenized on its
+        own instead, and counted in model.split_prompts."""
+        suffix = TASK_SUFFIX.format(source=source)
+        ids = self.tokenizer(self.prefix_text + suffix)["input_ids"]
+        if ids[:len(self.prefix_ids)] == self.prefix_ids:
+            return ids[len(self.prefix_ids):]
+        count('model.split_prompts')
+        return self.tokenizer(suffix, add_special_tokens=False)["input_ids"]
 
-### Respons:"""
-        inputs = self.tokenizer(ANNOTATION_TASK, return_tensors="pt")
-        input_ids = inputs["input_ids"].cuda()
+    def _prefix_cache(self, batch_size: int):
+        """_prefix_cache returns a fresh copy of the prefix keys and values for a batch,
+        in the format the model returned them in, running the prefix through the model
+        the first time it is needed."""
+        if self._prefix_key_values is None:
+            with torch.no_grad():
+                prefix = torch.tensor([self.prefix_ids], device=self.model.device)
+                self._prefix_key_values = self.model(input_ids=prefix, use_cache=True).past_key_values
+        key_values = self._prefix_key_values
+        if hasattr(key_values, 'batch_repeat_interleave'):
+            # generate extends the cache in place, so every call needs its own copy
+            key_values = copy.deepcopy(key_values)
+            if batch_size > 1:
+                key_values.batch_repeat_interleave(batch_size)
+            return key_values
+        # Older versions of transformers cannot repeat a Cache, so the keys and values are
+        # repeated as (key, value) tensors per layer, and put back in a Cache if the model
+        # returned one
+        legacy = key_values.to_legacy_cache() if hasattr(key_values, 'to_legacy_cache') else key_values
+        repeated = tuple(tuple(tensor.repeat_interleave(batch_size, dim=0) for tensor in layer) for layer in legacy)
+        return type(key_values).from_legacy_cache(repeated) if hasattr(key_values, 'from_legacy_cache') else repeated
+
+    def _generate(self, batch: List[List[int]], sources: List[str]) -> List[str]:
+        """_generate generates answers for a batch of encoded suffixes of the given sources.
+        Shorter suffixes are padded between the prefix and the suffix, so the prefix takes up
+        the same positions in every row and its cached keys and values can be shared by the
+        whole batch."""
+        pad_token_id = self.tokenizer.eos_token_id
+        suffix_width = max(len(ids) for ids in batch)
+        width = len(self.prefix_ids) + suffix_width
+        input_ids = torch.tensor([self.prefix_ids + [pad_token_id] * (suffix_width - len(ids)) + ids for ids in batch], device=self.model.device)
+        attention_mask = torch.tensor([[1] * len(self.prefix_ids) + [0] * (suffix_width - len(ids)) + [1] * len(ids) for ids in batch], device=self.model.device)
+        generate_args = {}
+        if self.prompt_lookup_tokens is not None and len(batch) == 1:
+            generate_args['prompt_lookup_num_tokens'] = self.prompt_lookup_tokens
+        logits_processor = transformers.LogitsProcessorList()
+        if self.constrain_to_source:
+            source_ids = [self.tokenizer(source, add_special_tokens=False)["input_ids"] for source in sources]
+            logits_processor.append(CopyConstrainedLogitsProcessor(width, source_ids, self.tag_ids, pad_token_id))
         generation_output = self.model.generate(
             input_ids=input_ids,
+            attention_mask=attention_mask,
+            past_key_values=self._prefix_cache(len(batch)) if self.prefix_cache and SUPPORTS_PREFIX_CACHE else None,
             generation_config=transformers.GenerationConfig(temperature=0.01, top_p=0.05, num_beams=1),
+            logits_processor=logits_processor,
             return_dict_in_generate=True,
-            output_scores=True,
-            max_new_tokens=256,
-            pad_token_id=self.tokenizer.eos_token_id
+            max_new_tokens=self.max_new_tokens,
+            pad_token_id=pad_token_id,
+            **generate_args
         )
+        count('model.prompt_tokens', int(attention_mask.sum()))
+        count('model.generated_tokens', int((generation_output.sequences[:, width:] != pad_token_id).sum()))
         response = []
         for seq in generation_output.sequences:
-            output = self.tokenizer.decode(seq, skip_special_tokens=True)
+            if self.constrain_to_source:
+                # Older tokenizers remove the space before punctuation by default, which
+                # would make the answer differ from the source
+                output = move_spaces_out_of_tags(self.tokenizer.decode(seq[width:], skip_special_tokens=True, clean_up_tokenization_spaces=False))
+            else:
+                output = self.tokenizer.decode(seq[width:], skip_special_tokens=True)
             response.append(output.split("### Respons:")[-1].strip())
-        return ''.join(response)
-        
\ No newline at end of file
+        return response
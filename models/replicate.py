@@ -6,16 +6,15 @@ and the redaction and pseudonymization task phrased for the model.
 import logging
 import re
 import time
-from typing import List, Tuple
+from typing import Iterator, List, Tuple
 
 import spacy
 import replicate
 
-from joblib import Memory
+from models.utilities.cache import CACHE_PATH, CompletionCache
+from models.utilities.perf import count, timer
+from models.utilities.projection import source_annotations
 
-from models.utilities.tags import list_annotations, remove_tags
-
-CACHE_DIRECTORY = '.cache'
 SYSTEM_PROMPT = """
 You are assisting a healthcare professional. 
 Respond in the original language of the notes, using only words from the notes and the tags specified. 
@@ -40,44 +39,47 @@ def fix_orthography(answer: str) -> str:
     return single_spaces
 
 class ReplicateChatModel:
-    def __init__(self, model, prompt, rate_limit=2, retries=5):
+    def __init__(self, model, prompt, rate_limit=2, retries=5, cache=None):
         self._model = model
         self._prompt = prompt
         self._rate_limit = rate_limit
         self._retries = retries
-        self._memory = Memory(CACHE_DIRECTORY)
+        self.cache = cache if cache is not None else CompletionCache(CACHE_PATH)
 
     def predict(self, doc_bin: spacy.tokens.DocBin, language: spacy.Language, mode: str) -> List[spacy.training.Example]:
-        examples = []
+        return [example for _, example in self.predict_iter(doc_bin, language, mode)]
+
+    def predict_iter(self, doc_bin: spacy.tokens.DocBin, language: spacy.Language, mode: str) -> Iterator[Tuple[spacy.tokens.Doc, spacy.training.Example]]:
         for doc in doc_bin.get_docs(language.vocab):
-            logging.debug(f"Task: {doc.text}")
+            logging.debug("Task: %s", doc.text)
             prediction = self.predict_task(doc.text).lstrip()
-            logging.debug(f"Predicted: {prediction}")
-            if remove_tags(prediction) != doc.text.rstrip():
-                logging.warning("Misaligned text!")
-                logging.warning(f"ORIGINAL: {doc.text}")
-                logging.warning(f"RETURNED: {remove_tags(prediction)}")
-            annotations = {'entities': list_annotations(prediction, EXPECTED_TAGS)}
-            logging.debug(f"Annotations: {annotations}")
+            logging.debug("Predicted: %s", prediction)
+            annotations = {'entities': source_annotations(prediction, doc.text, EXPECTED_TAGS)}
+            logging.debug("Annotations: %s", annotations)
 
             example = spacy.training.Example.from_dict(doc, annotations)
-            examples.append(example)
-        return examples
+            yield doc, example
 
     def predict_task(self, source: str) -> str:
         tries = 0
         temperature = 0.0
         while tries < self._retries:
-            get_cached_completion = self._memory.cache(get_chat_completion)
-            response = get_cached_completion(self._model, SYSTEM_PROMPT, self._prompt, source, temperature, self._rate_limit)
+            response = self.cache.get('replicate', self._model, (SYSTEM_PROMPT, self._prompt), source, temperature)
+            if response is None:
+                with timer('model.request'):
+                    response = get_chat_completion(self._model, SYSTEM_PROMPT, self._prompt, source, temperature, self._rate_limit)
+                if len(response) > 0:
+                    self.cache.put('replicate', self._model, (SYSTEM_PROMPT, self._prompt), source, temperature, response)
             if len(response) == 0:
                 logging.error(
                     "Unexpected answer from Replicate - empty answer")
                 temperature += 0.01
                 tries += 1
+                count('model.retries')
                 continue
 
             return fix_orthography(response)
 
         logging.error(f'Could not get an edit after {self._retries} tries.')
+        count('model.failed')
         return ''
@@ -1,75 +1,82 @@
+import itertools
 import logging
-from typing import Dict, List, Union
-import re
+from typing import Iterator, List, Tuple, Union
 import spacy
+from spacy.language import Language
 
-class SpacyModel:
-    """SpacyModel implements a default spaCy EntityRecognizer and EntityRuler, allowing
-    custom class."""
-    def __init__(self):
-        # We don't want to change the spaCy pipeline passed to us, 
-        # so just make a new one:
-        self.language = spacy.load('nb_core_news_lg')
-        self.patterns = [
-            (r"\d{11}", "Social_Security_Number"),
-            (r"\d{6}[\s-]+\d{5}", "Social_Security_Number"),
-            (r"\+\d{10}", "Phone_Number"),
-            (r"00\d{10}", "Phone_Number"),
-            (r"\d{8}", "Phone_Number"),
-            (r"(\+\d{2})?\d{2}\s\d{2}\s\d{2}\s\d{2}", "Phone_Number"),
-            (r"\d{1,2}\.\d{1,2}\.\d{2,4}", "Date"),
-            (r"\d{1,2} \. \d{1,2} \. \d{2,4}", "Date"),
-            (r"((19)|(20))\d{2}", "Date"),
-            (r"\d{1,2}\s?\.\s?((januar)|(februar)|(mars)|(april)|(mai)|(juni)|(juli)|(august)|(september)|(oktober)|(november)|(desember))\s?\d{2,4}?", "Date")
-        ]
-    
-    def predict(self, doc_bin: spacy.tokens.DocBin, language: spacy.Language, mode: str) -> Union[List[spacy.training.Example], List[str]]:
-        examples = []
-        for ref in doc_bin.get_docs(language.vocab):
-            new_doc = ref.text
-            results = self.language(new_doc)
+from models.utilities.patterns import PATTERNS_PATH, PatternMatcher
+from models.utilities.perf import timer
+
+MAP_CATEGORIES = {
+    'PER': 'Ignore', # We handle first and last names separately
+    'ORG': 'Location',
+    'GPE': 'Location',
+    'GPE_LOC': 'Location',
+    'GPE_ORG': 'Location',
+    'LOC': 'Location',
+    'EVT': 'Ignore',
+    'MISC': 'Ignore',
+    'DRV': 'Ignore',
+    'PROD': 'Ignore'
+}
+
+def mapped_label(label: str) -> str:
+    return MAP_CATEGORIES.get(label, label)
+
+@Language.factory('deid_rules', default_config={'patterns_path': PATTERNS_PATH})
+def make_deid_rules(nlp: Language, name: str, patterns_path: str) -> 'DeidRules':
+    return DeidRules(PatternMatcher.from_file(patterns_path))
+
+class DeidRules:
+    """DeidRules turns the entities found by the ner component into the PHI classes, splitting
+    names into first and last names, and adds the ages, numbers and dates matched by the
+    rules in patterns_path (see models/utilities/patterns.py). It runs as the last component
+    of the pipeline, so it runs in the worker processes along with the ner component."""
+    def __init__(self, matcher: PatternMatcher):
+        self.matcher = matcher
 
-            map_categories = {
-                'PER': 'Ignore', # We handle first and last names separately
-                'ORG': 'Location',
-                'GPE': 'Location',
-                'GPE_LOC': 'Location',
-                'GPE_ORG': 'Location',
-                'LOC': 'Location',
-                'EVT': 'Ignore',
-                'MISC': 'Ignore',
-                'DRV': 'Ignore',
-                'PROD': 'Ignore'
-            }
-                
-            
-            mapped_label = lambda l: map_categories[l] if l in map_categories else l
-            spans = [spacy.tokens.span.Span(results, s.start, s.end, mapped_label(s.label_)) for s in results.ents if mapped_label(s.label_) != 'Ignore']
+    def __call__(self, results: spacy.tokens.Doc) -> spacy.tokens.Doc:
+        spans = [spacy.tokens.span.Span(results, s.start, s.end, mapped_label(s.label_)) for s in results.ents if mapped_label(s.label_) != 'Ignore']
 
-            for token in results:
-                if token.ent_type_ == 'PER' and token.ent_iob_ == 'B':
-                    spans.append(spacy.tokens.span.Span(results, token.i, token.i+1, 'First_Name'))
-                elif token.ent_type_ == 'PER' and token.ent_iob_ == 'I':
-                    spans.append(spacy.tokens.span.Span(results, token.i, token.i+1, 'Last_Name'))
+        for token in results:
+            if token.ent_type_ == 'PER' and token.ent_iob_ == 'B':
+                spans.append(spacy.tokens.span.Span(results, token.i, token.i+1, 'First_Name'))
+            elif token.ent_type_ == 'PER' and token.ent_iob_ == 'I':
+                spans.append(spacy.tokens.span.Span(results, token.i, token.i+1, 'Last_Name'))
 
-            age_pattern = r"(\d+) år"
-            age_matches = re.finditer(age_pattern, new_doc, re.IGNORECASE)
-            for m in age_matches:
-                span = results.char_span(m.start(), m.end() - 3, "Age", alignment_mode="expand")
+        with timer('model.rules'):
+            matches = self.matcher.matches(results.text)
+        for start, end, label in matches:
+            span = results.char_span(start, end, label, alignment_mode="expand")
+            if span == None:
+                logging.warning(f"Matched {results.text[start:end]} as {label} but could not create span")
+            else:
                 spans.append(span)
 
-            for (pattern, label) in self.patterns:
-                matches = list(re.finditer(pattern, ref.text, re.IGNORECASE))
-                for match in matches:
-                    span = results.char_span(match.start(), match.end(), label, alignment_mode="expand")
-                    if span == None:
-                        logging.warning(f"Matched {match} but could not create span")
-                    else:
-                        spans.append(span)
-            
-            fixed_spans = spacy.util.filter_spans(spans)
-            results.set_ents(fixed_spans)
+        fixed_spans = spacy.util.filter_spans(spans)
+        results.set_ents(fixed_spans)
+        return results
+
+class SpacyModel:
+    """SpacyModel implements a default spaCy EntityRecognizer and EntityRuler, allowing
+    custom class. The documents are streamed through nlp.pipe in batches of batch_size,
+    in n_process processes. The regular expression rules are read from patterns_path."""
+    def __init__(self, batch_size: int = 64, n_process: int = 1, patterns_path: str = PATTERNS_PATH):
+        # We don't want to change the spaCy pipeline passed to us,
+        # so just make a new one, with only the components we use:
+        self.language = spacy.load('nb_core_news_lg', enable=['ner'])
+        self.language.add_pipe('deid_rules', last=True, config={'patterns_path': patterns_path})
+        self.batch_size = batch_size
+        self.n_process = n_process
+
+    def predict(self, doc_bin: spacy.tokens.DocBin, language: spacy.Language, mode: str) -> Union[List[spacy.training.Example], List[str]]:
+        return [answer for _, answer in self.predict_iter(doc_bin, language, mode)]
 
+    def predict_iter(self, doc_bin: spacy.tokens.DocBin, language: spacy.Language, mode: str) -> Iterator[Tuple[spacy.tokens.Doc, Union[spacy.training.Example, str]]]:
+        # nlp.pipe keeps the order of the texts, so the references are read alongside it
+        references, sources = itertools.tee(doc_bin.get_docs(language.vocab))
+        predictions = self.language.pipe((ref.text for ref in sources), batch_size=self.batch_size, n_process=self.n_process)
+        for ref, results in zip(references, predictions):
             if mode == 'annotate':
                 example = spacy.training.Example(predicted=results, reference=ref)
             else:
@@ -79,5 +86,4 @@ class SpacyModel:
                         example += tok.text_with_ws
                     else:
                         example += f"<{tok.ent_type_}> "
-            examples.append(example)
-        return examples
\ No newline at end of file
+            yield ref, example
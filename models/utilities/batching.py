@@ -0,0 +1,34 @@
+import itertools
+from typing import Iterable, Iterator, List, Sequence, TypeVar
+
+T = TypeVar('T')
+
+
+def length_buckets(lengths: Sequence[int], token_budget: int, extra_tokens: int = 0) -> List[List[int]]:
+    """length_buckets groups item indices into batches of similar length.
+    The items are sorted by length, and a batch is closed when adding the next
+    item would make (batch size) x (longest length + extra_tokens) exceed
+    token_budget. Every item is placed in a batch, even if it exceeds the
+    budget on its own."""
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    buckets = []
+    bucket = []
+    for i in order:
+        # Items are sorted, so the newest item is always the longest in the bucket
+        if bucket and (len(bucket) + 1) * (lengths[i] + extra_tokens) > token_budget:
+            buckets.append(bucket)
+            bucket = []
+        bucket.append(i)
+    if bucket:
+        buckets.append(bucket)
+    return buckets
+
+def windows(items: Iterable[T], size: int) -> Iterator[List[T]]:
+    """windows lazily splits items into consecutive lists of (at most) size items,
+    so that a stream can be processed in batches without holding all of it."""
+    iterator = iter(items)
+    while True:
+        window = list(itertools.islice(iterator, size))
+        if not window:
+            return
+        yield window
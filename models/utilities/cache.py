@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+cache.py
+Implements a single-file SQLite cache for completions from the API-backed
+models, keyed on the backend, model, prompt, input and temperature.
+
+Run as a module to import an existing joblib cache or evict old entries:
+    python -m models.utilities.cache --import_joblib .cache --max_age_days 90
+"""
+
+import ast
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import sqlite3
+import threading
+import time
+from typing import Any, Optional, Sequence, Union
+
+from tap import Tap
+
+from models.utilities.perf import count
+
+CACHE_PATH = '.cache/completions.sqlite3'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS completions (
+    backend TEXT NOT NULL,
+    model TEXT NOT NULL,
+    prompt_hash TEXT NOT NULL,
+    input_hash TEXT NOT NULL,
+    temperature REAL NOT NULL,
+    response TEXT NOT NULL,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL,
+    PRIMARY KEY (backend, model, prompt_hash, input_hash, temperature)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS completions_accessed ON completions (accessed);
+"""
+
+def content_hash(content: Union[str, Sequence[str]]) -> str:
+    """content_hash returns a SHA-256 digest of a string, or of a sequence of
+    strings (e.g. a system prompt and an instruction) taken together."""
+    if not isinstance(content, str):
+        content = '\0'.join(content)
+    return hashlib.sha256(content.encode('utf8')).hexdigest()
+
+class CompletionCache:
+    """CompletionCache stores API responses in one SQLite database in WAL mode,
+    so that several threads and processes can read and write it at once.
+    Each thread gets its own connection.
+
+    hits and misses count the lookups made through this instance."""
+    def __init__(self, path: str = CACHE_PATH, max_entries: int = None, max_age_days: float = None):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        connection = self._connection()
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.executescript(_SCHEMA)
+        if max_entries is not None or max_age_days is not None:
+            self.evict(max_entries, max_age_days)
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=60.0, isolation_level=None)
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    def get(self, backend: str, model: str, prompt: Union[str, Sequence[str]], source: str, temperature: float) -> Optional[Any]:
+        """get returns the cached response for a request, or None."""
+        key = (backend, model, content_hash(prompt), content_hash(source), temperature)
+        connection = self._connection()
+        row = connection.execute(
+            'SELECT response FROM completions WHERE backend = ? AND model = ? AND prompt_hash = ? AND input_hash = ? AND temperature = ?',
+            key).fetchone()
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                count('completion_cache.misses')
+                return None
+            self.hits += 1
+            count('completion_cache.hits')
+        connection.execute(
+            'UPDATE completions SET accessed = ? WHERE backend = ? AND model = ? AND prompt_hash = ? AND input_hash = ? AND temperature = ?',
+            (time.time(),) + key)
+        return json.loads(row[0])
+
+    def put(self, backend: str, model: str, prompt: Union[str, Sequence[str]], source: str, temperature: float, response: Any, created: float = None):
+        """put stores the response to a request, replacing any previous one."""
+        now = time.time()
+        if created is None:
+            created = now
+        self._connection().execute(
+            'INSERT OR REPLACE INTO completions VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (backend, model, content_hash(prompt), content_hash(source), temperature, json.dumps(response), created, now))
+
+    def evict(self, max_entries: int = None, max_age_days: float = None) -> int:
+        """evict removes entries created more than max_age_days ago, and then the least
+        recently used entries beyond max_entries. It returns how many were removed."""
+        connection = self._connection()
+        removed = 0
+        if max_age_days is not None:
+            cutoff = time.time() - max_age_days * 24 * 60 * 60
+            removed += connection.execute('DELETE FROM completions WHERE created < ?', (cutoff,)).rowcount
+        if max_entries is not None:
+            removed += connection.execute(
+                'DELETE FROM completions WHERE accessed <= (SELECT accessed FROM completions ORDER BY accessed DESC LIMIT 1 OFFSET ?)',
+                (max_entries,)).rowcount
+        if removed > 0:
+            logging.debug(f"Evicted {removed} cached completions.")
+        return removed
+
+    def __len__(self) -> int:
+        return self._connection().execute('SELECT COUNT(*) FROM completions').fetchone()[0]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups > 0 else 0.0}
+
+# How to read the arguments of the functions previously cached with joblib.Memory,
+# as (module path, function name) -> (backend, model, prompt, source, temperature).
+JOBLIB_FUNCTIONS = {
+    ('models/gpt_chat', 'get_chat_completion'): lambda a: ('gpt-chat', a['model'], a['prompt'], a['source'], a['temperature']),
+    ('models/gpt_chat', 'request_chat_completion'): lambda a: ('gpt-chat', a['model'], a['prompt'], a['source'], a['temperature']),
+    ('models/davinci_edit', 'get_completion'): lambda a: ('davinci-edit', 'text-davinci-edit-001', a['instruction'], a['source'], a['temperature']),
+    ('models/davinci_edit', 'request_completion'): lambda a: ('davinci-edit', 'text-davinci-edit-001', a['instruction'], a['source'], a['temperature']),
+    ('models/replicate', 'get_chat_completion'): lambda a: ('replicate', a['model'], (a['system_prompt'], a['prompt']), a['source'], a['temperature']),
+}
+
+def import_joblib(cache: CompletionCache, directory: str = '.cache') -> int:
+    """import_joblib copies the completions stored by joblib.Memory in directory
+    into the cache, returning how many were imported. Error responses
+    (without 'choices') are skipped, since they are retried anyway."""
+    import joblib
+
+    imported = 0
+    root = pathlib.Path(directory) / 'joblib'
+    for (module, function), to_key in JOBLIB_FUNCTIONS.items():
+        function_directory = root / module / function
+        if not function_directory.is_dir():
+            continue
+        for call_directory in function_directory.iterdir():
+            metadata_path = call_directory / 'metadata.json'
+            output_path = call_directory / 'output.pkl'
+            if not metadata_path.exists() or not output_path.exists():
+                continue
+            with open(metadata_path, 'r', encoding='utf8') as metadata_file:
+                metadata = json.load(metadata_file)
+            try:
+                arguments = {k: ast.literal_eval(v) for k, v in metadata['input_args'].items() if k != 'limiter'}
+            except (ValueError, SyntaxError):
+                logging.warning(f"Could not read the arguments in {metadata_path}, skipping.")
+                continue
+            response = joblib.load(output_path)
+            if not response or (isinstance(response, dict) and 'choices' not in response):
+                continue
+            backend, model, prompt, source, temperature = to_key(arguments)
+            cache.put(backend, model, prompt, source, temperature, response, created=metadata.get('time'))
+            imported += 1
+    return imported
+
+class CacheArguments(Tap):
+    path: str = CACHE_PATH
+    """Path to the completion cache"""
+    import_joblib: str = None
+    """Import completions from this joblib.Memory directory (e.g. .cache)"""
+    max_entries: int = None
+    """Evict the least recently used entries beyond this many"""
+    max_age_days: float = None
+    """Evict entries older than this many days"""
+
+if __name__ == '__main__':
+    args = CacheArguments().parse_args()
+    cache = CompletionCache(args.path)
+    if args.import_joblib:
+        print(f"Imported {import_joblib(cache, args.import_joblib)} completions from {args.import_joblib}")
+    if args.max_entries is not None or args.max_age_days is not None:
+        print(f"Evicted {cache.evict(args.max_entries, args.max_age_days)} completions")
+    print(f"{len(cache)} completions in {args.path}")
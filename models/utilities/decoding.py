@@ -0,0 +1,102 @@
+"""
+decoding.py
+Implements source-constrained decoding for annotate mode in the local
+HuggingFace backends. In annotate mode the answer should be the source
+text with XML tags added, so at every step the only sensible tokens are
+the next token of the source, or a token of an opening or closing tag.
+"""
+
+import re
+from typing import Dict, List, Sequence, Tuple
+
+import torch
+import transformers
+
+# A decoding state is (position in the source, open tag or None, position
+# the open tag was opened at, remaining token ids of the tag being written)
+State = Tuple[int, str, int, Tuple[int, ...]]
+
+class CopyConstrainedLogitsProcessor(transformers.LogitsProcessor):
+    """CopyConstrainedLogitsProcessor only allows the model to copy the next
+    source token, or to open or close one of the expected tags. Tags cannot
+    be nested or empty, and the end of sequence token is only allowed once
+    the whole source has been copied and all tags are closed.
+
+    The processor keeps no state between calls: the generated tokens are
+    replayed on every call, so it also works with assisted generation
+    (e.g. prompt lookup), which checks several candidate lengths at once."""
+    def __init__(self, prompt_length: int, sources: Sequence[Sequence[int]], tags: Dict[str, Tuple[List[int], List[int]]], eos_token_id: int):
+        """prompt_length is the width of the (padded) prompt, sources holds the token ids to
+        copy for each row of the batch, and tags maps each tag name to the token ids of
+        its opening and closing tags."""
+        self.prompt_length = prompt_length
+        self.sources = sources
+        self.tags = tags
+        self.eos_token_id = eos_token_id
+
+    def _step(self, source: Sequence[int], state: State, token: int) -> List[State]:
+        position, open_tag, opened_at, pending = state
+        if pending:
+            return [(position, open_tag, opened_at, pending[1:])] if token == pending[0] else []
+        next_states = []
+        if position < len(source) and token == source[position]:
+            next_states.append((position + 1, open_tag, opened_at, ()))
+        if open_tag is None:
+            for tag, (opening, _) in self.tags.items():
+                if token == opening[0]:
+                    next_states.append((position, tag, position, tuple(opening[1:])))
+        elif position > opened_at and token == self.tags[open_tag][1][0]:
+            next_states.append((position, None, position, tuple(self.tags[open_tag][1][1:])))
+        return next_states
+
+    def _allowed(self, source: Sequence[int], states: List[State]) -> List[int]:
+        allowed = set()
+        for position, open_tag, opened_at, pending in states:
+            if pending:
+                allowed.add(pending[0])
+                continue
+            if position < len(source):
+                allowed.add(source[position])
+            elif open_tag is None:
+                allowed.add(self.eos_token_id)
+            if open_tag is None:
+                if position < len(source):
+                    allowed.update(opening[0] for opening, _ in self.tags.values())
+            elif position > opened_at:
+                allowed.add(self.tags[open_tag][1][0])
+        return list(allowed)
+
+    def allowed_tokens(self, row: int, generated: Sequence[int]) -> List[int]:
+        """allowed_tokens returns the token ids which may follow the generated tokens in a row."""
+        source = self.sources[row]
+        states = [(0, None, 0, ())]
+        for token in generated:
+            states = [next_state for state in states for next_state in self._step(source, state, token)]
+            if not states:
+                # The row went off track (e.g. it has finished and is being padded)
+                return [self.eos_token_id]
+        return self._allowed(source, states)
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        mask = torch.full_like(scores, float('-inf'))
+        for row in range(input_ids.shape[0]):
+            allowed = self.allowed_tokens(row, input_ids[row, self.prompt_length:].tolist())
+            mask[row, allowed] = 0.0
+        return scores + mask
+
+def tag_token_ids(tokenizer: transformers.PreTrainedTokenizerBase, tags: Sequence[str]) -> Dict[str, Tuple[List[int], List[int]]]:
+    """tag_token_ids tokenizes the opening and closing tag of each tag name."""
+    return {tag: (tokenizer(f'<{tag}>', add_special_tokens=False)['input_ids'],
+                  tokenizer(f'</{tag}>', add_special_tokens=False)['input_ids'])
+            for tag in tags}
+
+_LEADING_SPACE = re.compile(r'<([\w_]+)>(\s+)')
+_TRAILING_SPACE = re.compile(r'(\s+)</([\w_]+)>')
+
+def move_spaces_out_of_tags(annotated: str) -> str:
+    """move_spaces_out_of_tags moves whitespace just inside a tag to outside it
+    (e.g. '<Age> 23</Age>' becomes ' <Age>23</Age>'). Copying the source token by
+    token puts the space in front of a word inside the tag when the tokenizer
+    attaches spaces to the following word."""
+    annotated = _LEADING_SPACE.sub(r'\2<\1>', annotated)
+    return _TRAILING_SPACE.sub(r'</\2>\1', annotated)
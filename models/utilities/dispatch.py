@@ -0,0 +1,188 @@
+"""
+dispatch.py
+Implements a concurrent request engine for the API-backed models:
+a token bucket rate limiter which adapts to the rate limit headers
+returned by the API, and a dispatcher which runs blocking requests
+concurrently while keeping the results in input order.
+"""
+
+import asyncio
+import concurrent.futures
+import contextvars
+import email.utils
+import logging
+import re
+import threading
+import time
+from typing import Callable, Iterable, Iterator, List, Mapping, Optional, Sequence, TypeVar
+
+import requests
+
+from models.utilities.batching import windows
+from models.utilities.perf import adjust, count, timer
+
+T = TypeVar('T')
+R = TypeVar('R')
+
+# How many times a request is repeated after being rejected with
+# 429 Too Many Requests before giving up and returning the response.
+RATE_LIMIT_RETRIES = 5
+# How long to back off after a 429 without a Retry-After header.
+DEFAULT_BACKOFF = 1.0
+# The limiter never slows down below this rate (requests per second),
+# however few requests the headers say are left.
+MIN_RATE = 0.1
+
+_DURATION_PART = re.compile(r'(\d+(?:\.\d+)?)(ms|h|m|s)')
+_DURATION_UNITS = {'ms': 0.001, 's': 1.0, 'm': 60.0, 'h': 3600.0}
+
+def parse_duration(value: str) -> Optional[float]:
+    """parse_duration parses durations as used by OpenAI's x-ratelimit-reset-*
+    headers (e.g. '20ms', '1s', '6m0s') into seconds."""
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts)
+
+def parse_retry_after(headers: Mapping[str, str]) -> Optional[float]:
+    """parse_retry_after returns how many seconds the server asked us to wait,
+    from either a retry-after-ms or a Retry-After header (in seconds or as a date)."""
+    if 'retry-after-ms' in headers:
+        try:
+            return float(headers['retry-after-ms']) / 1000.0
+        except ValueError:
+            pass
+    if 'retry-after' not in headers:
+        return None
+    value = headers['retry-after']
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+class TokenBucket:
+    """TokenBucket allows up to `rate` requests per second on average, with bursts
+    of up to `capacity` requests. It is thread-safe, so requests running in
+    worker threads can share one bucket.
+
+    The bucket is fed by the responses through `update`: Retry-After pauses
+    all requests, running out of requests or tokens pauses until the limit
+    resets, and otherwise the rate follows the remaining request budget."""
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.max_rate = rate
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        """_reserve takes a token if one is available, returning 0.0, or
+        otherwise returns how long to wait before trying again."""
+        now = time.monotonic()
+        with self._lock:
+            if now < self._paused_until:
+                return self._paused_until - now
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1.0:
+                self._tokens -= 1.0
+                return 0.0
+            return (1.0 - self._tokens) / self.rate
+
+    def acquire(self):
+        """acquire blocks until a request may be sent."""
+        while True:
+            wait = self._reserve()
+            if wait <= 0.0:
+                return
+            time.sleep(wait)
+
+    def pause(self, seconds: float):
+        """pause stops all requests for the given number of seconds."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0.0
+
+    def update(self, status_code: int, headers: Mapping[str, str]):
+        """update adapts the bucket to the rate limit headers of a response."""
+        retry_after = parse_retry_after(headers)
+        if retry_after is not None:
+            logging.debug(f"Server asked us to retry after {retry_after} seconds.")
+            self.pause(retry_after)
+        elif status_code == requests.codes.too_many_requests:
+            self.pause(DEFAULT_BACKOFF)
+
+        for kind in ['requests', 'tokens']:
+            remaining = headers.get(f'x-ratelimit-remaining-{kind}')
+            reset = parse_duration(headers.get(f'x-ratelimit-reset-{kind}', ''))
+            if remaining is None or reset is None:
+                continue
+            try:
+                remaining = int(remaining)
+            except ValueError:
+                continue
+            if remaining <= 0:
+                logging.debug(f"Out of {kind}, pausing for {reset} seconds.")
+                self.pause(reset)
+            elif kind == 'requests' and reset > 0:
+                # Spread the remaining requests evenly over the time until the limit resets
+                with self._lock:
+                    self.rate = min(self.max_rate, max(MIN_RATE, remaining / reset))
+
+def post(url: str, limiter: Optional[TokenBucket] = None, **kwargs) -> requests.Response:
+    """post sends a POST request through the limiter, feeding the response
+    back to it and retrying requests rejected with 429 Too Many Requests."""
+    for _ in range(RATE_LIMIT_RETRIES):
+        if limiter is not None:
+            with timer('model.rate_limit_wait'):
+                limiter.acquire()
+        r = requests.post(url, **kwargs)
+        if limiter is not None:
+            limiter.update(r.status_code, r.headers)
+        if r.status_code != requests.codes.too_many_requests:
+            break
+        logging.warning("Rate limited, retrying.")
+        count('model.rate_limited')
+    return r
+
+class RequestEngine:
+    """RequestEngine runs blocking tasks (e.g. cached API calls) concurrently in
+    worker threads, with at most max_in_flight running at a time, and shares a
+    TokenBucket between them."""
+    def __init__(self, max_in_flight: int = 8, requests_per_second: float = 5.0):
+        self.max_in_flight = max_in_flight
+        self.limiter = TokenBucket(requests_per_second, capacity=max_in_flight)
+
+    def map(self, fn: Callable[[T], R], items: Sequence[T]) -> List[R]:
+        """map returns [fn(item) for item in items], running the calls concurrently."""
+        return asyncio.run(self._map(fn, items))
+
+    def imap(self, fn: Callable[[T], R], items: Iterable[T], window: int = None) -> Iterator[R]:
+        """imap yields fn(item) for each item in order, running the calls concurrently
+        in windows of items (by default four times max_in_flight), so only one window of
+        items and results is held at a time."""
+        for chunk in windows(items, window or 4 * self.max_in_flight):
+            yield from self.map(fn, chunk)
+
+    async def _map(self, fn: Callable[[T], R], items: Sequence[T]) -> List[R]:
+        loop = asyncio.get_running_loop()
+        in_flight = asyncio.Semaphore(self.max_in_flight)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_in_flight) as executor:
+            async def run(item: T) -> R:
+                async with in_flight:
+                    adjust('model.in_flight', 1)
+                    try:
+                        # In a copy of the context, so fn records to the Recorder of the run (see models.utilities.perf.recording)
+                        return await loop.run_in_executor(executor, contextvars.copy_context().run, fn, item)
+                    finally:
+                        adjust('model.in_flight', -1)
+            return await asyncio.gather(*(run(item) for item in items))
@@ -0,0 +1,112 @@
+"""
+journal.py
+Implements a prediction journal: every answer is written to an SQLite
+database as soon as it arrives, with its latency, so that an interrupted
+run can be resumed without predicting the finished documents again.
+
+Runs are keyed on the prompt and every setting which can change the
+answers (see eval.JOURNAL_ARGUMENTS), so a journal file can be shared by
+many experiments.
+"""
+
+import json
+import os
+import sqlite3
+import time
+from typing import Dict, NamedTuple, Tuple, Union
+
+import spacy
+import spacy.tokens
+import spacy.training
+
+from models.utilities.cache import content_hash
+
+JOURNAL_PATH = '.cache/journal.sqlite3'
+
+# The token attributes needed to score a journaled Example
+_EXAMPLE_ATTRS = ['ORTH', 'SPACY', 'ENT_IOB', 'ENT_TYPE']
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_key TEXT PRIMARY KEY,
+    metadata TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS predictions (
+    run_key TEXT NOT NULL,
+    doc_index INTEGER NOT NULL,
+    text_hash TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    answer BLOB NOT NULL,
+    latency REAL NOT NULL,
+    created REAL NOT NULL,
+    PRIMARY KEY (run_key, doc_index)
+) WITHOUT ROWID;
+"""
+
+Answer = Union[spacy.training.Example, str]
+
+class Entry(NamedTuple):
+    """Entry is a journaled answer, kept serialized until it is needed."""
+    text_hash: str
+    kind: str
+    answer: bytes
+    latency: float
+
+    def decode(self, vocab: spacy.vocab.Vocab) -> Answer:
+        return decode_answer(self.kind, self.answer, vocab)
+
+def run_key(prompt: str, settings: Dict[str, object]) -> str:
+    """run_key identifies the predictions of a run by its prompt and the settings
+    (by name) which can change its answers."""
+    return content_hash([prompt] + [f'{name}={settings[name]!r}' for name in sorted(settings)])
+
+def encode_answer(answer: Answer) -> Tuple[str, bytes]:
+    """encode_answer serializes a replace-mode string, or an annotate-mode Example
+    as a DocBin holding its predicted and reference Docs."""
+    if isinstance(answer, str):
+        return 'text', answer.encode('utf8')
+    doc_bin = spacy.tokens.DocBin(attrs=_EXAMPLE_ATTRS)
+    doc_bin.add(answer.predicted)
+    doc_bin.add(answer.reference)
+    return 'example', doc_bin.to_bytes()
+
+def decode_answer(kind: str, answer: bytes, vocab: spacy.vocab.Vocab) -> Answer:
+    if kind == 'text':
+        return answer.decode('utf8')
+    predicted, reference = spacy.tokens.DocBin().from_bytes(answer).get_docs(vocab)
+    return spacy.training.Example(predicted, reference)
+
+class PredictionJournal:
+    """PredictionJournal records the answers of one run, keyed by the index of the
+    document in the dataset. Every answer is committed as soon as it is added."""
+    def __init__(self, path: str, key: str, metadata: dict = None):
+        self.path = path
+        self.key = key
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._connection = sqlite3.connect(path, timeout=60.0, isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.executescript(_SCHEMA)
+        self._connection.execute('INSERT OR IGNORE INTO runs VALUES (?, ?, ?)', (key, json.dumps(metadata or {}), time.time()))
+
+    def add(self, doc_index: int, text: str, answer: Answer, latency: float):
+        kind, encoded = encode_answer(answer)
+        self._connection.execute('INSERT OR REPLACE INTO predictions VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                 (self.key, doc_index, content_hash(text), kind, encoded, latency, time.time()))
+
+    def read_all(self) -> Dict[int, Entry]:
+        """read_all returns every answer recorded for the run by document index, in a single query."""
+        rows = self._connection.execute(
+            'SELECT doc_index, text_hash, kind, answer, latency FROM predictions WHERE run_key = ?', (self.key,))
+        return {doc_index: Entry(text_hash, kind, answer, latency) for doc_index, text_hash, kind, answer, latency in rows}
+
+    def clear(self):
+        """clear removes the answers recorded for the run, e.g. before starting it over."""
+        self._connection.execute('DELETE FROM predictions WHERE run_key = ?', (self.key,))
+
+    def __len__(self) -> int:
+        return self._connection.execute('SELECT COUNT(*) FROM predictions WHERE run_key = ?', (self.key,)).fetchone()[0]
+
+    def close(self):
+        self._connection.close()
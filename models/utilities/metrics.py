@@ -0,0 +1,217 @@
+"""
+metrics.py
+Implements live progress for long runs of eval.py: Progress tracks how many
+documents are done and can show it as a single line on stderr, and
+MetricsExporter exposes the progress along with everything recorded through
+models.utilities.perf in the OpenMetrics text format while the run goes on,
+either over HTTP for Prometheus to scrape, or as a file for the node
+exporter's textfile collector.
+"""
+
+import http.server
+import math
+import os
+import re
+import threading
+import time
+from typing import List, Optional, TextIO, Tuple
+
+from models.utilities.perf import Recorder, current
+
+CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+# The prefix of every exported metric
+PREFIX = 'deid'
+# How often the progress line is written to a stream which is not a terminal
+LINE_INTERVAL = 30.0
+
+_INVALID_NAME = re.compile(r'[^a-zA-Z0-9_]')
+
+def format_duration(seconds: Optional[float]) -> str:
+    if seconds is None or math.isinf(seconds):
+        return '?'
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f'{hours}:{minutes:02}:{seconds:02}'
+
+class Progress:
+    """Progress tracks how many of total documents are done. The rate only counts the
+    documents done since it was created, so answers scored from the journal do not
+    inflate it. With a stream, a progress line is written to it at most every interval
+    seconds, in place if the stream is a terminal and every LINE_INTERVAL seconds if not."""
+    def __init__(self, total: int, done: int = 0, stream: Optional[TextIO] = None, interval: float = 0.5, recorder: Recorder = None):
+        self.total = total
+        self.done = done
+        self.stream = stream
+        self.recorder = recorder or current()
+        self._in_place = stream is not None and stream.isatty()
+        self.interval = interval if self._in_place else max(interval, LINE_INTERVAL)
+        self._initial = done
+        self._started = time.perf_counter()
+        self._shown = self._started
+
+    def update(self, done: int):
+        self.done = done
+        now = time.perf_counter()
+        if self.stream is not None and now - self._shown >= self.interval:
+            self._shown = now
+            self._show()
+
+    def rate(self) -> Optional[float]:
+        """rate returns the documents done per second, or None before the first one."""
+        elapsed = time.perf_counter() - self._started
+        return (self.done - self._initial) / elapsed if self.done > self._initial and elapsed > 0 else None
+
+    def eta(self) -> Optional[float]:
+        """eta returns the estimated seconds until all documents are done, or None if unknown."""
+        rate = self.rate()
+        return max(0, self.total - self.done) / rate if rate else None
+
+    def line(self) -> str:
+        rate = self.rate()
+        parts = [f'{self.done}/{self.total} documents ({self.done / self.total if self.total else 1.0:.0%})',
+                 f'{rate:.2f} docs/s' if rate is not None else '- docs/s',
+                 f'ETA {format_duration(self.eta())}']
+        in_flight = self.recorder.gauge('model.in_flight')
+        if in_flight:
+            parts.append(f'{in_flight:.0f} in flight')
+        retries = self.recorder.counter('model.retries') + self.recorder.counter('model.rate_limited')
+        if retries:
+            parts.append(f'{retries} retries')
+        misaligned = self.recorder.counter('model.misaligned')
+        if misaligned:
+            parts.append(f'{misaligned} misaligned')
+        hits, misses = self.recorder.counter('completion_cache.hits'), self.recorder.counter('completion_cache.misses')
+        if hits + misses:
+            parts.append(f'cache hits {hits / (hits + misses):.0%}')
+        return ' | '.join(parts)
+
+    def _show(self):
+        if self._in_place:
+            # Overwrite the previous line, clearing whatever is left of it
+            self.stream.write(f'\r{self.line()}\x1b[K')
+        else:
+            self.stream.write(f'{self.line()}\n')
+        self.stream.flush()
+
+    def close(self):
+        if self.stream is None:
+            return
+        self._show()
+        if self._in_place:
+            self.stream.write('\n')
+            self.stream.flush()
+
+def _metric_name(name: str) -> str:
+    return f'{PREFIX}_{_INVALID_NAME.sub("_", name)}'
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ''
+    escape = lambda value: str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{key}="{escape(value)}"' for key, value in labels.items()) + '}'
+
+def openmetrics(recorder: Recorder = None, progress: Optional[Progress] = None) -> str:
+    """openmetrics renders the progress and what recorder has recorded in the OpenMetrics
+    text format. Stages become the counters deid_stage_seconds and deid_stage_calls labelled
+    by stage, counters and gauges keep their names (with dots replaced by underscores),
+    distributions become summaries, and hit rates the gauge deid_hit_ratio."""
+    report = (recorder or current()).report()
+    lines = []
+    def family(name: str, kind: str, help: str, samples: List[Tuple[str, dict, float]]):
+        lines.append(f'# TYPE {name} {kind}')
+        lines.append(f'# HELP {name} {help}')
+        lines.extend(f'{name}{suffix}{_labels(labels)} {value}' for suffix, labels, value in samples)
+
+    if progress is not None:
+        family(f'{PREFIX}_documents_done', 'gauge', 'Documents predicted and scored, including journaled answers.', [('', {}, progress.done)])
+        family(f'{PREFIX}_documents_expected', 'gauge', 'Documents to predict and score in the run.', [('', {}, progress.total)])
+        rate, eta = progress.rate(), progress.eta()
+        if rate is not None:
+            family(f'{PREFIX}_documents_per_second', 'gauge', 'Documents done per second.', [('', {}, rate)])
+        if eta is not None:
+            family(f'{PREFIX}_eta_seconds', 'gauge', 'Estimated seconds until the run is done.', [('', {}, eta)])
+    family(f'{PREFIX}_stage_seconds', 'counter', 'Seconds spent in each stage.',
+           [('_total', {'stage': name}, stage['seconds']) for name, stage in report['stages'].items()])
+    family(f'{PREFIX}_stage_calls', 'counter', 'Times each stage ran.',
+           [('_total', {'stage': name}, stage['calls']) for name, stage in report['stages'].items()])
+    for name, value in report['counters'].items():
+        family(_metric_name(name), 'counter', f'The {name} counter.', [('_total', {}, value)])
+    for name, value in report['gauges'].items():
+        family(_metric_name(name), 'gauge', f'The {name} gauge.', [('', {}, value)])
+    if report['hit_rates']:
+        family(f'{PREFIX}_hit_ratio', 'gauge', 'Share of cache lookups which were hits.',
+               [('', {'cache': name}, rate) for name, rate in report['hit_rates'].items()])
+    for name, summary in report['distributions'].items():
+        samples = [('', {'quantile': percentile / 100}, summary[f'p{percentile}']) for percentile in (50, 90, 99) if f'p{percentile}' in summary]
+        samples += [('_count', {}, summary['count']), ('_sum', {}, summary.get('mean', 0.0) * summary['count'])]
+        family(_metric_name(name), 'summary', f'The distribution of {name}.', samples)
+    if report['peak_rss_mb'] is not None:
+        family(f'{PREFIX}_peak_rss_bytes', 'gauge', 'Peak resident memory of the process.', [('', {}, int(report['peak_rss_mb'] * 2**20))])
+    lines.append('# EOF')
+    return '\n'.join(lines) + '\n'
+
+class MetricsExporter:
+    """MetricsExporter exposes openmetrics(recorder, progress) while a run goes on: over HTTP
+    at http://host:port/metrics if port is set (0 picks a free port, see self.port), and
+    as a file at path, rewritten every interval seconds, if path is set. The file is
+    replaced atomically, so readers never see a partial file."""
+    def __init__(self, progress: Optional[Progress] = None, port: Optional[int] = None, path: Optional[str] = None,
+                 interval: float = 5.0, host: str = '127.0.0.1', recorder: Recorder = None):
+        self.progress = progress
+        self.path = path
+        self.interval = interval
+        self.recorder = recorder or current()
+        self.port = None
+        self._server = None
+        self._writer = None
+        self._stop = threading.Event()
+        if port is not None:
+            self._server = http.server.ThreadingHTTPServer((host, port), self._handler())
+            self.port = self._server.server_address[1]
+            threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        if path is not None:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            self._writer = threading.Thread(target=self._write_every_interval, daemon=True)
+            self._writer.start()
+
+    def render(self) -> str:
+        return openmetrics(self.recorder, self.progress)
+
+    def write(self):
+        temporary = f'{self.path}.{os.getpid()}.tmp'
+        with open(temporary, 'w', encoding='utf8') as metrics_file:
+            metrics_file.write(self.render())
+        os.replace(temporary, self.path)
+
+    def _write_every_interval(self):
+        while not self._stop.wait(self.interval):
+            self.write()
+
+    def _handler(self):
+        exporter = self
+        class MetricsHandler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = exporter.render().encode('utf8')
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # Don't log every scrape
+                pass
+        return MetricsHandler
+
+    def close(self):
+        """close stops serving, and writes the file a last time."""
+        self._stop.set()
+        if self._writer is not None:
+            self._writer.join()
+            self.write()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
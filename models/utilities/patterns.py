@@ -0,0 +1,158 @@
+"""
+patterns.py
+Implements a matcher for the regular expression rules of the spaCy baseline
+(see models/spacy_patterns.yaml), which finds the matches of every rule in
+one scan of the text.
+
+The rules are compiled into a single expression with a lookahead group per
+rule. The scan stops at every position where some rule matches, and reads
+which rules match there from the groups. Keeping, for each rule, only the
+matches which start after its previous match ends gives exactly the matches
+re.finditer would find for each rule on its own, so the rules keep their
+meaning and priority. The expression starts with the characters any rule
+can start with, when these are known, so the regex engine can skip ahead
+to them without trying the rules at every position.
+"""
+
+import re
+from typing import List, NamedTuple, Optional, Set, Tuple
+
+import yaml
+
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_parse
+
+PATTERNS_PATH = 'models/spacy_patterns.yaml'
+
+class Rule(NamedTuple):
+    """Rule is a regular expression which marks PHI with a label."""
+    pattern: str
+    label: str
+    group: int = 0
+    """The group of the pattern which is the entity (0 for the whole match)"""
+
+def load_rules(path: str = PATTERNS_PATH) -> List[Rule]:
+    """load_rules reads the rules from a YAML file with a list of rules under 'patterns',
+    each with a pattern, a label and optionally a group."""
+    with open(path, 'r', encoding='utf8') as rules_file:
+        config = yaml.safe_load(rules_file)
+    return [Rule(rule['pattern'], rule['label'], rule.get('group', 0)) for rule in config['patterns']]
+
+class PatternMatcher:
+    """PatternMatcher finds the matches of a list of rules, matched case-insensitively."""
+    def __init__(self, rules: List[Rule]):
+        self.rules = rules
+        for rule in rules:
+            if re.compile(rule.pattern, re.IGNORECASE).groups < rule.group:
+                raise ValueError(f"The pattern {rule.pattern} for {rule.label} has no group {rule.group}")
+        # Only stop where at least one rule matches, then capture every rule which does
+        any_rule = '|'.join(f'(?:{rule.pattern})' for rule in rules)
+        captures = ''.join(f'(?:(?=(?P<rule{i}>{rule.pattern})))?' for i, rule in enumerate(rules))
+        starts = first_characters([rule.pattern for rule in rules])
+        prefix = f'(?=[{starts}])' if starts else ''
+        self._expression = re.compile(f'{prefix}(?=(?:{any_rule})){captures}', re.IGNORECASE)
+        self._groups = [self._expression.groupindex[f'rule{i}'] for i in range(len(rules))]
+
+    @classmethod
+    def from_file(cls, path: str = PATTERNS_PATH) -> 'PatternMatcher':
+        return cls(load_rules(path))
+
+    def matches(self, text: str) -> List[Tuple[int, int, str]]:
+        """matches returns the entities matched in text as (start, end, label), with the
+        matches of each rule in order, and the rules in the order they are listed."""
+        found = [[] for _ in self.rules]
+        ends = [0] * len(self.rules)
+        for match in self._expression.finditer(text):
+            position = match.start()
+            for i, group in enumerate(self._groups):
+                end = match.end(group)
+                if end < 0 or position < ends[i]:
+                    continue
+                # The groups of the pattern follow its own group
+                entity = group + self.rules[i].group
+                found[i].append((match.start(entity), match.end(entity), self.rules[i].label))
+                ends[i] = end
+        return [span for spans in found for span in spans]
+
+# How the items of a parsed character class are written in a pattern
+_CATEGORIES = {
+    sre_parse.CATEGORY_DIGIT: r'\d',
+    sre_parse.CATEGORY_SPACE: r'\s',
+    sre_parse.CATEGORY_WORD: r'\w',
+}
+
+def first_characters(patterns: List[str]) -> Optional[str]:
+    """first_characters returns a character class (without the brackets) of the characters
+    a match of any of the patterns can start with, or None if it cannot tell."""
+    items = set()
+    for pattern in patterns:
+        pattern_items = _first_items(list(sre_parse.parse(pattern)))
+        if pattern_items is None:
+            return None
+        items |= pattern_items
+    return ''.join(sorted(items)) or None
+
+def _first_items(sequence: list) -> Optional[Set[str]]:
+    """_first_items returns the character class items a match of a parsed sequence can start
+    with, None if it cannot tell, or an empty set if the sequence can match the empty string."""
+    items = set()
+    for op, argument in sequence:
+        if op is sre_parse.LITERAL:
+            return items | {re.escape(chr(argument))}
+        elif op is sre_parse.IN:
+            class_items = set()
+            for item_op, item in argument:
+                if item_op is sre_parse.LITERAL:
+                    class_items.add(re.escape(chr(item)))
+                elif item_op is sre_parse.RANGE:
+                    class_items.add(f'{re.escape(chr(item[0]))}-{re.escape(chr(item[1]))}')
+                elif item_op is sre_parse.CATEGORY and item in _CATEGORIES:
+                    class_items.add(_CATEGORIES[item])
+                else:
+                    return None
+            return items | class_items
+        elif op is sre_parse.SUBPATTERN:
+            inner = _first_items(list(argument[-1]))
+            if inner is None:
+                return None
+            items |= inner
+            if not _matches_empty(list(argument[-1])):
+                return items
+        elif op is sre_parse.BRANCH:
+            branches = [_first_items(list(branch)) for branch in argument[1]]
+            if any(branch is None for branch in branches):
+                return None
+            items |= set().union(*branches)
+            if not any(_matches_empty(list(branch)) for branch in argument[1]):
+                return items
+        elif op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT):
+            minimum, _, inner_sequence = argument
+            inner = _first_items(list(inner_sequence))
+            if inner is None:
+                return None
+            items |= inner
+            if minimum > 0 and not _matches_empty(list(inner_sequence)):
+                return items
+        else:
+            return None
+    # The whole sequence can be empty, so a match could start with anything
+    return None if sequence else set()
+
+def _matches_empty(sequence: list) -> bool:
+    """_matches_empty returns whether a parsed sequence of the ops _first_items knows can
+    match the empty string."""
+    for op, argument in sequence:
+        if op in (sre_parse.LITERAL, sre_parse.IN):
+            return False
+        elif op is sre_parse.SUBPATTERN:
+            if not _matches_empty(list(argument[-1])):
+                return False
+        elif op is sre_parse.BRANCH:
+            if not any(_matches_empty(list(branch)) for branch in argument[1]):
+                return False
+        elif op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT):
+            if argument[0] > 0 and not _matches_empty(list(argument[2])):
+                return False
+    return True
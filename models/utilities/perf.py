@@ -0,0 +1,202 @@
+"""
+perf.py
+Implements the instrumentation of the harness: the dataset loaders, models
+and scorers time their stages and count events through the functions in
+this module, which record them in one Recorder per process (or per run, see
+recording). eval.py writes a summary of a run under 'perf' in its --output
+file, and can write every timed stage as a Chrome trace (open it in
+chrome://tracing or https://ui.perfetto.dev).
+
+Stages and counters are named '<part>.<what>', e.g. 'model.request' or
+'completion_cache.hits'. Counters ending in .hits and .misses are reported
+as hit rates as well. Gauges hold values which go up and down, such as the
+number of requests in flight.
+"""
+
+import collections
+import contextlib
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+from typing import Dict, List, Optional
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+# The percentiles reported for every distribution
+PERCENTILES = [50, 90, 99]
+
+class Timer:
+    """Timer times a with block and records it as a stage of a Recorder. The time
+    taken is available as seconds after the block."""
+    def __init__(self, recorder: 'Recorder', name: str):
+        self.recorder = recorder
+        self.name = name
+        self.seconds = None
+
+    def __enter__(self) -> 'Timer':
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.seconds = time.perf_counter() - self._start
+        self.recorder.add_time(self.name, self._start, self.seconds)
+
+class Recorder:
+    """Recorder collects the time spent in named stages, counters, gauges and distributions
+    of values (e.g. the latency of each document). It is thread-safe, so it can be shared
+    by the worker threads of the API-backed models. With trace, every timed stage is
+    kept as an event for write_trace."""
+    def __init__(self, trace: bool = False):
+        self._lock = threading.Lock()
+        self.reset(trace)
+
+    def reset(self, trace: bool = False):
+        with self._lock:
+            self.trace = trace
+            self.started = time.perf_counter()
+            self._stages: Dict[str, List[float]] = collections.defaultdict(lambda: [0.0, 0])
+            self._counters = collections.Counter()
+            self._gauges: Dict[str, float] = {}
+            self._values: Dict[str, List[float]] = collections.defaultdict(list)
+            self._events = []
+
+    def timer(self, name: str) -> Timer:
+        return Timer(self, name)
+
+    def add_time(self, name: str, start: float, seconds: float):
+        """add_time records that the stage name ran for seconds from start (as given by
+        time.perf_counter)."""
+        with self._lock:
+            stage = self._stages[name]
+            stage[0] += seconds
+            stage[1] += 1
+            if self.trace:
+                self._events.append((name, start, seconds, threading.get_ident()))
+
+    def count(self, name: str, n: int = 1):
+        with self._lock:
+            self._counters[name] += n
+
+    def observe(self, name: str, value: float):
+        with self._lock:
+            self._values[name].append(value)
+
+    def adjust(self, name: str, delta: float):
+        """adjust adds delta to the gauge name."""
+        with self._lock:
+            self._gauges[name] = self._gauges.get(name, 0) + delta
+
+    def counter(self, name: str) -> int:
+        with self._lock:
+            return self._counters[name]
+
+    def gauge(self, name: str) -> float:
+        with self._lock:
+            return self._gauges.get(name, 0)
+
+    def seconds(self, name: str) -> float:
+        with self._lock:
+            return self._stages[name][0] if name in self._stages else 0.0
+
+    def report(self) -> dict:
+        """report summarizes everything recorded since the last reset."""
+        with self._lock:
+            counters = dict(sorted(self._counters.items()))
+            hit_rates = {}
+            for name, hits in counters.items():
+                if name.endswith('.hits'):
+                    lookups = hits + counters.get(f'{name[:-len(".hits")]}.misses', 0)
+                    hit_rates[name[:-len('.hits')]] = hits / lookups if lookups > 0 else 0.0
+            return {
+                'wall_seconds': time.perf_counter() - self.started,
+                'stages': {name: {'seconds': seconds, 'calls': calls} for name, (seconds, calls) in sorted(self._stages.items())},
+                'counters': counters,
+                'hit_rates': hit_rates,
+                'gauges': dict(sorted(self._gauges.items())),
+                'distributions': {name: summarize(values) for name, values in sorted(self._values.items())},
+                'peak_rss_mb': peak_rss_mb(),
+                'peak_child_rss_mb': peak_rss_mb(children=True),
+            }
+
+    def write_trace(self, path: str):
+        """write_trace writes the timed stages as complete events in the Chrome trace format."""
+        with self._lock:
+            events = [{'name': name, 'cat': name.split('.')[0], 'ph': 'X', 'ts': (start - self.started) * 1e6, 'dur': seconds * 1e6,
+                       'pid': os.getpid(), 'tid': thread} for name, start, seconds, thread in self._events]
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w', encoding='utf8') as trace_file:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, trace_file)
+
+def summarize(values: List[float]) -> dict:
+    """summarize returns the count, mean, PERCENTILES (by the nearest rank) and maximum
+    of a list of values."""
+    if not values:
+        return {'count': 0}
+    ordered = sorted(values)
+    summary = {'count': len(ordered), 'mean': sum(ordered) / len(ordered)}
+    for percentile in PERCENTILES:
+        rank = max(1, -(-percentile * len(ordered) // 100))
+        summary[f'p{percentile}'] = ordered[rank - 1]
+    summary['max'] = ordered[-1]
+    return summary
+
+def peak_rss_mb(children: bool = False) -> Optional[float]:
+    """peak_rss_mb returns the peak resident memory of this process (or the largest of its
+    finished child processes) in MB, or None where it is not available."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS, and in kilobytes elsewhere
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+
+# The Recorder of this process
+RECORDER = Recorder()
+
+# The Recorder the functions below record to: RECORDER, unless the code runs within recording
+_CURRENT = contextvars.ContextVar('recorder', default=RECORDER)
+
+def current() -> Recorder:
+    return _CURRENT.get()
+
+@contextlib.contextmanager
+def recording(recorder: Recorder):
+    """recording makes the functions below record to recorder instead of RECORDER within a
+    with block, e.g. so that runs in different threads each have their own Recorder. Worker
+    threads record to it as well if they run in a copy of the context (see
+    contextvars.copy_context), as models.utilities.dispatch does."""
+    token = _CURRENT.set(recorder)
+    try:
+        yield recorder
+    finally:
+        _CURRENT.reset(token)
+
+def timer(name: str) -> Timer:
+    return current().timer(name)
+
+def add_time(name: str, start: float, seconds: float):
+    current().add_time(name, start, seconds)
+
+def count(name: str, n: int = 1):
+    current().count(name, n)
+
+def observe(name: str, value: float):
+    current().observe(name, value)
+
+def adjust(name: str, delta: float):
+    current().adjust(name, delta)
+
+def reset(trace: bool = False):
+    current().reset(trace)
+
+def report() -> dict:
+    return current().report()
+
+def write_trace(path: str):
+    current().write_trace(path)
@@ -0,0 +1,207 @@
+"""
+projection.py
+Implements projecting the annotations of an answer whose text does not
+match the source (e.g. an LLM which fixed a typo, or dropped a space)
+back onto the source text, so the answer can be scored instead of
+re-requested.
+
+The texts are diffed as lists of tokens (each with the whitespace before
+it), skipping equal tokens and searching a short window after each change
+for where the texts agree again, which is close to linear for texts which
+are nearly the same. Within a changed stretch of tokens, the characters
+are diffed with difflib. A span boundary is projected if it falls in an unchanged stretch of
+either diff, or on the edge of a changed one, and is then moved out to
+the edges of the word it falls in.
+"""
+
+import bisect
+import difflib
+import functools
+import logging
+import re
+from typing import List, NamedTuple, Optional, Tuple
+
+from models.utilities.perf import count
+from models.utilities.tags import parse_tags
+
+Span = Tuple[int, int, str]
+
+# Words and punctuation, each with the whitespace before it, and trailing whitespace
+_TOKEN = re.compile(r'\s*(?:\w+|[^\w\s])|\s+')
+
+# Changed stretches longer than this (on either side) are not diffed by character
+MAX_BLOCK_CHARS = 256
+# How many tokens after a change the texts are searched for where they agree again
+RESYNC_WINDOW = 32
+# How many tokens in a row must agree for the texts to agree again
+RESYNC_TOKENS = 3
+# How similar (as difflib's ratio) a span must be to what it is projected onto, unless
+# it is all of a changed stretch
+MIN_SIMILARITY = 0.5
+
+class Projection(NamedTuple):
+    spans: List[Span]
+    projected: int
+    dropped: int
+
+class _Blocks:
+    """_Blocks holds the opcodes of a diff of two texts in characters, as
+    (tag, start, end in the first text, start, end in the second text)."""
+    def __init__(self, opcodes: List[Tuple[str, int, int, int, int]]):
+        # Insertions take no characters of the first text, so no boundary falls in them
+        self.opcodes = [opcode for opcode in opcodes if opcode[1] < opcode[2]]
+        self.starts = [opcode[1] for opcode in self.opcodes]
+        self.ends = [opcode[2] for opcode in self.opcodes]
+
+    def find(self, position: int, is_end: bool) -> Optional[Tuple[str, int, int, int, int]]:
+        """find returns the block a boundary in the first text falls in, or None. A start
+        is looked up in the block starting at or before it, an end in the block ending at
+        or after it, so a boundary between two blocks belongs to the block of the span."""
+        i = bisect.bisect_left(self.ends, position) if is_end else bisect.bisect_right(self.starts, position) - 1
+        return self.opcodes[i] if 0 <= i < len(self.opcodes) else None
+
+    def map(self, position: int, is_end: bool) -> Optional[int]:
+        """map returns where a boundary in the first text is in the second text: in an
+        unchanged block, the same character, and on the edge of a changed or deleted block,
+        the edge of what it was changed to (e.g. a whole entity which was rewritten).
+        Otherwise it returns None."""
+        block = self.find(position, is_end)
+        if block is None:
+            return None
+        tag, a_start, a_end, b_start, b_end = block
+        if tag == 'equal':
+            return b_start + position - a_start
+        if position == (a_end if is_end else a_start):
+            # A deleted block ends up empty, so its edges map to the same place
+            return b_end if is_end else b_start
+        return None
+
+def _tag(i1: int, i2: int, j1: int, j2: int) -> str:
+    return 'replace' if i1 < i2 and j1 < j2 else 'delete' if i1 < i2 else 'insert'
+
+def _resync(a: List[str], b: List[str], i: int, j: int) -> Optional[Tuple[int, int]]:
+    """_resync returns the closest (i, j) after a change at a[i] and b[j] where
+    RESYNC_TOKENS tokens of a and b agree again (or both end), or None if there is
+    none within RESYNC_WINDOW tokens."""
+    for distance in range(1, 2 * RESYNC_WINDOW + 1):
+        for skip_a in range(max(0, distance - RESYNC_WINDOW), min(distance, RESYNC_WINDOW) + 1):
+            next_i, next_j = i + skip_a, j + distance - skip_a
+            if next_i > len(a) or next_j > len(b):
+                continue
+            if a[next_i:next_i + RESYNC_TOKENS] == b[next_j:next_j + RESYNC_TOKENS]:
+                return next_i, next_j
+    return None
+
+def _diff(a: List[str], b: List[str]) -> List[Tuple[str, int, int, int, int]]:
+    """_diff returns opcodes (as difflib.SequenceMatcher.get_opcodes) which turn a into b.
+    Equal tokens are skipped in lockstep, and after a change, the closest point where
+    the texts agree again is looked for within RESYNC_WINDOW tokens, so the time is
+    close to linear when there are few changes. Where there is none, the next
+    4 * RESYNC_WINDOW tokens are diffed with difflib instead."""
+    opcodes = []
+    i = j = 0
+    while i < len(a) and j < len(b):
+        start_i, start_j = i, j
+        while i < len(a) and j < len(b) and a[i] == b[j]:
+            i += 1
+            j += 1
+        if i > start_i:
+            opcodes.append(('equal', start_i, i, start_j, j))
+        if i == len(a) or j == len(b):
+            break
+        sync = _resync(a, b, i, j)
+        if sync is not None:
+            opcodes.append((_tag(i, sync[0], j, sync[1]), i, sync[0], j, sync[1]))
+            i, j = sync
+            continue
+        # Diff a chunk with difflib, and go on from the end of its last equal stretch
+        chunk_a, chunk_b = a[i:i + 4 * RESYNC_WINDOW], b[j:j + 4 * RESYNC_WINDOW]
+        chunk = difflib.SequenceMatcher(None, chunk_a, chunk_b, autojunk=False).get_opcodes()
+        last_equal = max((k for k, opcode in enumerate(chunk) if opcode[0] == 'equal'), default=None)
+        if last_equal is None:
+            opcodes.append((_tag(i, i + len(chunk_a), j, j + len(chunk_b)), i, i + len(chunk_a), j, j + len(chunk_b)))
+            i, j = i + len(chunk_a), j + len(chunk_b)
+            continue
+        opcodes.extend((tag, i + i1, i + i2, j + j1, j + j2) for tag, i1, i2, j1, j2 in chunk[:last_equal + 1])
+        i, j = i + chunk[last_equal][2], j + chunk[last_equal][4]
+    if i < len(a) or j < len(b):
+        opcodes.append((_tag(i, len(a), j, len(b)), i, len(a), j, len(b)))
+    return opcodes
+
+def project_spans(returned: str, source: str, spans: List[Span]) -> Projection:
+    """project_spans maps (start, end, label) character spans of the text returned by a
+    model onto the source text it was asked to annotate, and counts how many were
+    projected. Spans which cannot be mapped, which map to nothing, or which map onto
+    text too different from their own (see MIN_SIMILARITY) are dropped."""
+    if returned == source:
+        return Projection(list(spans), len(spans), 0)
+    returned_tokens = _TOKEN.findall(returned)
+    source_tokens = _TOKEN.findall(source)
+    returned_offsets = _offsets(returned_tokens)
+    source_offsets = _offsets(source_tokens)
+    blocks = _Blocks([(tag, returned_offsets[i1], returned_offsets[i2], source_offsets[j1], source_offsets[j2])
+                      for tag, i1, i2, j1, j2 in _diff(returned_tokens, source_tokens)])
+
+    @functools.lru_cache(maxsize=None)
+    def character_blocks(a_start: int, a_end: int, b_start: int, b_end: int) -> Optional[_Blocks]:
+        if a_end - a_start > MAX_BLOCK_CHARS or b_end - b_start > MAX_BLOCK_CHARS:
+            return None
+        opcodes = difflib.SequenceMatcher(None, returned[a_start:a_end], source[b_start:b_end], autojunk=False).get_opcodes()
+        return _Blocks([(tag, a_start + i1, a_start + i2, b_start + j1, b_start + j2) for tag, i1, i2, j1, j2 in opcodes])
+
+    def map_boundary(position: int, is_end: bool) -> Optional[int]:
+        block = blocks.find(position, is_end)
+        if block is not None and block[0] == 'replace':
+            within = character_blocks(*block[1:])
+            mapped = within.map(position, is_end) if within is not None else None
+            if mapped is not None:
+                return mapped
+        return blocks.map(position, is_end)
+
+    projected = []
+    for start, end, label in spans:
+        mapped_start, mapped_end = map_boundary(start, False), map_boundary(end, True)
+        if mapped_start is None or mapped_end is None or mapped_start >= mapped_end or source[mapped_start:mapped_end].isspace():
+            continue
+        # A boundary mapped into a changed word is moved out to the edges of the word
+        while 0 < mapped_start < len(source) and source[mapped_start - 1].isalnum() and source[mapped_start].isalnum():
+            mapped_start -= 1
+        while 0 < mapped_end < len(source) and source[mapped_end - 1].isalnum() and source[mapped_end].isalnum():
+            mapped_end += 1
+        text, mapped_text = returned[start:end], source[mapped_start:mapped_end]
+        if text != mapped_text and difflib.SequenceMatcher(None, text, mapped_text).ratio() < MIN_SIMILARITY:
+            # Keep a rewritten entity (e.g. a different name) only if it is all that changed there
+            block = blocks.find(start, False)
+            if block is None or block[0] != 'replace' or block != blocks.find(end, True) or returned[block[1]:block[2]].strip() != text.strip():
+                continue
+        projected.append((mapped_start, mapped_end, label))
+    return Projection(projected, len(projected), len(spans) - len(projected))
+
+def _offsets(tokens: List[str]) -> List[int]:
+    """_offsets returns the character offset of every token, and of the end of the last."""
+    offsets = [0]
+    for token in tokens:
+        offsets.append(offsets[-1] + len(token))
+    return offsets
+
+def source_annotations(answer: str, source: str, expected_tags: List[str]) -> List[Span]:
+    """source_annotations returns the (start, end, label) spans of the expected_tags annotations
+    in an annotated answer, as spans of the source text. If the text of the answer does not
+    match the source, the spans are projected onto it with project_spans. The malformed tags,
+    misaligned answers, and projected and dropped spans are counted (see models.utilities.perf)."""
+    parsed = parse_tags(answer, expected_tags)
+    if parsed.malformed:
+        count('model.malformed_tags', len(parsed.malformed))
+        logging.debug("Malformed tags: %s", parsed.malformed)
+    if parsed.text == source.rstrip():
+        return parsed.annotations
+    logging.warning("Misaligned text!")
+    count('model.misaligned')
+    logging.warning("ORIGINAL: %s", source)
+    logging.warning("RETURNED: %s", parsed.text)
+    # Map the annotations onto the source, rather than using offsets in another text
+    projection = project_spans(parsed.text, source, parsed.annotations)
+    count('model.projected_spans', projection.projected)
+    count('model.dropped_spans', projection.dropped)
+    logging.warning("Projected %d annotations onto the source, dropped %d", projection.projected, projection.dropped)
+    return projection.spans
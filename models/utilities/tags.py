@@ -1,5 +1,6 @@
+import collections
 import re
-from typing import List, Tuple
+from typing import List, NamedTuple, Tuple
 
 # _ENCLOSED_IN_TAGS matches on expressions with XML-style tags (e.g. '<Age>23</Age>')
 # putting the tag name in the first capturing group, and the contents in the second
@@ -7,6 +8,10 @@ from typing import List, Tuple
 # NOTE: This will fail if you have nested annotations.
 _ENCLOSED_IN_TAGS = re.compile(r'<([\w_]*)>([^<]*)<\/\1>')
 
+# _TAG matches a single opening or closing tag, putting the slash of a closing tag in
+# the first capturing group and the tag name in the second. Any other '<' is text.
+_TAG = re.compile(r'<(/?)([A-Za-z_]\w*)>')
+
 def remove_tags(task: str) -> str:
     """remove_tags removes simple XML tags from a text,
     replacing them with their contents."""
@@ -32,4 +37,73 @@ def list_annotations(annotated: str, expected_tags: List[str] = None) -> List[Tu
         if expected_tags is not None and tag_name not in expected_tags:
             continue
         annotations.append((tag_start, tag_end, tag_name))
-    return annotations
\ No newline at end of file
+    return annotations
+
+class MalformedTag(NamedTuple):
+    """MalformedTag is a tag which parse_tags could not use as it is: an opening tag
+    which is never closed ('unclosed'), a closing tag which was never opened ('unopened'),
+    or an annotation inside another annotation ('nested'). The position is the index
+    of the tag in the annotated text."""
+    position: int
+    tag: str
+    problem: str
+
+class ParsedTags(NamedTuple):
+    text: str
+    annotations: List[Tuple[int, int, str]]
+    malformed: List[MalformedTag]
+
+def parse_tags(annotated: str, expected_tags: List[str] = None) -> ParsedTags:
+    """parse_tags reads an annotated text in one scan, returning the text without tags,
+    the (start, end, tag) character spans of the annotations in it (only those with
+    expected_tags, if given), and the malformed tags it found.
+
+    Unlike remove_tags and list_annotations, it removes every tag, whether it is closed
+    or not, and keeps any '<' which does not start a tag as text. A closing tag closes
+    the innermost open tag with its name, and any tags opened inside that one are
+    unclosed. Annotations inside another annotation are dropped, since the entities of
+    a document cannot overlap."""
+    # Splitting on the tags gives the text before the first tag, then the slash, name
+    # and following text of each tag
+    pieces = _TAG.split(annotated)
+    expected = set(expected_tags) if expected_tags is not None else None
+    length = len(pieces[0])
+    position = length
+    # The open tags, innermost last, as (name, start in the text, position in annotated)
+    open_tags = []
+    # How many tags of each name are open, so closing tags which were never opened are
+    # found without looking through the open tags
+    open_counts = collections.Counter()
+    spans = []
+    malformed = []
+    for i in range(1, len(pieces), 3):
+        closing, name, text = pieces[i], pieces[i + 1], pieces[i + 2]
+        tag_at = position
+        position += len(closing) + len(name) + 2 + len(text)
+        if not closing:
+            open_tags.append((name, length, tag_at))
+            open_counts[name] += 1
+        elif open_counts[name] == 0:
+            malformed.append(MalformedTag(tag_at, name, 'unopened'))
+        else:
+            while open_tags[-1][0] != name:
+                unclosed, _, opened_at = open_tags.pop()
+                open_counts[unclosed] -= 1
+                malformed.append(MalformedTag(opened_at, unclosed, 'unclosed'))
+            _, start, opened_at = open_tags.pop()
+            open_counts[name] -= 1
+            if expected is None or name in expected:
+                spans.append((start, length, name, opened_at))
+        length += len(text)
+    for unclosed, _, opened_at in open_tags:
+        malformed.append(MalformedTag(opened_at, unclosed, 'unclosed'))
+
+    # Inner spans are closed (and listed) before the spans around them
+    annotations = []
+    for start, end, name, opened_at in sorted(spans, key=lambda span: (span[0], -span[1], span[3])):
+        if annotations and start < annotations[-1][1]:
+            malformed.append(MalformedTag(opened_at, name, 'nested'))
+            continue
+        annotations.append((start, end, name))
+    malformed.sort()
+    return ParsedTags(''.join(pieces[::3]), annotations, malformed)
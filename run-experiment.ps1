@@ -1,25 +1 @@
-pipenv run python eval.py --prompt_path prompts/null.txt --mode annotate --dataset norsynthclinical --model spacy --output results/baseline-annotate-norsynth.json
-pipenv run python eval.py --prompt_path prompts/null.txt --mode annotate --dataset norsynthclinical --model spacy --output results/baseline-annotate-norsynth-single.json --singleClass
-pipenv run python eval.py --prompt_path prompts/null.txt --mode replace --dataset norsynthclinical --model spacy --output results/baseline-redact-norsynth.json
-pipenv run python eval.py --prompt_path prompts/null.txt --mode annotate --dataset synthdeid --model spacy --output results/baseline-annotate-synthdata.json
-pipenv run python eval.py --prompt_path prompts/null.txt --mode annotate --dataset synthdeid --model spacy --output results/baseline-annotate-synthdata-single.json --singleClass
-pipenv run python eval.py --prompt_path prompts/null.txt --mode replace --dataset synthdeid --model spacy --output results/baseline-redact-synthdata.json
-pipenv run python eval.py --prompt_path prompts/gpt_annotate_example.txt --mode annotate --dataset norsynthclinical --model gpt-chat --modelName gpt-4 --openAIKey $Env:OPENAI_API_KEY --output results/gpt-4-annotate-norsynth.json
-pipenv run python eval.py --prompt_path prompts/gpt_annotate_example.txt --mode annotate --dataset norsynthclinical --model gpt-chat --modelName gpt-4 --openAIKey $Env:OPENAI_API_KEY --output results/gpt-4-annotate-norsynth-single.json --singleClass
-pipenv run python eval.py --prompt_path prompts/gpt_replace_example.txt --mode replace --dataset norsynthclinical --model gpt-chat --modelName gpt-4 --openAIKey $Env:OPENAI_API_KEY --output results/gpt-4-replace-norsynth.json
-
-pipenv run python eval.py --prompt_path prompts/gpt_annotate_example.txt --mode annotate --dataset synthdeid --model gpt-chat --modelName gpt-4 --openAIKey $Env:OPENAI_API_KEY --output results/gpt-4-annotate-synthdata.json
-pipenv run python eval.py --prompt_path prompts/gpt_annotate_example.txt --mode annotate --dataset synthdeid --model gpt-chat --modelName gpt-4 --openAIKey $Env:OPENAI_API_KEY --output results/gpt-4-annotate-synthdata-single.json --singleClass
-pipenv run python eval.py --prompt_path prompts/gpt_replace_example.txt --mode replace --dataset synthdeid --model gpt-chat --modelName gpt-4 --openAIKey $Env:OPENAI_API_KEY --output results/gpt-4-replace-synthdata.json
-pipenv run python eval.py --prompt_path prompts/gpt_annotate_example.txt --mode annotate --dataset norsynthclinical --model gpt-chat --modelName gpt-3.5-turbo --openAIKey $Env:OPENAI_API_KEY --output results/gpt-3.5-annotate-norsynth.json
-pipenv run python eval.py --prompt_path prompts/gpt_annotate_example.txt --mode annotate --dataset norsynthclinical --model gpt-chat --modelName gpt-3.5-turbo --openAIKey $Env:OPENAI_API_KEY --output results/gpt-3.5-annotate-norsynth-single.json --singleClass
-pipenv run python eval.py --prompt_path prompts/gpt_replace_example.txt --mode replace --dataset norsynthclinical --model gpt-chat --modelName gpt-3.5-turbo --openAIKey $Env:OPENAI_API_KEY --output results/gpt-3.5-replace-norsynth.json
-pipenv run python eval.py --prompt_path prompts/gpt_annotate_example.txt --mode annotate --dataset synthdeid --model gpt-chat --modelName gpt-3.5-turbo --openAIKey $Env:OPENAI_API_KEY --output results/gpt-3.5-annotate-synthdata.json
-pipenv run python eval.py --prompt_path prompts/gpt_annotate_example.txt --mode annotate --dataset synthdeid --model gpt-chat --modelName gpt-3.5-turbo --openAIKey $Env:OPENAI_API_KEY --output results/gpt-3.5-annotate-synthdata-single.json --singleClass
-pipenv run python eval.py --prompt_path prompts/gpt_replace_example.txt --mode replace --dataset synthdeid --model gpt-chat --modelName gpt-3.5-turbo --openAIKey $Env:OPENAI_API_KEY --output results/gpt-3.5-replace-synthdata.json
-pipenv run python eval.py --prompt_path prompts/gpt_annotate_example.txt --mode annotate --dataset norsynthclinical --model davinci-edit --modelName text-davinci-edit-001 --openAIKey $Env:OPENAI_API_KEY --output results/gpt-3-annotate-norsynth.json
-pipenv run python eval.py --prompt_path prompts/gpt_annotate_example.txt --mode annotate --dataset norsynthclinical --model davinci-edit --modelName text-davinci-edit-001 --openAIKey $Env:OPENAI_API_KEY --output results/gpt-3-annotate-norsynth-single.json --singleClass
-pipenv run python eval.py --prompt_path prompts/gpt_replace_example.txt --mode replace --dataset norsynthclinical --model davinci-edit --modelName text-davinci-edit-001 --openAIKey $Env:OPENAI_API_KEY --output results/gpt-3-replace-norsynth.json
-pipenv run python eval.py --prompt_path prompts/gpt_annotate_example.txt --mode annotate --dataset synthdeid --model davinci-edit --modelName text-davinci-edit-001 --openAIKey $Env:OPENAI_API_KEY --output results/gpt-3-annotate-synthdata.json
-pipenv run python eval.py --prompt_path prompts/gpt_annotate_example.txt --mode annotate --dataset synthdeid --model davinci-edit --modelName text-davinci-edit-001 --openAIKey $Env:OPENAI_API_KEY --output results/gpt-3-annotate-synthdata-single.json --singleClass
-pipenv run python eval.py --prompt_path prompts/gpt_replace_example.txt --mode replace --dataset synthdeid --model davinci-edit --modelName text-davinci-edit-001 --openAIKey $Env:OPENAI_API_KEY --output results/gpt-3-replace-synthdata.json
+pipenv run python run_experiments.py --matrix experiments.yaml
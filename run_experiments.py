@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+run_experiments.py
+Runs a matrix of eval.py experiments in one process (see experiments.yaml).
+
+Each spaCy pipeline and dataset is loaded once and shared by all runs, and
+runs which use the same model share one model instance. Runs which share
+their journaled answers (e.g. which only differ in singleClass, see
+eval.JOURNAL_ARGUMENTS) are run one after the other, and all but the first
+score the answers journaled by the first instead of predicting them again.
+Runs with different models are run in parallel threads, with at most
+`workers` at a time.
+"""
+
+import concurrent.futures
+import csv
+import itertools
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, List
+
+from tap import Tap
+import spacy
+import yaml
+
+import eval
+import models.utilities.perf
+
+SUMMARY_COLUMNS = ['name', 'model', 'modelName', 'dataset', 'mode', 'singleClass', 'precision', 'recall', 'f1', 'seconds',
+                   'documents_per_second', 'peak_rss_mb', 'output', 'error']
+
+class MatrixArguments(Tap):
+    matrix: str = 'experiments.yaml'
+    """Path to the experiment matrix"""
+    names: List[str] = []
+    """Only run the experiments with these names (default: all)"""
+    workers: int = None
+    """How many models to run at once (default: as set in the matrix, or 1)"""
+    summary: str = None
+    """CSV file to write the summary table to (default: as set in the matrix)"""
+    dry_run: bool = False
+    """Only list the runs in the matrix"""
+
+def expand_matrix(matrix: dict, names: List[str] = None) -> List[Dict[str, Any]]:
+    """expand_matrix returns the settings of every run in the matrix, with the name of the
+    experiment it belongs to under 'name'."""
+    labels = matrix.get('labels', {})
+    runs = []
+    for experiment in matrix['experiments']:
+        if names and experiment['name'] not in names:
+            continue
+        settings = {**matrix.get('defaults', {}), **experiment}
+        axes = {key: value for key, value in settings.items() if isinstance(value, list)}
+        for values in itertools.product(*axes.values()):
+            run = {**settings, **dict(zip(axes, values))}
+            if run.get('mode') == 'replace' and run.get('singleClass'):
+                continue
+            fields = {key: labels.get(value, value) if isinstance(value, str) else value for key, value in run.items()}
+            fields['single'] = '-single' if run.get('singleClass') else ''
+            runs.append({key: os.path.expandvars(value.format(**fields)) if isinstance(value, str) else value
+                         for key, value in run.items()})
+    return runs
+
+def to_arguments(run: Dict[str, Any]) -> eval.ExperimentArguments:
+    settings = {key: value for key, value in run.items() if key != 'name'}
+    unknown = set(settings) - set(eval.ExperimentArguments.__annotations__)
+    if unknown:
+        raise KeyError(f"Unknown settings in experiment {run['name']}: {sorted(unknown)}")
+    args = eval.ExperimentArguments().from_dict(settings)
+    # from_dict skips the checks parse_args makes
+    args.process_args()
+    return args
+
+def _model_key(args: eval.ExperimentArguments, prompt: str) -> tuple:
+    """_model_key returns what the model of a run is loaded from."""
+    return (prompt,) + tuple(repr(getattr(args, name)) for name in eval.MODEL_ARGUMENTS)
+
+def _group_key(args: eval.ExperimentArguments, prompt: str) -> tuple:
+    """_group_key returns the part of the model key which is part of the journal key of the
+    run as well (see eval.JOURNAL_ARGUMENTS), leaving out how requests are sent and cached.
+    Runs in different groups, which run at the same time, so never share journaled answers."""
+    return (prompt,) + tuple(repr(getattr(args, name)) for name in eval.MODEL_ARGUMENTS if name in eval.JOURNAL_ARGUMENTS)
+
+class SharedResources:
+    """SharedResources loads prompts, spaCy pipelines and datasets once, for all threads."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded = {}
+
+    def _get(self, key: tuple, load):
+        with self._lock:
+            if key not in self._loaded:
+                self._loaded[key] = load()
+            return self._loaded[key]
+
+    def prompt(self, path: str) -> str:
+        def load():
+            with open(path, 'r', encoding='utf-8') as prompt_file:
+                return prompt_file.read()
+        return self._get(('prompt', path), load)
+
+    def pipeline(self, name: str, full: bool = False) -> spacy.language.Language:
+        def load():
+            logging.debug(f'Loading pipeline {name}')
+            return eval.load_pipeline(name, full)
+        return self._get(('pipeline', name, full), load)
+
+    def dataset(self, name: str, pipeline: str) -> spacy.tokens.DocBin:
+        nlp = self.pipeline(pipeline)
+        def load():
+            logging.debug(f'Loading dataset {name}')
+            return eval.load_dataset(name, nlp)
+        return self._get(('dataset', name, pipeline), load)
+
+def run_model_group(runs: List[Dict[str, Any]], resources: SharedResources) -> List[Dict[str, Any]]:
+    """run_model_group runs all the runs of a group (see _group_key), one at a time,
+    returning a row of the summary table for each. Runs with the same model key
+    (see _model_key) share one instance of the model."""
+    loaded = {}
+    predicted = set()
+    rows = []
+    for run in runs:
+        args = to_arguments(run)
+        row = {'name': run['name'], 'model': args.model, 'modelName': args.modelName, 'dataset': args.dataset,
+               'mode': args.mode, 'singleClass': args.singleClass, 'output': args.output}
+        start = time.perf_counter()
+        # Each run records to a Recorder of its own, so its perf section only covers that run
+        # even when several groups run at once (peak memory is still that of the whole process)
+        with models.utilities.perf.recording(models.utilities.perf.Recorder(trace=args.perfTrace is not None)):
+            try:
+                prompt = resources.prompt(args.prompt_path)
+                nlp = resources.pipeline(args.spacyPipeline, args.fullPipeline)
+                doc_bin = resources.dataset(args.dataset, args.spacyPipeline)
+                model_key = _model_key(args, prompt)
+                if model_key not in loaded:
+                    logging.debug(f'Loading model {args.model}')
+                    loaded[model_key] = eval.load_model(args.model, prompt, args)
+                # Only the first run with the same journaled answers asks the model,
+                # the rest score the answers it journaled
+                predictions = eval.journal_key(args, prompt)
+                if predictions in predicted:
+                    args.resume = True
+                evaluation = eval.evaluate(args, prompt, nlp, loaded[model_key], doc_bin)
+                predicted.add(predictions)
+                row.update(summarize(evaluation))
+            except Exception as e:
+                logging.exception(f"Run {run['name']} on {args.dataset} ({args.mode}) failed")
+                row['error'] = repr(e)
+        row['seconds'] = round(time.perf_counter() - start, 2)
+        rows.append(row)
+    return rows
+
+def summarize(evaluation: dict) -> dict:
+    """summarize picks the headline metrics and performance from the results of either mode."""
+    if evaluation is None:
+        return {}
+    if 'f1' in evaluation:
+        row = {'precision': evaluation['precision'], 'recall': evaluation['recall'], 'f1': evaluation['f1']}
+    else:
+        row = {'precision': evaluation.get('ents_p'), 'recall': evaluation.get('ents_r'), 'f1': evaluation.get('ents_f')}
+    perf = evaluation.get('perf') or {}
+    row['documents_per_second'] = (perf.get('throughput') or {}).get('documents_per_second')
+    row['peak_rss_mb'] = perf.get('peak_rss_mb')
+    return row
+
+def run_matrix(runs: List[Dict[str, Any]], workers: int = 1) -> List[Dict[str, Any]]:
+    """run_matrix runs the runs in groups (see _group_key), running up to workers groups at a time.
+    The summary rows are returned in the order of the runs."""
+    resources = SharedResources()
+    groups = {}
+    for run in runs:
+        args = to_arguments(run)
+        groups.setdefault(_group_key(args, resources.prompt(args.prompt_path)), []).append(run)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(lambda group: run_model_group(group, resources), groups.values()))
+    rows = {id(run): row for group, group_rows in zip(groups.values(), results) for run, row in zip(group, group_rows)}
+    return [rows[id(run)] for run in runs]
+
+def write_summary(rows: List[Dict[str, Any]], path: str):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w', encoding='utf8', newline='') as summary_file:
+        writer = csv.DictWriter(summary_file, fieldnames=SUMMARY_COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+def print_summary(rows: List[Dict[str, Any]]):
+    columns = ['name', 'dataset', 'mode', 'singleClass', 'precision', 'recall', 'f1', 'seconds']
+    format_value = lambda value: f'{value:.4f}' if isinstance(value, float) else ('' if value is None else str(value))
+    table = [columns] + [[format_value(row.get(column)) for column in columns] for row in rows]
+    widths = [max(len(line[i]) for line in table) for i in range(len(columns))]
+    for line in table:
+        print('  '.join(value.ljust(width) for value, width in zip(line, widths)))
+
+def main(args: MatrixArguments):
+    with open(args.matrix, 'r', encoding='utf8') as matrix_file:
+        matrix = yaml.safe_load(matrix_file)
+    runs = expand_matrix(matrix, args.names)
+    if args.dry_run:
+        for run in runs:
+            args = to_arguments(run)
+            print(f"{run['name']}: {args.model} on {args.dataset} ({args.mode}{', single class' if args.singleClass else ''}) -> {args.output}")
+        return
+
+    start = time.perf_counter()
+    rows = run_matrix(runs, args.workers or matrix.get('workers', 1))
+    print(f"Ran {len(rows)} experiments in {time.perf_counter() - start:.1f} seconds:")
+    print_summary(rows)
+    summary = args.summary or matrix.get('summary')
+    if summary:
+        write_summary(rows, summary)
+
+if __name__ == '__main__':
+    args = MatrixArguments().parse_args()
+    main(args)
@@ -0,0 +1,204 @@
+"""
+alignment.py
+Implements a Needleman-Wunsch aligner for token sequences, vectorized
+with NumPy over integer-interned tokens, and an anchored, linear-memory
+variant for long documents.
+"""
+
+import bisect
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+# GAP marks the missing side of an aligned pair, e.g. (3, GAP) means
+# source token 3 was removed from the response.
+GAP = -1
+
+# The weights match the defaults of string2string's NeedlemanWunsch,
+# which earlier versions of the scorer used.
+MATCH_WEIGHT = 1
+MISMATCH_WEIGHT = -1
+GAP_WEIGHT = -1
+
+_MATCH, _MISMATCH = np.int32(MATCH_WEIGHT), np.int32(MISMATCH_WEIGHT)
+
+# Sub-problems with at most this many score matrix cells are aligned with
+# a full matrix in the anchored mode; larger ones are split in half first.
+MAX_MATRIX_CELLS = 1 << 20
+# Exact runs of at least this many tokens are locked in as anchors
+# in the anchored mode.
+MIN_ANCHOR_LENGTH = 8
+
+def intern_tokens(source: Sequence[str], response: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """intern_tokens maps the tokens of both sequences to integer IDs,
+    so that equal tokens get equal IDs."""
+    vocabulary = {}
+    source_ids = np.fromiter((vocabulary.setdefault(t, len(vocabulary)) for t in source), dtype=np.int32, count=len(source))
+    response_ids = np.fromiter((vocabulary.setdefault(t, len(vocabulary)) for t in response), dtype=np.int32, count=len(response))
+    return source_ids, response_ids
+
+def _next_row(previous: np.ndarray, source_id: int, response_ids: np.ndarray, i: int, column_gaps: np.ndarray, best: np.ndarray) -> np.ndarray:
+    """_next_row computes row i of the score matrix from row i-1.
+
+    The diagonal and vertical moves only depend on the previous row and are
+    computed as whole-row array operations. The horizontal moves chain along
+    the row, but with a linear gap weight they reduce to a running maximum:
+    H[i, j] = max_k (best[k] + (j - k) * GAP_WEIGHT), which is
+    np.maximum.accumulate over best[k] - k * GAP_WEIGHT."""
+    substitution = np.where(response_ids == source_id, _MATCH, _MISMATCH)
+    best[0] = i * GAP_WEIGHT
+    np.maximum(previous[:-1] + substitution, previous[1:] + GAP_WEIGHT, out=best[1:])
+    return np.maximum.accumulate(best - column_gaps) + column_gaps
+
+def score_matrix(source_ids: np.ndarray, response_ids: np.ndarray) -> np.ndarray:
+    """score_matrix fills the (n+1) x (m+1) Needleman-Wunsch score matrix
+    one row at a time."""
+    n, m = len(source_ids), len(response_ids)
+    scores = np.empty((n + 1, m + 1), dtype=np.int32)
+    column_gaps = np.arange(m + 1, dtype=np.int32) * GAP_WEIGHT
+    scores[0] = column_gaps
+    best = np.empty(m + 1, dtype=np.int32)
+    for i in range(1, n + 1):
+        scores[i] = _next_row(scores[i - 1], source_ids[i - 1], response_ids, i, column_gaps, best)
+    return scores
+
+def last_row(source_ids: np.ndarray, response_ids: np.ndarray) -> np.ndarray:
+    """last_row returns the final row of the score matrix, keeping only
+    two rows in memory."""
+    m = len(response_ids)
+    column_gaps = np.arange(m + 1, dtype=np.int32) * GAP_WEIGHT
+    row = column_gaps.copy()
+    best = np.empty(m + 1, dtype=np.int32)
+    for i in range(1, len(source_ids) + 1):
+        row = _next_row(row, source_ids[i - 1], response_ids, i, column_gaps, best)
+    return row
+
+def backtrack(scores: np.ndarray, source_ids: np.ndarray, response_ids: np.ndarray) -> List[Tuple[int, int]]:
+    """backtrack recovers one optimal alignment from a score matrix.
+
+    Ties are broken in the same order as string2string's NeedlemanWunsch:
+    diagonal first, then a gap in the source, then a gap in the response."""
+    source_list, response_list = source_ids.tolist(), response_ids.tolist()
+    pairs = []
+    i, j = len(source_list), len(response_list)
+    while i > 0 and j > 0:
+        current = scores.item(i, j)
+        weight = MATCH_WEIGHT if source_list[i - 1] == response_list[j - 1] else MISMATCH_WEIGHT
+        if current == scores.item(i - 1, j - 1) + weight:
+            i, j = i - 1, j - 1
+            pairs.append((i, j))
+        elif current == scores.item(i, j - 1) + GAP_WEIGHT:
+            j -= 1
+            pairs.append((GAP, j))
+        else:
+            i -= 1
+            pairs.append((i, GAP))
+    while i > 0:
+        i -= 1
+        pairs.append((i, GAP))
+    while j > 0:
+        j -= 1
+        pairs.append((GAP, j))
+    pairs.reverse()
+    return pairs
+
+def align_tokens(source: Sequence[str], response: Sequence[str]) -> List[Tuple[int, int]]:
+    """align_tokens globally aligns two token sequences, returning a list of
+    (source index, response index) pairs in order. Tokens present in only
+    one of the sequences are paired with GAP."""
+    source_ids, response_ids = intern_tokens(source, response)
+    scores = score_matrix(source_ids, response_ids)
+    return backtrack(scores, source_ids, response_ids)
+
+def _unique_grams(ids: List[int], length: int) -> dict:
+    """_unique_grams maps every n-gram of the given length which occurs
+    exactly once in ids to its start position."""
+    positions = {}
+    for start in range(len(ids) - length + 1):
+        gram = tuple(ids[start:start + length])
+        positions[gram] = -1 if gram in positions else start
+    return {gram: start for gram, start in positions.items() if start >= 0}
+
+def _longest_chain(candidates: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """_longest_chain returns the longest subsequence of (i, j) pairs, sorted
+    on i, in which j is also increasing (patience sorting)."""
+    tails, tail_indices, previous = [], [], [-1] * len(candidates)
+    for index, (_, j) in enumerate(candidates):
+        position = bisect.bisect_left(tails, j)
+        if position > 0:
+            previous[index] = tail_indices[position - 1]
+        if position == len(tails):
+            tails.append(j)
+            tail_indices.append(index)
+        else:
+            tails[position] = j
+            tail_indices[position] = index
+    chain = []
+    index = tail_indices[-1] if tail_indices else -1
+    while index >= 0:
+        chain.append(candidates[index])
+        index = previous[index]
+    chain.reverse()
+    return chain
+
+def find_anchors(source_ids: np.ndarray, response_ids: np.ndarray, min_length: int = MIN_ANCHOR_LENGTH) -> List[Tuple[int, int, int]]:
+    """find_anchors finds long exact runs shared by both sequences, returned as
+    (source start, response start, length) triples in increasing order.
+
+    Runs are seeded from n-grams which occur exactly once in each sequence,
+    keeping the longest chain of seeds which is in order in both, and then
+    extended in both directions as far as the tokens match."""
+    source_list, response_list = source_ids.tolist(), response_ids.tolist()
+    n, m = len(source_list), len(response_list)
+    source_grams = _unique_grams(source_list, min_length)
+    response_grams = _unique_grams(response_list, min_length)
+    candidates = sorted((i, response_grams[gram]) for gram, i in source_grams.items() if gram in response_grams)
+
+    anchors = []
+    end_i, end_j = 0, 0
+    for i, j in _longest_chain(candidates):
+        if i < end_i or j < end_j:
+            # Already covered by (or overlapping) the previous anchor
+            continue
+        while i > end_i and j > end_j and source_list[i - 1] == response_list[j - 1]:
+            i, j = i - 1, j - 1
+        length = 0
+        while i + length < n and j + length < m and source_list[i + length] == response_list[j + length]:
+            length += 1
+        anchors.append((i, j, length))
+        end_i, end_j = i + length, j + length
+    return anchors
+
+def _hirschberg(source_ids: np.ndarray, response_ids: np.ndarray, source_offset: int, response_offset: int, pairs: List[Tuple[int, int]], max_cells: int):
+    """_hirschberg appends an optimal alignment of the two sequences to pairs,
+    splitting the problem in half until the score matrix fits in max_cells."""
+    n, m = len(source_ids), len(response_ids)
+    if n == 0 or m == 0 or n == 1 or (n + 1) * (m + 1) <= max_cells:
+        for i, j in backtrack(score_matrix(source_ids, response_ids), source_ids, response_ids):
+            pairs.append((i + source_offset if i != GAP else GAP, j + response_offset if j != GAP else GAP))
+        return
+
+    middle = n // 2
+    forward = last_row(source_ids[:middle], response_ids)
+    backward = last_row(source_ids[middle:][::-1], response_ids[::-1])
+    split = int(np.argmax(forward + backward[::-1]))
+    _hirschberg(source_ids[:middle], response_ids[:split], source_offset, response_offset, pairs, max_cells)
+    _hirschberg(source_ids[middle:], response_ids[split:], source_offset + middle, response_offset + split, pairs, max_cells)
+
+def align_tokens_anchored(source: Sequence[str], response: Sequence[str], min_anchor_length: int = MIN_ANCHOR_LENGTH, max_cells: int = MAX_MATRIX_CELLS) -> List[Tuple[int, int]]:
+    """align_tokens_anchored aligns two token sequences like align_tokens, but in
+    memory linear in their length: long exact runs are locked in as anchors, and
+    only the gaps between them are aligned, using Hirschberg's divide-and-conquer
+    algorithm.
+
+    The result is not guaranteed to be identical to align_tokens: anchors are
+    fixed up front, and ties between equally good alignments may be broken
+    differently. For near-identical sequences the cost is close to linear."""
+    source_ids, response_ids = intern_tokens(source, response)
+    pairs = []
+    i, j = 0, 0
+    for anchor_i, anchor_j, length in find_anchors(source_ids, response_ids, min_anchor_length) + [(len(source_ids), len(response_ids), 0)]:
+        _hirschberg(source_ids[i:anchor_i], response_ids[j:anchor_j], i, j, pairs, max_cells)
+        pairs.extend((anchor_i + k, anchor_j + k) for k in range(length))
+        i, j = anchor_i + length, anchor_j + length
+    return pairs
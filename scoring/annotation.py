@@ -0,0 +1,319 @@
+import collections
+import re
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import spacy
+from spacy.attrs import ENT_IOB, ENT_TYPE, IDX, IS_SPACE, LENGTH, ORTH, SPACY
+from spacy.scorer import PRFScore
+
+from models.utilities.perf import count, timer
+from scoring.entities import EntityTable, UNALIGNED, count_entities, iob_spans
+
+# The ways entities are scored, as (whether all entities are put in a single
+# PHI class, whether entities are split into one entity per token). Every
+# variant is scored from the same answers.
+VARIANTS = {
+    'per_label': (False, False),
+    'per_label_tokens': (False, True),
+    'single_class': (True, False),
+    'single_class_tokens': (True, True),
+}
+DEFAULT_VARIANT = 'per_label'
+# What eval.py --singleClass reports
+SINGLE_CLASS_VARIANT = 'single_class_tokens'
+
+SINGLE_CLASS_LABEL = 'PHI'
+
+# The counts kept for each label of each document (see Scorer.document_counts)
+DOCUMENT_COUNT_COLUMNS = ['tp', 'fp', 'fn']
+
+_WHITESPACE = re.compile(r'\s')
+
+# How many examples to collect before counting their entities together
+CHUNK_SIZE = 2048
+
+# The token attributes the scorer reads, as columns of Doc.to_array. Docs which
+# agree on the first two have the same tokens.
+_ATTRS = [ORTH, SPACY, ENT_IOB, ENT_TYPE]
+_ORTH, _SPACY, _ENTS = 0, 1, slice(2, 4)
+# The token attributes needed to score examples with different tokens
+_SPAN_ATTRS = [IDX, LENGTH, IS_SPACE]
+
+class Scorer:
+    """Scorer scores annotate-mode examples one by one as they arrive, keeping only
+    counts, so the examples can be dropped once their chunk is counted. It gives the same
+    scores as spacy.scorer.Scorer(nlp).score for the tokenizer and (if the pipeline
+    has one, or has_ner is set) the ner component, which are the scores eval.py
+    reports. The entities are scored in every variant in VARIANTS at once.
+
+    The token attributes of the examples are collected as integer arrays and their
+    entities are counted chunk_size examples at a time (see scoring.entities). Most
+    answers have the same tokens as the reference, which is checked for the whole
+    chunk at once, and are scored without aligning them; the rest are aligned by
+    their character offsets where possible."""
+    def __init__(self, nlp: spacy.Language, chunk_size: int = CHUNK_SIZE, has_ner: Optional[bool] = None):
+        self.has_ner = 'ner' in nlp.pipe_names if has_ner is None else has_ner
+        self.chunk_size = chunk_size
+        self.documents = 0
+        self._strings = nlp.vocab.strings
+        self._token_acc = PRFScore()
+        self._token_prf = PRFScore()
+        self._ents_per_type: Dict[str, Dict[str, PRFScore]] = {variant: collections.defaultdict(PRFScore) for variant in VARIANTS}
+        # The nonzero counts of each document, as rows of (document, label id, tp, fp, fn)
+        self._document_counts: Dict[str, List[np.ndarray]] = {variant: [] for variant in VARIANTS}
+        self._labels = [SINGLE_CLASS_LABEL]
+        self._label_ids = {self._strings.add(SINGLE_CLASS_LABEL): 0}
+        self._is_space: Dict[int, bool] = {}
+        self._without_whitespace: Dict[int, str] = {}
+        self._reset_chunk()
+
+    def add(self, example: spacy.training.Example):
+        """add reads the token attributes of an example. Whether its tokens are the same
+        as the reference is found for the whole chunk at once, when it is counted."""
+        self.documents += 1
+        self._gold.append(example.reference.to_array(_ATTRS))
+        self._pred.append(example.predicted.to_array(_ATTRS))
+        self._examples.append(example)
+        if len(self._gold) >= self.chunk_size:
+            self._flush()
+
+    def _stripped(self, orths: np.ndarray) -> List[str]:
+        """_stripped returns the text of each token without whitespace, from the strings of
+        their ORTH hashes, which is much faster than reading the tokens of the Doc."""
+        orths = orths.tolist()
+        for orth in set(orths).difference(self._without_whitespace):
+            self._without_whitespace[orth] = _WHITESPACE.sub('', self._strings[orth])
+        return list(map(self._without_whitespace.__getitem__, orths))
+
+    def _add_retokenized(self, example: spacy.training.Example, gold: np.ndarray, pred: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """_add_retokenized counts the tokens of an example whose predicted and reference
+        tokens differ, returning its alignment (see _align)."""
+        gold_spans = example.reference.to_array(_SPAN_ATTRS)
+        pred_spans = example.predicted.to_array(_SPAN_ATTRS)
+        alignment = _align(example, gold_spans, pred_spans, self._stripped(gold[:, _ORTH]), self._stripped(pred[:, _ORTH]))
+        self._add_tokenization(example, gold_spans, pred_spans, alignment)
+        return alignment
+
+    def _add_tokenization(self, example: spacy.training.Example, gold_spans: np.ndarray, pred_spans: np.ndarray, alignment: Tuple[np.ndarray, np.ndarray]):
+        """_add_tokenization counts like spacy.scorer.Scorer.score_tokenization, for
+        an example where the predicted and reference tokens differ."""
+        if example.reference.has_unknown_spaces:
+            return
+        first, last = alignment
+        pred_kept = pred_spans[:, 2] == 0
+        one_to_one = (first == last) & (first != UNALIGNED)
+        tp = int(np.count_nonzero(one_to_one[pred_kept]))
+        self._token_acc.tp += tp
+        self._token_acc.fp += int(np.count_nonzero(pred_kept)) - tp
+        self._token_prf.score_set(_token_spans(pred_spans), _token_spans(gold_spans))
+
+    def _add_same_tokenization(self, orths: np.ndarray):
+        """_add_same_tokenization counts the tokens of examples with the same predicted and
+        reference tokens, which are all aligned one to one and have the same spans."""
+        hashes, counts = np.unique(orths, return_counts=True)
+        tokens = 0
+        for orth, n in zip(hashes.tolist(), counts.tolist()):
+            is_space = self._is_space.get(orth)
+            if is_space is None:
+                is_space = self._is_space[orth] = self._strings[orth].isspace()
+            if not is_space:
+                tokens += n
+        self._token_acc.tp += tokens
+        self._token_prf.tp += tokens
+
+    def _reset_chunk(self):
+        self._gold: List[np.ndarray] = []
+        self._pred: List[np.ndarray] = []
+        self._examples: List[spacy.training.Example] = []
+
+    def _label_array(self, types: np.ndarray) -> np.ndarray:
+        """_label_array maps entity type hashes to label ids."""
+        hashes, inverse = np.unique(types, return_inverse=True)
+        ids = np.empty(len(hashes), dtype=np.int64)
+        for i, label_hash in enumerate(hashes.tolist()):
+            if label_hash not in self._label_ids:
+                self._label_ids[label_hash] = len(self._labels)
+                self._labels.append(self._strings[label_hash])
+            ids[i] = self._label_ids[label_hash]
+        return ids[inverse.reshape(-1)]
+
+    def _flush(self):
+        if not self._gold:
+            return
+        with timer('score.count'):
+            self._count_chunk()
+
+    def _count_chunk(self):
+        """_count_chunk counts the tokens of the examples collected so far, and their
+        entities in every variant."""
+        gold_lengths = np.array([len(gold) for gold in self._gold])
+        pred_lengths = np.array([len(pred) for pred in self._pred])
+        gold_offsets = np.cumsum(gold_lengths) - gold_lengths
+        pred_offsets = np.cumsum(pred_lengths) - pred_lengths
+        gold = np.concatenate(self._gold)
+        pred = np.concatenate(self._pred)
+        pred_doc = np.repeat(np.arange(len(self._pred)), pred_lengths)
+
+        # The reference tokens each predicted token is aligned to, in global positions,
+        # which for examples with the same tokens are the tokens at the same place
+        first = np.arange(len(pred)) + (gold_offsets - pred_offsets)[pred_doc]
+        retokenized = _retokenized(gold, pred, pred_doc, first, gold_lengths != pred_lengths)
+        last = first.copy()
+        if len(retokenized):
+            count('score.retokenized', len(retokenized))
+            with timer('score.align'):
+                for doc in retokenized.tolist():
+                    alignment = self._add_retokenized(self._examples[doc], self._gold[doc], self._pred[doc])
+                    tokens = slice(pred_offsets[doc], pred_offsets[doc] + pred_lengths[doc])
+                    first[tokens] = np.where(alignment[0] == UNALIGNED, UNALIGNED, alignment[0] + gold_offsets[doc])
+                    last[tokens] = np.where(alignment[1] == UNALIGNED, UNALIGNED, alignment[1] + gold_offsets[doc])
+        same_tokens = np.array([not example.reference.has_unknown_spaces for example in self._examples])
+        same_tokens[retokenized] = False
+        self._add_same_tokenization(pred[same_tokens[pred_doc], _ORTH])
+        if not self.has_ner:
+            self._reset_chunk()
+            return
+        # The entity types are string hashes, which need all 64 bits
+        gold, pred = gold[:, _ENTS], pred[:, _ENTS]
+        gold_iob, pred_iob = gold[:, 0].view(np.int64), pred[:, 0].view(np.int64)
+
+        gold_start, gold_end, gold_types, _ = iob_spans(gold_iob, gold[:, 1])
+        pred_start, _, pred_types, token_entity = iob_spans(pred_iob, pred[:, 1])
+        gold_doc = np.repeat(np.arange(len(self._gold)), gold_lengths)
+        entity_tokens = np.flatnonzero(token_entity >= 0)
+        entity = token_entity[entity_tokens]
+        # Documents are annotated if any token has an ENT_IOB, or if they are empty
+        annotated = (np.bincount(gold_doc[gold_iob != 0], minlength=len(self._gold)) > 0) | (gold_lengths == 0)
+        table = EntityTable(
+            gold_start=gold_start, gold_end=gold_end, gold_label=self._label_array(gold_types), gold_doc=gold_doc[gold_start],
+            predicted_first=first[entity_tokens], predicted_last=last[entity_tokens], predicted_entity=entity,
+            predicted_label=self._label_array(pred_types)[entity], predicted_doc=pred_doc[entity_tokens],
+            missing=np.flatnonzero(gold_iob == 0), annotated=annotated,
+        )
+        first_document = self.documents - len(self._gold)
+        for variant, (single_class, split) in VARIANTS.items():
+            counts = count_entities(table, len(self._labels), 0 if single_class else None, split)
+            tp, fp, fn = counts.tp.sum(axis=0), counts.fp.sum(axis=0), counts.fn.sum(axis=0)
+            ents_per_type = self._ents_per_type[variant]
+            for label_id in np.flatnonzero(counts.seen):
+                score = ents_per_type[self._labels[label_id]]
+                score.tp += int(tp[label_id])
+                score.fp += int(fp[label_id])
+                score.fn += int(fn[label_id])
+            documents, label_ids = np.nonzero(counts.tp | counts.fp | counts.fn)
+            self._document_counts[variant].append(np.stack([
+                documents + first_document, label_ids,
+                counts.tp[documents, label_ids], counts.fp[documents, label_ids], counts.fn[documents, label_ids],
+            ], axis=1))
+        self._reset_chunk()
+
+    def scores(self, wait: bool = True, variant: str = DEFAULT_VARIANT) -> dict:
+        """scores returns the scores of all examples added so far, with the entities
+        scored as in variant. Unlike replacement.Scorer, the examples are scored in
+        this process, so there is never anything to wait for."""
+        self._flush()
+        scores = {'token_acc': None, 'token_p': None, 'token_r': None, 'token_f': None}
+        if len(self._token_acc) > 0:
+            scores = {
+                'token_acc': self._token_acc.precision,
+                'token_p': self._token_prf.precision,
+                'token_r': self._token_prf.recall,
+                'token_f': self._token_prf.fscore,
+            }
+        if self.has_ner:
+            ents_per_type = self._ents_per_type[variant]
+            totals = PRFScore()
+            for prf in ents_per_type.values():
+                totals += prf
+            if len(totals) > 0:
+                scores.update({
+                    'ents_p': totals.precision,
+                    'ents_r': totals.recall,
+                    'ents_f': totals.fscore,
+                    'ents_per_type': {k: v.to_dict() for k, v in ents_per_type.items()},
+                })
+            else:
+                scores.update({'ents_p': None, 'ents_r': None, 'ents_f': None, 'ents_per_type': None})
+        return scores
+
+    def variants(self) -> Dict[str, dict]:
+        """variants returns the scores in every variant in VARIANTS."""
+        return {variant: self.scores(variant=variant) for variant in VARIANTS}
+
+    def document_counts(self, variant: str = DEFAULT_VARIANT) -> Optional[dict]:
+        """document_counts returns the entity counts of every example added so far, in the
+        order they were added, with the entities scored as in variant: 'counts' holds the
+        tp, fp and fn of each label in 'labels' for each example. scoring.stats resamples
+        these to compare runs. Returns None if the pipeline has no ner component."""
+        if not self.has_ner:
+            return None
+        self._flush()
+        labels = list(self._ents_per_type[variant])
+        counts = np.zeros((self.documents, len(self._labels), len(DOCUMENT_COUNT_COLUMNS)), dtype=np.int64)
+        if self._document_counts[variant]:
+            rows = np.concatenate(self._document_counts[variant])
+            counts[rows[:, 0], rows[:, 1]] = rows[:, 2:]
+        label_ids = [self._labels.index(label) for label in labels]
+        return {'labels': labels, 'columns': DOCUMENT_COUNT_COLUMNS, 'counts': counts[:, label_ids].tolist()}
+
+def _token_spans(spans: np.ndarray) -> set:
+    """_token_spans returns the character spans of the tokens which are not whitespace."""
+    kept = spans[spans[:, 2] == 0]
+    return set(zip(kept[:, 0].tolist(), (kept[:, 0] + kept[:, 1]).tolist()))
+
+def _retokenized(gold: np.ndarray, pred: np.ndarray, pred_doc: np.ndarray, position: np.ndarray, other_length: np.ndarray) -> np.ndarray:
+    """_retokenized returns the examples of a chunk whose predicted tokens differ from the
+    reference tokens, given the concatenated token attributes of all of them, and the
+    reference token at the same place as each predicted token."""
+    if not other_length.any():
+        # The tokens of every example are at the same rows on both sides
+        differs = (gold[:, _ORTH] != pred[:, _ORTH]) | (gold[:, _SPACY] != pred[:, _SPACY])
+    elif len(gold) and len(pred):
+        # The places past the end of the reference are in examples of another length
+        position = np.minimum(position, len(gold) - 1)
+        differs = (gold[position, _ORTH] != pred[:, _ORTH]) | (gold[position, _SPACY] != pred[:, _SPACY])
+    else:
+        differs = np.zeros(len(pred), dtype=bool)
+    return np.union1d(np.flatnonzero(other_length), pred_doc[differs])
+
+def _align(example: spacy.training.Example, gold_spans: np.ndarray, pred_spans: np.ndarray, gold_texts: List[str], pred_texts: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """_align returns the first and last reference token each predicted token is aligned
+    to (or UNALIGNED), as in example.alignment.x2y, given the text of every token without
+    whitespace.
+
+    When both Docs have the same text apart from whitespace, spaCy aligns every token to
+    the tokens it shares characters with, skipping whitespace, unless both sides have
+    whitespace at the same point. So if only one of the Docs has whitespace in its tokens,
+    the alignment is found from the token lengths without whitespace. Otherwise, it is
+    left to spaCy."""
+    pred_text = ''.join(pred_texts)
+    if pred_text == ''.join(gold_texts):
+        pred_lengths = pred_spans[:, 1].astype(np.int64)
+        gold_lengths = gold_spans[:, 1].astype(np.int64)
+        # The tokens contain no whitespace if their lengths add up to the text without it
+        pred_whitespace = pred_lengths.sum() != len(pred_text)
+        gold_whitespace = gold_lengths.sum() != len(pred_text)
+        if not (pred_whitespace and gold_whitespace):
+            if pred_whitespace:
+                pred_lengths = np.fromiter(map(len, pred_texts), np.int64, len(pred_texts))
+            if gold_whitespace:
+                gold_lengths = np.fromiter(map(len, gold_texts), np.int64, len(gold_texts))
+            pred_ends = np.cumsum(pred_lengths)
+            gold_ends = np.cumsum(gold_lengths)
+            first = np.searchsorted(gold_ends, pred_ends - pred_lengths, 'right')
+            last = np.searchsorted(gold_ends - gold_lengths, pred_ends, 'left') - 1
+            # Whitespace tokens are not aligned to anything
+            first[pred_lengths == 0] = last[pred_lengths == 0] = UNALIGNED
+            return first, last
+    align_x2y = example.alignment.x2y
+    data = np.asarray(align_x2y.data)
+    ends = np.cumsum(align_x2y.lengths)
+    # spaCy can add an empty alignment for trailing whitespace beyond the last token
+    lengths, ends = np.asarray(align_x2y.lengths)[:len(pred_spans)], ends[:len(pred_spans)]
+    has_alignment = lengths > 0
+    first = np.full(len(lengths), UNALIGNED, dtype=np.int64)
+    last = np.full(len(lengths), UNALIGNED, dtype=np.int64)
+    first[has_alignment] = data[(ends - lengths)[has_alignment]]
+    last[has_alignment] = data[ends[has_alignment] - 1]
+    return first, last
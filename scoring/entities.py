@@ -0,0 +1,142 @@
+"""
+entities.py
+Counts entity matches for many documents at once, from tables of spans
+held as integer arrays, with the same rules as spacy.scorer.get_ner_prf.
+
+Token positions are global: the tokens of all reference documents in a
+table are numbered one after the other, so a span is identified by its
+global start, end and label id alone and the spans of all documents can
+be matched with one set operation.
+"""
+
+from typing import NamedTuple, Tuple
+
+import numpy as np
+
+# Marks a predicted token which is not aligned to any reference token
+UNALIGNED = -1
+
+class EntityTable(NamedTuple):
+    """EntityTable holds the entities of a batch of examples."""
+    gold_start: np.ndarray
+    """The global start of each reference entity"""
+    gold_end: np.ndarray
+    """The global end of each reference entity"""
+    gold_label: np.ndarray
+    """The label id of each reference entity"""
+    gold_doc: np.ndarray
+    """The document of each reference entity"""
+    predicted_first: np.ndarray
+    """The first global reference token each predicted entity token is aligned to, or UNALIGNED"""
+    predicted_last: np.ndarray
+    """The last global reference token each predicted entity token is aligned to, or UNALIGNED"""
+    predicted_entity: np.ndarray
+    """Which predicted entity each predicted entity token belongs to, numbered in order"""
+    predicted_label: np.ndarray
+    """The label id of each predicted entity token"""
+    predicted_doc: np.ndarray
+    """The document of each predicted entity token"""
+    missing: np.ndarray
+    """The sorted global positions of the reference tokens without entity annotation"""
+    annotated: np.ndarray
+    """Whether each reference document has entity annotation"""
+
+class Counts(NamedTuple):
+    """Counts holds the true positives, false positives and false negatives per document
+    and label id (as documents x labels arrays), and which labels were seen (and so get
+    an entry in ents_per_type)."""
+    tp: np.ndarray
+    fp: np.ndarray
+    fn: np.ndarray
+    seen: np.ndarray
+
+def count_entities(table: EntityTable, labels: int, single_class: int = None, split: bool = False) -> Counts:
+    """count_entities counts the matches between the predicted and reference entities in table.
+    If single_class is set, every entity gets that label id, and if split is set, every entity
+    is split into one entity per token. Either of them sets the entities of the whole Doc in
+    spaCy, which marks all other tokens as outside, so then no tokens are missing annotation."""
+    documents = len(table.annotated)
+    gold_start, gold_end, gold_label, gold_doc = table.gold_start, table.gold_end, table.gold_label, table.gold_doc
+    first, last, entity, label, doc = table.predicted_first, table.predicted_last, table.predicted_entity, table.predicted_label, table.predicted_doc
+    missing = table.missing
+    if single_class is None and not split:
+        # Documents without entity annotation are not scored at all
+        gold_kept = table.annotated[gold_doc]
+        predicted_kept = table.annotated[doc]
+        gold_start, gold_end, gold_label, gold_doc = gold_start[gold_kept], gold_end[gold_kept], gold_label[gold_kept], gold_doc[gold_kept]
+        first, last, entity, label, doc = first[predicted_kept], last[predicted_kept], entity[predicted_kept], label[predicted_kept], doc[predicted_kept]
+    else:
+        missing = missing[:0]
+    if single_class is not None:
+        gold_label = np.full_like(gold_label, single_class)
+        label = np.full_like(label, single_class)
+
+    if split:
+        gold_start, gold_end, (gold_label, gold_doc) = split_spans(gold_start, gold_end, gold_label, gold_doc)
+        predicted_start, predicted_end = first, last + 1
+        aligned = first != UNALIGNED
+    else:
+        predicted_start, predicted_end, label, doc, aligned = _merge_tokens(first, last, entity, label, doc)
+
+    # Predictions over tokens without gold annotation are neither right nor wrong
+    scored = aligned & (np.searchsorted(missing, predicted_start, 'left') == np.searchsorted(missing, predicted_end - 1, 'right'))
+
+    positions = max(int(gold_end.max(initial=0)), int(predicted_end.max(initial=0))) + 1
+    gold_keys = np.ravel_multi_index((gold_start, gold_end, gold_label), (positions, positions, labels))
+    scored_start, scored_end, scored_label, scored_doc = predicted_start[scored], predicted_end[scored], label[scored], doc[scored]
+    predicted_keys = np.ravel_multi_index((scored_start, scored_end, scored_label), (positions, positions, labels))
+    # Each reference entity can only be matched once, by the first prediction of it
+    _, first_occurrence = np.unique(predicted_keys, return_index=True)
+    matched = np.zeros(len(predicted_keys), dtype=bool)
+    matched[first_occurrence] = True
+    if len(gold_keys):
+        gold_keys = np.sort(gold_keys)
+        matched &= gold_keys[np.minimum(np.searchsorted(gold_keys, predicted_keys), len(gold_keys) - 1)] == predicted_keys
+    else:
+        matched[:] = False
+
+    tp = _count(scored_doc[matched], scored_label[matched], documents, labels)
+    fp = _count(scored_doc, scored_label, documents, labels) - tp
+    fn = _count(gold_doc, gold_label, documents, labels) - tp
+    seen = (np.bincount(label, minlength=labels) > 0) | (fn.sum(axis=0) > 0)
+    return Counts(tp, fp, fn, seen)
+
+def _count(doc: np.ndarray, label: np.ndarray, documents: int, labels: int) -> np.ndarray:
+    """_count counts the spans of each document and label id, as a documents x labels array."""
+    return np.bincount(doc * labels + label, minlength=documents * labels).reshape(documents, labels)
+
+def iob_spans(iob: np.ndarray, types: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """iob_spans finds the entities in ENT_IOB and ENT_TYPE arrays like Doc.ents does,
+    returning the start, end and type of each entity, and the entity of each token
+    (or -1). Entities never cross documents, as every entity starts with a B token."""
+    # A B token without a type is read as outside
+    begins = (iob == 3) & (types != 0)
+    inside = begins | (iob == 1)
+    token_entity = np.where(inside, np.cumsum(begins) - 1, -1)
+    start = np.flatnonzero(begins)
+    # The tokens of an entity are consecutive
+    lengths = np.bincount(token_entity[inside], minlength=len(start))
+    return start, start + lengths, types[start], token_entity
+
+def split_spans(start: np.ndarray, end: np.ndarray, *columns: np.ndarray) -> Tuple[np.ndarray, np.ndarray, Tuple[np.ndarray, ...]]:
+    """split_spans splits every span into one span per token, repeating the
+    columns (e.g. the label id) of each span for its tokens."""
+    lengths = end - start
+    span = np.repeat(np.arange(len(start)), lengths)
+    # The offset of each token in its span
+    offsets = np.arange(len(span)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    tokens = start[span] + offsets
+    return tokens, tokens + 1, tuple(column[span] for column in columns)
+
+def _merge_tokens(first: np.ndarray, last: np.ndarray, entity: np.ndarray, label: np.ndarray, doc: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """_merge_tokens finds the reference span each predicted entity is aligned to, from the
+    first aligned reference token of its first aligned token to the last of its last."""
+    if len(entity) == 0:
+        empty = entity[:0]
+        return empty, empty, label[:0], doc[:0], np.zeros(0, dtype=bool)
+    # The tokens of an entity are consecutive rows, and the alignment is monotonic
+    starts = np.flatnonzero(np.r_[True, entity[1:] != entity[:-1]])
+    aligned_first = np.minimum.reduceat(np.where(first == UNALIGNED, np.iinfo(first.dtype).max, first), starts)
+    aligned_last = np.maximum.reduceat(last, starts)
+    aligned = aligned_last != UNALIGNED
+    return np.where(aligned, aligned_first, UNALIGNED), aligned_last + 1, label[starts], doc[starts], aligned
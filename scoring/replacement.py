@@ -1,51 +1,172 @@
 import spacy
-from typing import List
-import string2string.alignment
+from typing import List, Tuple
 import collections
+import concurrent.futures
+
+from models.utilities.perf import count, timer
+from scoring.alignment import GAP, align_tokens, align_tokens_anchored
+
+# Documents with more tokens than this are aligned with the linear-memory
+# anchored aligner rather than the full score matrix.
+ANCHORED_THRESHOLD = 2000
+# How many documents each worker process scores per task when scoring in parallel.
+CHUNK_SIZE = 16
+
+# The counts kept for each document (see Scorer.document_counts), as returned by
+# align_tokens_with_labels, followed by the number of source tokens.
+DOCUMENT_COUNT_COLUMNS = ['tp', 'tn', 'fp', 'fn', 'removals', 'rewrites', 'insertions', 'length']
+
+# A Payload is what a worker process needs to score one document:
+# the whitespace-separated source tokens, whether each of them is PHI,
+# the answer, and whether to use the anchored aligner.
+Payload = Tuple[List[str], List[bool], str, bool]
 
 class Scorer:
-    def __init__(self, nlp: spacy.Language):
+    """Scorer scores replace-mode answers against the source documents. Answers can be
+    scored all at once with score, or one by one as they arrive with add, reading the
+    scores so far with scores(wait=False) and the final scores with scores()."""
+    def __init__(self, nlp: spacy.Language, anchored_threshold: int = ANCHORED_THRESHOLD, workers: int = 1, chunk_size: int = CHUNK_SIZE):
         self.nlp = nlp
-        return
+        self.anchored_threshold = anchored_threshold
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self._pool = None
+        self._reset()
+
+    def _reset(self):
+        self.documents = 0
+        self._counts = collections.Counter()
+        self._scored_length = 0
+        self._document_counts: List[List[int]] = []
+        self._chunk = []
+        self._chunk_lengths = []
+        self._pending = collections.deque()
 
     def score(self, doc_bin: spacy.tokens.DocBin, answers: List[str]) -> dict:
-        total_doc_length = 0
-        ctr = collections.Counter()
-        for i, doc in enumerate(doc_bin.get_docs(self.nlp.vocab)):
-            answer = answers[i]
-            results = align_answer(doc, answer)
-            total_doc_length += len(doc)
-            ctr.update(results)
-        rates = {k: v / total_doc_length for (k, v) in ctr.items()}
-        
-        rates['precision'] = rates['tp'] / (rates['tp'] + rates['fp'])
-        rates['recall'] = rates['tp'] / (rates['tp'] + rates['fn'])
-        rates['f1'] = 2.0 * (rates['precision'] * rates['recall']) / (rates['precision'] + rates['recall'])
-        return rates
-
-def align_answer(source, response, gap_char='~'):
-    nw = string2string.alignment.NeedlemanWunsch(gap_char=gap_char)
-    source_split, response_split = str(source).split(), response.split() 
-    source_aligned, response_aligned = nw.get_alignment(source_split, response_split)
-    source_aligned_elems = [p.strip() for p in source_aligned.split(' | ')]
-    response_aligned_elems = [p.strip() for p in response_aligned.split(' | ')]
+        """score returns the scores of the answers to the documents of doc_bin, on their
+        own: answers added before, with add or an earlier call to score, are discarded."""
+        if len(doc_bin) != len(answers):
+            raise ValueError(f"There are {len(answers)} answers to the {len(doc_bin)} documents")
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+        self._reset()
+        for doc, answer in zip(doc_bin.get_docs(self.nlp.vocab), answers):
+            self.add(doc, answer)
+        return self.scores()
+
+    def add(self, doc: spacy.tokens.Doc, answer: str):
+        """add queues an answer for scoring. Answers are scored in chunks of chunk_size,
+        in worker processes if workers > 1."""
+        anchored = len(doc) > self.anchored_threshold
+        if anchored:
+            count('score.anchored')
+        self._chunk.append(make_payload(doc, answer, anchored))
+        self._chunk_lengths.append(len(doc))
+        self.documents += 1
+        if len(self._chunk) >= self.chunk_size:
+            self._flush()
+
+    def _flush(self):
+        if not self._chunk:
+            return
+        if self.workers > 1:
+            if self._pool is None:
+                self._pool = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers)
+            self._pending.append((self._pool.submit(_score_chunk, self._chunk), self._chunk_lengths))
+            # Don't let the queue of chunks grow with the corpus if scoring falls behind
+            while len(self._pending) > 2 * self.workers:
+                self._collect()
+        else:
+            with timer('score.align'):
+                self._add_counts(_score_chunk(self._chunk), self._chunk_lengths)
+        self._chunk = []
+        self._chunk_lengths = []
+
+    def _collect(self):
+        """_collect waits for the oldest chunk being scored in a worker process."""
+        future, lengths = self._pending.popleft()
+        with timer('score.wait'):
+            counts = future.result()
+        self._add_counts(counts, lengths)
+
+    def _add_counts(self, counts: List[dict], lengths: List[int]):
+        for document, length in zip(counts, lengths):
+            self._counts.update(document)
+            self._document_counts.append([document[column] for column in DOCUMENT_COUNT_COLUMNS[:-1]] + [length])
+        self._scored_length += sum(lengths)
+
+    def scores(self, wait: bool = True) -> dict:
+        """scores returns the scores of all answers added so far. With wait=False, it
+        returns without waiting for answers which are still being scored."""
+        if wait:
+            self._flush()
+            while self._pending:
+                self._collect()
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+        else:
+            while self._pending and self._pending[0][0].done():
+                self._collect()
+        return replacement_rates(self._counts, self._scored_length)
+
+    def document_counts(self) -> dict:
+        """document_counts returns the counts of every answer added so far, in the order
+        they were added: 'counts' holds a row of the columns in 'columns' for each answer.
+        scoring.stats resamples these to compare runs. Like scores(), it waits for the
+        answers which are still being scored, but it keeps the worker processes."""
+        self._flush()
+        while self._pending:
+            self._collect()
+        return {'columns': DOCUMENT_COUNT_COLUMNS, 'counts': self._document_counts}
+
+def replacement_rates(counts: collections.Counter, total_doc_length: int) -> dict:
+    """replacement_rates turns the counts from align_tokens_with_labels into rates per
+    source token, with precision, recall and F1."""
+    rates = {k: v / total_doc_length for (k, v) in counts.items()}
+    tp, fp, fn = rates.get('tp', 0.0), rates.get('fp', 0.0), rates.get('fn', 0.0)
+    rates['precision'] = tp / (tp + fp) if tp + fp > 0 else 0.0
+    rates['recall'] = tp / (tp + fn) if tp + fn > 0 else 0.0
+    rates['f1'] = 2.0 * (rates['precision'] * rates['recall']) / (rates['precision'] + rates['recall']) if rates['precision'] + rates['recall'] > 0 else 0.0
+    return rates
+
+def make_payload(source: spacy.tokens.Doc, response: str, anchored: bool = False) -> Payload:
+    """make_payload extracts what align_tokens_with_labels needs from a document,
+    so it can be sent to another process without pickling the Doc."""
+    source_split = str(source).split()
+    # NOTE: The whitespace-separated tokens are looked up by index among the
+    # spaCy tokens, which assumes that the dataset is pre-tokenized.
+    is_phi = [source[i].ent_type_ != "" for i in range(len(source_split))]
+    return source_split, is_phi, response, anchored
+
+def _score_chunk(payloads: List[Payload]) -> List[dict]:
+    return [align_tokens_with_labels(*payload) for payload in payloads]
+
+def align_answer(source, response, anchored: bool = False):
+    return align_tokens_with_labels(*make_payload(source, response, anchored))
+
+def align_tokens_with_labels(source_split: List[str], is_phi: List[bool], response: str, anchored: bool = False) -> dict:
+    response_split = response.split()
+    if anchored:
+        pairs = align_tokens_anchored(source_split, response_split)
+    else:
+        pairs = align_tokens(source_split, response_split)
 
     tp, tn, fp, fn = 0, 0, 0, 0
     insertions, removals, rewrites = 0, 0, 0
-    _gap_chars = 0
     
-    for i, src_token in enumerate(source_aligned_elems):
-        resp_token = response_aligned_elems[i]
-        if src_token == gap_char:
-            # If we find a gap character in the source, there is a token in the response
+    for i, j in pairs:
+        if i == GAP:
+            # If we find a gap in the source, there is a token in the response
             # which is either a spurious token introduced by the model, or a PHI marker
             insertions += 1
-            _gap_chars += 1
             continue
         
-        doc_token = source[i - _gap_chars]
-        if doc_token.ent_type_ == "":
-            if resp_token == gap_char:
+        src_token = source_split[i]
+        resp_token = response_split[j] if j != GAP else None
+        if not is_phi[i]:
+            if resp_token is None:
                 # This word was unnecessarily removed,
                 # count it as a false positive
                 removals += 1
@@ -63,7 +184,7 @@ def align_answer(source, response, gap_char='~'):
                 # Non-PHI kept, true negative
                 tn += 1
         else:
-            if resp_token == gap_char or (resp_token.startswith('<') and resp_token.endswith('>')):
+            if resp_token is None or (resp_token.startswith('<') and resp_token.endswith('>')):
                 # PHI removed or replaced with PHI marker,
                 # true positive
                 tp += 1
@@ -0,0 +1,197 @@
+"""
+stats.py
+Confidence intervals and significance tests for the scores of eval.py runs,
+computed from the per-document counts in their output files (see
+document_counts in scoring.annotation and scoring.replacement).
+
+Every resample is a weighting of the documents: the counts of a resample
+are the weighted sum of the document counts, and its scores are computed
+from those sums just like the scores of the full run. The weights of many
+resamples are drawn at once and applied with a single matrix product, so
+no Examples are scored again.
+"""
+
+from typing import Dict, List, NamedTuple, Tuple
+
+import numpy as np
+
+# Resamples are drawn in batches of about this many document weights, so memory
+# stays bounded on large datasets
+BATCH_ELEMENTS = 1 << 22
+
+# What spacy.scorer.PRFScore adds to its denominators
+_EPSILON = 1e-100
+
+class DocumentCounts(NamedTuple):
+    """DocumentCounts holds the per-document counts of one run."""
+    mode: str
+    """'annotate' or 'replace'"""
+    documents: np.ndarray
+    """The index in the dataset of each document"""
+    labels: List[str]
+    """The entity labels, in annotate mode"""
+    columns: List[str]
+    """The counts kept for each document (and label, in annotate mode)"""
+    counts: np.ndarray
+    """documents x labels x columns counts in annotate mode, documents x columns in replace mode"""
+
+def load_counts(result: dict, variant: str = None) -> DocumentCounts:
+    """load_counts reads the per-document counts from the output of eval.py, for the
+    entities scored as in variant if it is set. Without a list of 'documents', the
+    documents are numbered in order."""
+    if variant is not None:
+        if variant not in result.get('variants', {}):
+            raise KeyError(f"The results have no variant {variant}")
+        result = result['variants'][variant]
+    document_counts = result.get('document_counts')
+    if document_counts is None:
+        raise ValueError("The results have no per-document counts, so they were written by an older eval.py")
+    mode = 'annotate' if 'labels' in document_counts else 'replace'
+    columns = document_counts['columns']
+    counts = np.array(document_counts['counts'], dtype=np.float64)
+    if mode == 'annotate':
+        counts = counts.reshape(len(document_counts['counts']), len(document_counts['labels']), len(columns))
+    else:
+        counts = counts.reshape(len(document_counts['counts']), len(columns))
+    documents = np.array(document_counts.get('documents', range(len(counts))), dtype=np.int64)
+    return DocumentCounts(mode, documents, document_counts.get('labels', []), columns, counts)
+
+def pair_counts(a: DocumentCounts, b: DocumentCounts) -> Tuple[DocumentCounts, DocumentCounts]:
+    """pair_counts keeps the documents scored in both runs, in the same order, and gives
+    both runs the same labels (with zero counts for the labels a run never saw)."""
+    if a.mode != b.mode or a.columns != b.columns:
+        raise ValueError(f"Cannot compare a {a.mode}-mode run with a {b.mode}-mode run")
+    documents, a_rows, b_rows = np.intersect1d(a.documents, b.documents, assume_unique=True, return_indices=True)
+    if len(documents) == 0:
+        raise ValueError("The runs have no documents in common")
+    a, b = a._replace(documents=documents, counts=a.counts[a_rows]), b._replace(documents=documents, counts=b.counts[b_rows])
+    if a.mode == 'annotate' and a.labels != b.labels:
+        labels = a.labels + [label for label in b.labels if label not in a.labels]
+        a, b = _with_labels(a, labels), _with_labels(b, labels)
+    return a, b
+
+def _with_labels(counts: DocumentCounts, labels: List[str]) -> DocumentCounts:
+    padded = np.zeros((len(counts.documents), len(labels), len(counts.columns)))
+    padded[:, [labels.index(label) for label in counts.labels]] = counts.counts
+    return counts._replace(labels=labels, counts=padded)
+
+def metrics(counts: DocumentCounts, totals: np.ndarray) -> Dict[str, np.ndarray]:
+    """metrics computes the scores of eval.py from summed counts, with the same shape
+    as counts.counts but with any number of leading resample dimensions instead of
+    the documents. In annotate mode, these are the micro-averaged ents_p, ents_r and
+    ents_f, and the F-score of each label; in replace mode, the precision, recall
+    and F1, and the removal, rewrite and insertion rates."""
+    if counts.mode == 'annotate':
+        tp, fp, fn = (totals[..., counts.columns.index(column)] for column in ('tp', 'fp', 'fn'))
+        p, r, f = _prf(tp.sum(axis=-1), fp.sum(axis=-1), fn.sum(axis=-1))
+        scores = {'ents_p': p, 'ents_r': r, 'ents_f': f}
+        _, _, label_f = _prf(tp, fp, fn)
+        for i, label in enumerate(counts.labels):
+            scores[f'ents_per_type.{label}.f'] = label_f[..., i]
+        return scores
+    column = {name: totals[..., i] for i, name in enumerate(counts.columns)}
+    tp, fp, fn = column['tp'], column['fp'], column['fn']
+    # Like scoring.replacement.replacement_rates, which gives 0 rather than dividing by 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        precision = np.where(tp + fp > 0, tp / (tp + fp), 0.0)
+        recall = np.where(tp + fn > 0, tp / (tp + fn), 0.0)
+        f1 = np.where(precision + recall > 0, 2.0 * precision * recall / (precision + recall), 0.0)
+        scores = {'precision': precision, 'recall': recall, 'f1': f1}
+        for name in ('removals', 'rewrites', 'insertions'):
+            scores[name] = np.where(column['length'] > 0, column[name] / column['length'], 0.0)
+    return scores
+
+def _prf(tp: np.ndarray, fp: np.ndarray, fn: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """_prf computes the precision, recall and F-score like spacy.scorer.PRFScore."""
+    p = tp / (tp + fp + _EPSILON)
+    r = tp / (tp + fn + _EPSILON)
+    return p, r, 2 * (p * r) / (p + r + _EPSILON)
+
+def _batches(resamples: int, documents: int):
+    """_batches yields the sizes of the batches to draw the resamples in."""
+    size = max(1, BATCH_ELEMENTS // documents)
+    for start in range(0, resamples, size):
+        yield min(size, resamples - start)
+
+def _bootstrap_weights(rng: np.random.Generator, resamples: int, documents: int) -> np.ndarray:
+    """_bootstrap_weights draws how many times each document is picked in each resample,
+    when documents are picked with replacement."""
+    picks = rng.integers(0, documents, size=(resamples, documents))
+    picks += np.arange(resamples)[:, None] * documents
+    return np.bincount(picks.ravel(), minlength=resamples * documents).reshape(resamples, documents).astype(np.float64)
+
+def _flat(counts: DocumentCounts) -> np.ndarray:
+    return counts.counts.reshape(len(counts.documents), -1)
+
+def point_estimates(counts: DocumentCounts) -> Dict[str, float]:
+    """point_estimates returns the scores of all the documents."""
+    totals = counts.counts.sum(axis=0)
+    return {name: float(value) for name, value in metrics(counts, totals).items()}
+
+def bootstrap(counts: DocumentCounts, resamples: int = 10000, seed: int = 0) -> Dict[str, np.ndarray]:
+    """bootstrap returns the scores of resamples bootstrap resamples of the documents."""
+    rng = np.random.default_rng(seed)
+    flat = _flat(counts)
+    totals = np.concatenate([_bootstrap_weights(rng, size, len(flat)) @ flat for size in _batches(resamples, len(flat))])
+    return metrics(counts, totals.reshape((resamples,) + counts.counts.shape[1:]))
+
+def confidence_interval(samples: np.ndarray, confidence: float = 0.95) -> Tuple[float, float]:
+    """confidence_interval returns the percentile interval of the samples."""
+    alpha = (1.0 - confidence) / 2.0
+    low, high = np.quantile(samples, [alpha, 1.0 - alpha])
+    return float(low), float(high)
+
+def paired_bootstrap(a: DocumentCounts, b: DocumentCounts, resamples: int = 10000, seed: int = 0) -> Dict[str, np.ndarray]:
+    """paired_bootstrap returns the differences between the scores of b and a on the
+    same resamples of their documents. a and b must be paired (see pair_counts)."""
+    rng = np.random.default_rng(seed)
+    a_flat, b_flat = _flat(a), _flat(b)
+    a_totals, b_totals = [], []
+    for size in _batches(resamples, len(a_flat)):
+        weights = _bootstrap_weights(rng, size, len(a_flat))
+        a_totals.append(weights @ a_flat)
+        b_totals.append(weights @ b_flat)
+    shape = (resamples,) + a.counts.shape[1:]
+    return _differences(metrics(a, np.concatenate(a_totals).reshape(shape)), metrics(b, np.concatenate(b_totals).reshape(shape)))
+
+def approximate_randomization(a: DocumentCounts, b: DocumentCounts, resamples: int = 10000, seed: int = 0) -> Dict[str, float]:
+    """approximate_randomization returns the two-sided p-value of the difference between
+    the scores of a and b for every metric, by swapping the answers of the two runs on
+    a random half of the documents in each resample. a and b must be paired (see
+    pair_counts)."""
+    rng = np.random.default_rng(seed)
+    a_flat, b_flat = _flat(a), _flat(b)
+    a_total, b_total = a_flat.sum(axis=0), b_flat.sum(axis=0)
+    shape = a.counts.shape[1:]
+    observed = {name: abs(value) for name, value in _differences(metrics(a, a_total.reshape(shape)), metrics(b, b_total.reshape(shape))).items()}
+    # Swapping a document moves its difference in counts from one run to the other
+    delta = b_flat - a_flat
+    extreme = {name: 0 for name in observed}
+    for size in _batches(resamples, len(a_flat)):
+        moved = rng.integers(0, 2, size=(size, len(a_flat))).astype(np.float64) @ delta
+        a_scores = metrics(a, (a_total + moved).reshape((size,) + shape))
+        b_scores = metrics(b, (b_total - moved).reshape((size,) + shape))
+        for name, difference in _differences(a_scores, b_scores).items():
+            # Allow for rounding, so identical runs are never significantly different
+            extreme[name] += int(np.count_nonzero(np.abs(difference) >= observed[name] - 1e-12))
+    return {name: (count + 1) / (resamples + 1) for name, count in extreme.items()}
+
+def _differences(a_scores: Dict[str, np.ndarray], b_scores: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    return {name: b_scores[name] - a_scores[name] for name in a_scores}
+
+def compare(a: DocumentCounts, b: DocumentCounts, resamples: int = 10000, confidence: float = 0.95, seed: int = 0) -> Dict[str, dict]:
+    """compare returns, for every metric, the scores of runs a and b with their bootstrap
+    confidence intervals, the confidence interval of the difference b - a, and the
+    approximate randomization p-value of the difference, on the documents both runs
+    scored."""
+    a, b = pair_counts(a, b)
+    a_point, b_point = point_estimates(a), point_estimates(b)
+    a_samples, b_samples = bootstrap(a, resamples, seed), bootstrap(b, resamples, seed + 1)
+    differences = paired_bootstrap(a, b, resamples, seed + 2)
+    p_values = approximate_randomization(a, b, resamples, seed + 3)
+    return {name: {
+        'a': a_point[name], 'a_ci': confidence_interval(a_samples[name], confidence),
+        'b': b_point[name], 'b_ci': confidence_interval(b_samples[name], confidence),
+        'difference': b_point[name] - a_point[name], 'difference_ci': confidence_interval(differences[name], confidence),
+        'p': p_values[name],
+    } for name in a_point}
@@ -0,0 +1,12 @@
+import models.dummy
+
+class CountingModel(models.dummy.DummyModel):
+    """CountingModel is a DummyModel which remembers which documents it was asked to predict,
+    in predicted, which can be a list shared by several models."""
+    def __init__(self, predicted: list = None):
+        self.predicted = [] if predicted is None else predicted
+
+    def predict_iter(self, doc_bin, language, mode):
+        for doc, answer in super().predict_iter(doc_bin, language, mode):
+            self.predicted.append(doc.text)
+            yield doc, answer
@@ -0,0 +1,85 @@
+import unittest
+
+import random
+import string2string.alignment
+
+import scoring.alignment
+from scoring.alignment import GAP
+
+def reference_pairs(source, response, gap_char='~'):
+    """reference_pairs runs string2string's NeedlemanWunsch and converts
+    its ' | '-joined output to index pairs."""
+    nw = string2string.alignment.NeedlemanWunsch(gap_char=gap_char)
+    source_aligned, response_aligned = nw.get_alignment(source, response)
+    source_elems = [p.strip() for p in source_aligned.split(' | ')]
+    response_elems = [p.strip() for p in response_aligned.split(' | ')]
+    pairs = []
+    i, j = 0, 0
+    for src, resp in zip(source_elems, response_elems):
+        pair_i, pair_j = GAP, GAP
+        if src != gap_char:
+            pair_i, i = i, i + 1
+        if resp != gap_char:
+            pair_j, j = j, j + 1
+        pairs.append((pair_i, pair_j))
+    return pairs
+
+class AlignmentTests(unittest.TestCase):
+    def setUp(self):
+        self.random = random.Random(1234)
+        self.vocabulary = ['Pasienten', 'er', '47', 'år', '<Age>', '<First_Name>', '.', ',', 'Ola', 'Olsen']
+
+    def _perturb(self, tokens):
+        perturbed = []
+        for token in tokens:
+            roll = self.random.random()
+            if roll < 0.1:
+                continue
+            elif roll < 0.2:
+                perturbed.append(self.random.choice(self.vocabulary))
+            elif roll < 0.3:
+                perturbed.extend([token, self.random.choice(self.vocabulary)])
+            else:
+                perturbed.append(token)
+        return perturbed
+
+    def test_identical(self):
+        tokens = "The quick brown fox jumps over the lazy dog".split()
+        pairs = scoring.alignment.align_tokens(tokens, tokens)
+        self.assertEqual(pairs, [(i, i) for i in range(len(tokens))])
+
+    def test_empty_response(self):
+        pairs = scoring.alignment.align_tokens(['a', 'b'], [])
+        self.assertEqual(pairs, [(0, GAP), (1, GAP)])
+
+    def test_matches_string2string(self):
+        for _ in range(50):
+            length = self.random.randint(1, 60)
+            source = [self.random.choice(self.vocabulary) for _ in range(length)]
+            response = self._perturb(source)
+            if len(response) == 0:
+                continue
+            self.assertEqual(scoring.alignment.align_tokens(source, response), reference_pairs(source, response))
+
+    def test_anchored_is_optimal(self):
+        def alignment_score(pairs, source, response):
+            return sum(scoring.alignment.GAP_WEIGHT if GAP in (i, j) else
+                       (scoring.alignment.MATCH_WEIGHT if source[i] == response[j] else scoring.alignment.MISMATCH_WEIGHT)
+                       for i, j in pairs)
+
+        for _ in range(50):
+            length = self.random.randint(1, 60)
+            source = [self.random.choice(self.vocabulary) for _ in range(length)]
+            response = self._perturb(source)
+            full = scoring.alignment.align_tokens(source, response)
+            # Without anchors, Hirschberg's splitting must still give an optimal alignment
+            split = scoring.alignment.align_tokens_anchored(source, response, min_anchor_length=len(source) + 1, max_cells=16)
+            self.assertEqual([i for i, _ in split if i != GAP], list(range(len(source))))
+            self.assertEqual([j for _, j in split if j != GAP], list(range(len(response))))
+            self.assertEqual(alignment_score(split, source, response), alignment_score(full, source, response))
+
+    def test_anchored_near_identical(self):
+        source = [f"token{i}" for i in range(200)]
+        response = source[:50] + ['<First_Name>'] + source[51:150] + source[152:]
+        pairs = scoring.alignment.align_tokens_anchored(source, response, max_cells=64)
+        self.assertEqual(pairs, scoring.alignment.align_tokens(source, response))
@@ -0,0 +1,159 @@
+import unittest
+
+import random
+
+import spacy
+import spacy.scorer
+import spacy.tokens
+import spacy.training
+from spacy.attrs import ORTH
+
+import datasets.loaders.synthdeid
+import models.dummy
+import scoring.annotation
+import scoring.stats
+
+LABELS = ['First_Name', 'Last_Name', 'Age', 'Date']
+
+class AnnotationScoreTests(unittest.TestCase):
+    def setUp(self):
+        self.nlp = spacy.blank("nb")
+        self.nlp.add_pipe("ner")
+
+    def _random_example(self, rng: random.Random, missing: bool = False) -> spacy.training.Example:
+        words = [rng.choice(['Ola', 'Kari', 'Nordmann', '23', 'år', 'innlagt', '12.03.2020', '.', '\n']) for _ in range(rng.randint(1, 20))]
+        reference = spacy.tokens.Doc(self.nlp.vocab, words=words)
+        annotation = rng.choice(['outside', 'missing', None]) if missing else 'outside'
+        if annotation is not None:
+            reference.set_ents(self._random_spans(reference, rng), default=annotation)
+        # Merge or split some tokens in the prediction, so the tokenizations differ
+        predicted = self.nlp.make_doc(reference.text)
+        roll = rng.random()
+        if len(predicted) > 2 and roll < 0.2:
+            with predicted.retokenize() as retokenizer:
+                retokenizer.merge(predicted[0:2])
+        elif roll < 0.4:
+            i = rng.randrange(len(words))
+            if len(words[i]) > 1:
+                cut = rng.randint(1, len(words[i]) - 1)
+                predicted = spacy.tokens.Doc(self.nlp.vocab, words=words[:i] + [words[i][:cut], words[i][cut:]] + words[i + 1:],
+                                             spaces=[True] * i + [False] + [True] * (len(words) - i))
+        predicted.set_ents(self._random_spans(predicted, rng))
+        return spacy.training.Example(predicted, reference)
+
+    def _random_spans(self, doc: spacy.tokens.Doc, rng: random.Random):
+        spans = [spacy.tokens.Span(doc, i, min(len(doc), i + rng.randint(1, 2)), rng.choice(LABELS))
+                 for i in range(len(doc)) if rng.random() < 0.3]
+        return spacy.util.filter_spans(spans)
+
+    def test_matches_spacy_scorer(self):
+        rng = random.Random(0)
+        examples = [self._random_example(rng) for _ in range(200)]
+
+        scorer = scoring.annotation.Scorer(self.nlp)
+        for example in examples:
+            scorer.add(example)
+
+        self.assertEqual(scorer.scores(), spacy.scorer.Scorer(self.nlp).score(examples))
+
+    def test_variants_match_relabelled_and_split_examples(self):
+        rng = random.Random(1)
+        examples = [self._random_example(rng, missing=True) for _ in range(300)]
+
+        scorer = scoring.annotation.Scorer(self.nlp, chunk_size=13)
+        for example in examples:
+            scorer.add(example)
+        variants = scorer.variants()
+
+        for variant, (single_class, split) in scoring.annotation.VARIANTS.items():
+            expected = [_relabel_and_split(example, single_class, split) for example in examples]
+            self.assertEqual(variants[variant], spacy.scorer.Scorer(self.nlp).score(expected), variant)
+        # Scoring the variants does not change the answers
+        self.assertEqual(variants['per_label'], spacy.scorer.Scorer(self.nlp).score(examples))
+
+    def test_document_counts_add_up_to_scores(self):
+        rng = random.Random(4)
+        examples = [self._random_example(rng, missing=True) for _ in range(100)]
+
+        scorer = scoring.annotation.Scorer(self.nlp, chunk_size=9)
+        for example in examples:
+            scorer.add(example)
+
+        for variant in scoring.annotation.VARIANTS:
+            document_counts = scorer.document_counts(variant)
+            self.assertEqual(len(document_counts['counts']), len(examples))
+            ents_per_type = scorer.scores(variant=variant)['ents_per_type']
+            self.assertEqual(document_counts['labels'], list(ents_per_type))
+            scores = scoring.stats.point_estimates(scoring.stats.load_counts({'document_counts': document_counts}))
+            for label in document_counts['labels']:
+                self.assertAlmostEqual(scores[f'ents_per_type.{label}.f'], ents_per_type[label]['f'], msg=variant)
+
+    def test_alignment_matches_spacy(self):
+        rng = random.Random(3)
+        scorer = scoring.annotation.Scorer(self.nlp)
+        for _ in range(300):
+            example = self._random_example(rng)
+            attrs = scoring.annotation._SPAN_ATTRS
+            texts = [scorer._stripped(doc.to_array(ORTH)) for doc in (example.reference, example.predicted)]
+            first, last = scoring.annotation._align(example, example.reference.to_array(attrs), example.predicted.to_array(attrs), *texts)
+            align_x2y = example.alignment.x2y
+            expected = [(int(align_x2y[i:i + 1][0]), int(align_x2y[i:i + 1][-1])) if align_x2y.lengths[i] else (-1, -1)
+                        for i in range(len(example.predicted))]
+            self.assertEqual(list(zip(first.tolist(), last.tolist())), expected)
+
+    def test_matches_spacy_scorer_on_synthdeid(self):
+        rng = random.Random(2)
+        examples = []
+        for reference in datasets.loaders.synthdeid.load_synthdeid(self.nlp.vocab).get_docs(self.nlp.vocab):
+            predicted = self.nlp.make_doc(reference.text)
+            if rng.random() < 0.2:
+                with predicted.retokenize() as retokenizer:
+                    retokenizer.merge(predicted[0:2])
+            spans = []
+            for ent in reference.ents:
+                span = predicted.char_span(ent.start_char, ent.end_char, alignment_mode='expand')
+                start, end = span.start, span.end
+                roll = rng.random()
+                if roll < 0.1:
+                    continue
+                elif roll < 0.2:
+                    end = min(end + 1, len(predicted))
+                spans.append(spacy.tokens.Span(predicted, start, end, rng.choice(LABELS) if roll > 0.9 else ent.label_))
+            predicted.set_ents(spacy.util.filter_spans(spans + self._random_spans(predicted, random.Random(rng.random()))[:2]))
+            examples.append(spacy.training.Example(predicted, reference))
+
+        # Count in several chunks
+        scorer = scoring.annotation.Scorer(self.nlp, chunk_size=7)
+        for example in examples:
+            scorer.add(example)
+        self.assertEqual(scorer.scores(), spacy.scorer.Scorer(self.nlp).score(examples))
+        self.assertGreater(scorer.scores()['ents_f'], 0.5)
+
+    def test_predict_iter_matches_predict(self):
+        docbin = spacy.tokens.DocBin()
+        for text in ["Ola er 23 år", "Kari er innlagt"]:
+            docbin.add(self.nlp.make_doc(text))
+        model = models.dummy.DummyModel()
+
+        pairs = list(model.predict_iter(docbin, self.nlp, 'replace'))
+        self.assertEqual([doc.text for doc, _ in pairs], ["Ola er 23 år", "Kari er innlagt"])
+        self.assertEqual([answer for _, answer in pairs], model.predict(docbin, self.nlp, 'replace'))
+
+
+def _relabel_and_split(example: spacy.training.Example, single_class: bool, split: bool) -> spacy.training.Example:
+    """_relabel_and_split makes the Docs a variant is scored on, the way eval.py did
+    before the variants were scored from the same answers."""
+    def transform(doc):
+        doc = doc.copy()
+        if not (single_class or split):
+            return doc
+        ents = []
+        for ent in doc.ents:
+            label = 'PHI' if single_class else ent.label_
+            if split:
+                ents.extend(spacy.tokens.Span(doc, token, token + 1, label) for token in range(ent.start, ent.end))
+            else:
+                ents.append(spacy.tokens.Span(doc, ent.start, ent.end, label))
+        doc.set_ents(ents)
+        return doc
+    return spacy.training.Example(transform(example.predicted), transform(example.reference))
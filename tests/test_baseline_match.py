@@ -76,3 +76,11 @@ class BaselineMatcherTests(unittest.TestCase):
         self.assertEqual(len(answers), 1)
         self.assertEqual(answers[0], "Han heter <First_Name> <Last_Name> ")
 
+    def test_multiprocess_matches_single_process(self):
+        texts = ["Han heter Ola Olsen og er 29 år", "Hans telefonnummer er 77712345 nå", "Jeg er født 1 . januar 1985 i Tromsø"] * 4
+        docbin = spacy.tokens.DocBin()
+        for text in texts:
+            docbin.add(self.nlp.make_doc(text))
+
+        parallel = models.spacy.SpacyModel(batch_size=2, n_process=2)
+        self.assertEqual(parallel.predict(docbin, self.nlp, 'replace'), self.model.predict(docbin, self.nlp, 'replace'))
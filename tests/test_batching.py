@@ -0,0 +1,50 @@
+import unittest
+
+import random
+import tempfile
+
+from benchmarks.generation import make_tiny_causal_lm
+from benchmarks.synthetic import VOCABULARY
+from models.utilities.batching import length_buckets
+
+class LengthBucketTests(unittest.TestCase):
+    def test_respects_budget(self):
+        lengths = [random.Random(i).randint(1, 100) for i in range(200)]
+        buckets = length_buckets(lengths, token_budget=500, extra_tokens=20)
+
+        self.assertEqual(sorted(i for bucket in buckets for i in bucket), list(range(len(lengths))))
+        for bucket in buckets:
+            self.assertLessEqual(len(bucket) * (max(lengths[i] for i in bucket) + 20), 500)
+
+    def test_oversized_items_get_own_bucket(self):
+        self.assertEqual(length_buckets([10, 1000, 20], token_budget=100), [[0, 2], [1]])
+
+class BatchedGenerationTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        import models.hf_transformer
+
+        rng = random.Random(0)
+        prompt = "Marker personopplysninger i teksten."
+        cls.sources = [' '.join(rng.choice(VOCABULARY) for _ in range(rng.randint(3, 30))) for _ in range(6)]
+        cls.directory = tempfile.TemporaryDirectory()
+        make_tiny_causal_lm(cls.directory.name, [prompt] + cls.sources)
+        cls.model = models.hf_transformer.HFTransformerModel(prompt, cls.directory.name, batch_token_budget=4096, max_new_tokens=8)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def setUp(self):
+        self.model.prefix_cache = True
+
+    def test_batched_matches_single(self):
+        single = [self.model.predict_task(source) for source in self.sources]
+        self.assertEqual(self.model.predict_batch(self.sources), single)
+
+    def test_prefix_cache_matches_uncached(self):
+        self.model.prefix_cache = False
+        uncached = self.model.predict_batch(self.sources)
+        self.model.prefix_cache = True
+        self.assertEqual([self.model.predict_task(source) for source in self.sources], uncached)
+        self.assertEqual(self.model.predict_batch(self.sources), uncached)
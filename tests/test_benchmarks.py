@@ -0,0 +1,39 @@
+import unittest
+
+from benchmarks.compare import compare
+
+def _results(**seconds):
+    return {'results': {name.replace('_', '.'): {'seconds': value} for name, value in seconds.items()}}
+
+class CompareTests(unittest.TestCase):
+    def test_flags_regressions(self):
+        baseline = _results(align_answer=1.0, tags_remove=2.0, fix_orthography=1.0)
+        current = _results(align_answer=1.05, tags_remove=3.0, fix_orthography=0.5)
+        changes = {change['name']: change for change in compare(baseline, current, threshold=0.1)}
+        self.assertFalse(changes['align.answer']['regression'])
+        self.assertTrue(changes['tags.remove']['regression'])
+        self.assertEqual(changes['tags.remove']['ratio'], 1.5)
+        self.assertTrue(changes['fix.orthography']['improvement'])
+
+    def test_skips_missing_and_skipped(self):
+        baseline = {'results': {'loader.norsynth': {'skipped': 'missing'}, 'align_answer': {'seconds': 1.0}}}
+        current = {'results': {'loader.norsynth': {'seconds': 1.0}, 'patterns.matches': {'seconds': 1.0}}}
+        self.assertEqual(compare(baseline, current), [])
+
+class SuiteTests(unittest.TestCase):
+    def test_runs_micro_benchmarks(self):
+        from benchmarks.suite import BenchmarkArguments, run_suite
+        args = BenchmarkArguments().parse_args(['--documents', '5', '--length', '20', '--repeats', '1', '--only', 'tags', 'fix_orthography'])
+        suite = run_suite(args)
+        self.assertEqual(set(suite['results']), {'tags.remove_tags', 'tags.list_annotations', 'tags.parse_tags', 'fix_orthography'})
+        for result in suite['results'].values():
+            self.assertEqual(result['documents'], 5)
+            self.assertGreater(result['seconds'], 0)
+
+    def test_runs_startup_benchmarks(self):
+        from benchmarks.suite import BenchmarkArguments, run_suite
+        args = BenchmarkArguments().parse_args(['--repeats', '1', '--only', 'startup', '--pipeline', 'blank:nb'])
+        suite = run_suite(args)
+        self.assertEqual(set(suite['results']), {'startup.tokenizer', 'startup.full_pipeline'})
+        for result in suite['results'].values():
+            self.assertGreater(result['seconds'], 0)
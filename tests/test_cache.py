@@ -0,0 +1,71 @@
+import unittest
+
+import json
+import os
+import tempfile
+import threading
+
+import joblib
+
+from models.utilities.cache import CompletionCache, import_joblib
+
+class CompletionCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'completions.sqlite3')
+        self.cache = CompletionCache(self.path)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_roundtrip(self):
+        response = {'choices': [{'message': {'content': 'Han er <Age>47</Age> år'}}]}
+        self.assertIsNone(self.cache.get('gpt-chat', 'gpt-4', 'prompt', 'Han er 47 år', 0.0))
+        self.cache.put('gpt-chat', 'gpt-4', 'prompt', 'Han er 47 år', 0.0, response)
+
+        self.assertEqual(self.cache.get('gpt-chat', 'gpt-4', 'prompt', 'Han er 47 år', 0.0), response)
+        self.assertIsNone(self.cache.get('gpt-chat', 'gpt-4', 'prompt', 'Han er 47 år', 0.01))
+        self.assertIsNone(self.cache.get('gpt-chat', 'gpt-3.5-turbo', 'prompt', 'Han er 47 år', 0.0))
+        self.assertEqual(self.cache.stats()['hits'], 1)
+        self.assertEqual(self.cache.stats()['misses'], 3)
+
+    def test_evict_least_recently_used(self):
+        for i in range(10):
+            self.cache.put('gpt-chat', 'gpt-4', 'prompt', f'document {i}', 0.0, 'answer')
+        self.cache.get('gpt-chat', 'gpt-4', 'prompt', 'document 0', 0.0)
+
+        self.cache.evict(max_entries=3)
+
+        self.assertEqual(len(self.cache), 3)
+        self.assertIsNotNone(self.cache.get('gpt-chat', 'gpt-4', 'prompt', 'document 0', 0.0))
+
+    def test_evict_by_age(self):
+        self.cache.put('gpt-chat', 'gpt-4', 'prompt', 'old', 0.0, 'answer', created=0.0)
+        self.cache.put('gpt-chat', 'gpt-4', 'prompt', 'new', 0.0, 'answer')
+
+        self.assertEqual(self.cache.evict(max_age_days=30), 1)
+        self.assertEqual(len(self.cache), 1)
+
+    def test_concurrent_writers(self):
+        def write(thread):
+            cache = CompletionCache(self.path)
+            for i in range(50):
+                cache.put('gpt-chat', 'gpt-4', 'prompt', f'{thread}-{i}', 0.0, 'answer')
+        threads = [threading.Thread(target=write, args=(t,)) for t in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(self.cache), 200)
+
+    def test_import_joblib(self):
+        call_directory = os.path.join(self.directory.name, 'joblib', 'models', 'gpt_chat', 'get_chat_completion', '0123abcd')
+        os.makedirs(call_directory)
+        response = {'choices': [{'message': {'content': 'answer'}}]}
+        joblib.dump(response, os.path.join(call_directory, 'output.pkl'))
+        with open(os.path.join(call_directory, 'metadata.json'), 'w', encoding='utf8') as metadata_file:
+            arguments = {'prompt': 'prompt', 'source': "Han er 47 år'", 'model': 'gpt-4', 'openAIAPIKey': 'KEY', 'temperature': 0.01, 'rate_limit': 2}
+            json.dump({'duration': 1.0, 'input_args': {k: repr(v) for k, v in arguments.items()}, 'time': 0.0}, metadata_file)
+
+        self.assertEqual(import_joblib(self.cache, self.directory.name), 1)
+        self.assertEqual(self.cache.get('gpt-chat', 'gpt-4', 'prompt', "Han er 47 år'", 0.01), response)
@@ -0,0 +1,58 @@
+import unittest
+
+import os
+import tempfile
+import unittest.mock
+
+import spacy
+import spacy.tokens
+
+import datasets.loaders.cache
+import datasets.loaders.synthdeid
+
+class DatasetCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.nlp = spacy.blank("nb")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def _docs(self, doc_bin: spacy.tokens.DocBin) -> list:
+        return [(doc.text, [(ent.start, ent.end, ent.label_) for ent in doc.ents]) for doc in doc_bin.get_docs(self.nlp.vocab)]
+
+    def test_cached_dataset_matches_source(self):
+        uncached = datasets.loaders.synthdeid.load_synthdeid(self.nlp.vocab, cache_directory=None)
+        cold = datasets.loaders.synthdeid.load_synthdeid(self.nlp.vocab, cache_directory=self.directory.name)
+        with unittest.mock.patch('datasets.loaders.synthdeid._relabel', side_effect=AssertionError('The dataset should be read from the cache')):
+            warm = datasets.loaders.synthdeid.load_synthdeid(self.nlp.vocab, cache_directory=self.directory.name)
+        self.assertEqual(self._docs(cold), self._docs(uncached))
+        self.assertEqual(self._docs(warm), self._docs(uncached))
+        self.assertNotIn('Health_Care_Unit', {label for _, ents in self._docs(warm) for _, _, label in ents})
+
+    def test_changed_sources_are_loaded_again(self):
+        source = os.path.join(self.directory.name, 'source.txt')
+        with open(source, 'w', encoding='utf8') as source_file:
+            source_file.write('Ola')
+        builds = []
+        def build():
+            builds.append(1)
+            return spacy.tokens.DocBin(docs=[self.nlp.make_doc('Ola')])
+
+        key = lambda: {'sources': datasets.loaders.cache.source_fingerprint([source])}
+        cache = os.path.join(self.directory.name, 'cache')
+        datasets.loaders.cache.cached_docbin('test', key(), build, cache)
+        datasets.loaders.cache.cached_docbin('test', key(), build, cache)
+        self.assertEqual(len(builds), 1)
+
+        with open(source, 'a', encoding='utf8') as source_file:
+            source_file.write(' Olsen')
+        datasets.loaders.cache.cached_docbin('test', key(), build, cache)
+        self.assertEqual(len(builds), 2)
+        # The entry for the old sources is removed, but not the entries of other datasets
+        datasets.loaders.cache.cached_docbin('test-holdout', key(), build, cache)
+        self.assertEqual(sorted(name.rsplit('-', 1)[0] for name in os.listdir(cache)), ['test', 'test-holdout'])
+        self.assertEqual(len(builds), 3)
+        # A different label mapping is a different dataset
+        datasets.loaders.cache.cached_docbin('test', {**key(), 'labels': {'Health_Care_Unit': 'Location'}}, build, cache)
+        self.assertEqual(len(builds), 4)
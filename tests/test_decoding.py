@@ -0,0 +1,57 @@
+import unittest
+
+import random
+import tempfile
+
+import torch
+
+from benchmarks.generation import make_tiny_causal_lm
+from benchmarks.synthetic import VOCABULARY
+from models.utilities.decoding import CopyConstrainedLogitsProcessor, move_spaces_out_of_tags
+from models.utilities.tags import remove_tags
+
+EOS = 0
+TAGS = {'Age': ([1, 2], [1, 3, 2]), 'Date': ([4], [5])}
+
+class CopyConstrainedTests(unittest.TestCase):
+    def setUp(self):
+        self.processor = CopyConstrainedLogitsProcessor(2, [[10, 11, 12]], TAGS, EOS)
+
+    def test_allowed_tokens(self):
+        self.assertEqual(sorted(self.processor.allowed_tokens(0, [])), [1, 4, 10])
+        # Inside a multi-token opening tag, only its next token is allowed
+        self.assertEqual(self.processor.allowed_tokens(0, [1]), [2])
+        # Tags cannot be empty or nested
+        self.assertEqual(self.processor.allowed_tokens(0, [1, 2]), [10])
+        self.assertEqual(sorted(self.processor.allowed_tokens(0, [1, 2, 10])), [1, 11])
+        self.assertEqual(self.processor.allowed_tokens(0, [1, 2, 10, 1]), [3])
+        # The sequence can only end once the source is copied and all tags are closed
+        self.assertEqual(sorted(self.processor.allowed_tokens(0, [10, 11, 4, 12])), [5])
+        self.assertEqual(self.processor.allowed_tokens(0, [10, 11, 4, 12, 5]), [EOS])
+        self.assertEqual(self.processor.allowed_tokens(0, [10, 13]), [EOS])
+
+    def test_random_scores_copy_source(self):
+        rng = torch.Generator().manual_seed(0)
+        for _ in range(20):
+            input_ids = torch.tensor([[7, 7]])
+            while input_ids[0, -1].item() != EOS:
+                scores = self.processor(input_ids, torch.rand((1, 16), generator=rng))
+                input_ids = torch.cat([input_ids, scores.argmax(-1, keepdim=True)], dim=-1)
+            copied = [token for token in input_ids[0, 2:-1].tolist() if token >= 10]
+            self.assertEqual(copied, [10, 11, 12])
+
+    def test_move_spaces_out_of_tags(self):
+        self.assertEqual(move_spaces_out_of_tags('Han er<Age> 23 </Age>år'), 'Han er <Age>23</Age> år')
+
+class ConstrainedGenerationTests(unittest.TestCase):
+    def test_answers_match_source(self):
+        import models.hf_transformer
+
+        rng = random.Random(0)
+        prompt = "Marker personopplysninger i teksten."
+        sources = [' '.join(rng.choice(VOCABULARY) for _ in range(rng.randint(3, 20))) for _ in range(4)]
+        with tempfile.TemporaryDirectory() as directory:
+            make_tiny_causal_lm(directory, [prompt] + sources)
+            model = models.hf_transformer.HFTransformerModel(prompt, directory, max_new_tokens=500, prompt_lookup_tokens=5, constrain_to_source=True)
+            for source in sources:
+                self.assertEqual(remove_tags(model.predict_task(source)), source)
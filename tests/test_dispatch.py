@@ -0,0 +1,130 @@
+import unittest
+
+import http.server
+import json
+import random
+import tempfile
+import threading
+import time
+
+import spacy
+import spacy.tokens
+
+import models.gpt_chat
+from models.utilities.cache import CompletionCache
+from models.utilities import perf
+from models.utilities.dispatch import TokenBucket, parse_duration
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+    """StandInHandler answers chat completion requests by echoing the input,
+    keeping track of how many requests are in flight."""
+    def do_POST(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        with server.lock:
+            server.requests += 1
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+            reject = server.reject > 0
+            server.reject -= 1
+        time.sleep(random.uniform(0.0, 0.02))
+
+        if reject:
+            payload, status, headers = {'error': 'rate limited'}, 429, {'Retry-After': '0.2'}
+        else:
+            source = body['messages'][-1]['content'][len('Input: '):]
+            payload, status, headers = {'choices': [{'message': {'content': source}}]}, 200, {'x-ratelimit-remaining-requests': '100', 'x-ratelimit-reset-requests': '1s'}
+        encoded = json.dumps(payload).encode('utf8')
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(encoded)))
+        self.end_headers()
+        self.wfile.write(encoded)
+        with server.lock:
+            server.in_flight -= 1
+
+    def log_message(self, format, *args):
+        pass
+
+class RequestEngineTests(unittest.TestCase):
+    def setUp(self):
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+        self.server.lock = threading.Lock()
+        self.server.requests, self.server.in_flight, self.server.max_in_flight, self.server.reject = 0, 0, 0, 0
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.cache = tempfile.TemporaryDirectory()
+        self.nlp = spacy.blank("nb")
+        self.texts = [f"Pasient nummer {i} er innlagt ." for i in range(30)]
+        self.docbin = spacy.tokens.DocBin()
+        for text in self.texts:
+            self.docbin.add(self.nlp.make_doc(text))
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.cache.cleanup()
+
+    def _model(self, max_in_flight=4):
+        api_base = f'http://127.0.0.1:{self.server.server_port}/v1'
+        return models.gpt_chat.GptChatModel('', 'stand-in', 'KEY', max_in_flight=max_in_flight, requests_per_second=1000.0,
+                                            cache=CompletionCache(f'{self.cache.name}/completions.sqlite3'), api_base=api_base)
+
+    def test_order_and_in_flight_limit(self):
+        answers = self._model(max_in_flight=4).predict(self.docbin, self.nlp, 'replace')
+
+        self.assertEqual(answers, self.texts)
+        self.assertLessEqual(self.server.max_in_flight, 4)
+        self.assertEqual(self.server.requests, len(self.texts))
+
+    def test_predict_iter_requests_one_window_at_a_time(self):
+        answers = self._model(max_in_flight=2).predict_iter(self.docbin, self.nlp, 'replace')
+        doc, answer = next(answers)
+
+        self.assertEqual(answer, doc.text)
+        self.assertLessEqual(self.server.requests, 8)
+        self.assertEqual([answer for _, answer in answers], self.texts[1:])
+
+    def test_requests_recorded_to_the_run(self):
+        recorder = perf.Recorder()
+        with perf.recording(recorder):
+            self._model().predict(self.docbin, self.nlp, 'replace')
+        self.assertEqual(recorder.report()['stages']['model.request']['calls'], len(self.texts))
+
+    def test_cached_documents_skip_limiter(self):
+        self._model().predict(self.docbin, self.nlp, 'replace')
+        model = self._model()
+        model._engine.limiter.pause(60)
+
+        start = time.monotonic()
+        answers = model.predict(self.docbin, self.nlp, 'replace')
+
+        self.assertLess(time.monotonic() - start, 10)
+        self.assertEqual(answers, self.texts)
+        self.assertEqual(self.server.requests, len(self.texts))
+        self.assertEqual(model.cache.hits, len(self.texts))
+
+    def test_retry_after(self):
+        self.server.reject = 1
+        start = time.monotonic()
+        answers = self._model(max_in_flight=1).predict(self.docbin, self.nlp, 'replace')
+
+        self.assertEqual(answers, self.texts)
+        self.assertGreaterEqual(time.monotonic() - start, 0.2)
+
+class TokenBucketTests(unittest.TestCase):
+    def test_parse_duration(self):
+        self.assertAlmostEqual(parse_duration('20ms'), 0.02)
+        self.assertAlmostEqual(parse_duration('6m0s'), 360.0)
+        self.assertAlmostEqual(parse_duration('1h2m3.5s'), 3723.5)
+
+    def test_follows_remaining_requests(self):
+        bucket = TokenBucket(rate=100.0)
+        bucket.update(200, {'x-ratelimit-remaining-requests': '10', 'x-ratelimit-reset-requests': '5s'})
+        self.assertAlmostEqual(bucket.rate, 2.0)
+
+    def test_pauses_when_exhausted(self):
+        bucket = TokenBucket(rate=100.0)
+        bucket.update(200, {'x-ratelimit-remaining-tokens': '0', 'x-ratelimit-reset-tokens': '30s'})
+        self.assertGreater(bucket._reserve(), 29.0)
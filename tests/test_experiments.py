@@ -0,0 +1,124 @@
+import unittest
+
+import csv
+import os
+import tempfile
+import unittest.mock
+
+import spacy
+import spacy.tokens
+
+import run_experiments
+from tests.helpers import CountingModel
+
+class ExperimentMatrixTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        nlp = spacy.blank("nb")
+        labels = {}
+        for name in ['first', 'second']:
+            doc_bin = spacy.tokens.DocBin()
+            for i in range(5):
+                doc_bin.add(nlp.make_doc(f"Pasient {i} fra {name} datasett ."))
+            path = os.path.join(self.directory.name, f'{name}.spacy')
+            doc_bin.to_disk(path)
+            labels[path] = name
+        self.matrix = {
+            'labels': labels,
+            'defaults': {
+                'dataset': list(labels),
+                'journalPath': os.path.join(self.directory.name, 'journal.sqlite3'),
+            },
+            'experiments': [{
+                'name': 'dummy',
+                'model': 'dummy',
+                'prompt_path': 'prompts/null.txt',
+                'mode': ['annotate', 'replace'],
+                'singleClass': [False, True],
+                'output': os.path.join(self.directory.name, '{name}-{mode}-{dataset}{single}.json'),
+            }],
+        }
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_expand_matrix(self):
+        runs = run_experiments.expand_matrix(self.matrix)
+        # singleClass only applies to annotate mode
+        self.assertEqual(len(runs), 2 * 3)
+        outputs = [os.path.basename(run['output']) for run in runs]
+        self.assertIn('dummy-annotate-first-single.json', outputs)
+        self.assertIn('dummy-replace-second.json', outputs)
+        self.assertNotIn('dummy-replace-second-single.json', outputs)
+        self.assertEqual(run_experiments.expand_matrix(self.matrix, ['other']), [])
+
+    def test_unknown_settings_are_rejected(self):
+        self.matrix['experiments'][0]['modle'] = 'dummy'
+        with self.assertRaises(KeyError):
+            run_experiments.to_arguments(run_experiments.expand_matrix(self.matrix)[0])
+        del self.matrix['experiments'][0]['modle']
+        self.matrix['experiments'][0]['checkEvery'] = 0
+        with self.assertRaises(ValueError):
+            run_experiments.to_arguments(run_experiments.expand_matrix(self.matrix)[0])
+
+    def test_runs_share_models_and_predictions(self):
+        runs = run_experiments.expand_matrix(self.matrix)
+        loaded, predicted = [], []
+        def load_model(model_name, prompt, args):
+            loaded.append(model_name)
+            return CountingModel(predicted)
+
+        with unittest.mock.patch('eval.load_model', load_model):
+            rows = run_experiments.run_matrix(runs, workers=2)
+        summary_path = os.path.join(self.directory.name, 'summary.csv')
+        run_experiments.write_summary(rows, summary_path)
+
+        # One model for every run, and the single class runs score the
+        # answers journaled by the runs with all classes
+        self.assertEqual(loaded, ['dummy'])
+        self.assertEqual(len(predicted), 2 * 2 * 5)
+        self.assertEqual([(row['dataset'], row['mode'], row['singleClass']) for row in rows],
+                         [(run['dataset'], run['mode'], run['singleClass']) for run in runs])
+        for row in rows:
+            self.assertNotIn('error', row)
+            self.assertTrue(os.path.exists(row['output']))
+        with open(summary_path, 'r', encoding='utf8') as summary_file:
+            self.assertEqual(len(list(csv.DictReader(summary_file))), len(runs))
+
+    def test_groups_running_at_once_do_not_share_answers(self):
+        # The dummy model ignores constrainToSource, but its runs are journaled apart
+        self.matrix['experiments'][0]['constrainToSource'] = [False, True]
+        self.matrix['experiments'][0]['output'] = os.path.join(self.directory.name, '{name}-{mode}-{dataset}{single}-{constrainToSource}.json')
+        runs = run_experiments.expand_matrix(self.matrix)
+        loaded, predicted = [], []
+        def load_model(model_name, prompt, args):
+            loaded.append(model_name)
+            return CountingModel(predicted)
+
+        with unittest.mock.patch('eval.load_model', load_model):
+            rows = run_experiments.run_matrix(runs, workers=2)
+        self.assertEqual(loaded, ['dummy', 'dummy'])
+        self.assertEqual(len(predicted), 2 * 2 * 2 * 5)
+        for row in rows:
+            self.assertNotIn('error', row)
+
+    def test_request_settings_share_a_group(self):
+        # Runs which only differ in how requests are sent share journaled answers, so they
+        # run one after the other, each with a model of its own
+        self.matrix['experiments'][0]['maxInFlight'] = [1, 2]
+        self.matrix['experiments'][0]['output'] = os.path.join(self.directory.name, '{name}-{mode}-{dataset}{single}-{maxInFlight}.json')
+        runs = run_experiments.expand_matrix(self.matrix)
+        loaded, predicted = [], []
+        def load_model(model_name, prompt, args):
+            loaded.append(args.maxInFlight)
+            return CountingModel(predicted)
+
+        with unittest.mock.patch('eval.load_model', load_model):
+            rows = run_experiments.run_matrix(runs, workers=2)
+        self.assertEqual(sorted(loaded), [1, 2])
+        self.assertEqual(len(predicted), 2 * 2 * 5)
+        for row in rows:
+            self.assertNotIn('error', row)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+import unittest
+
+import json
+import os
+import sqlite3
+import tempfile
+import unittest.mock
+
+import spacy
+import spacy.scorer
+import spacy.tokens
+import spacy.training
+
+import eval
+from models.utilities.journal import decode_answer, encode_answer
+from tests.helpers import CountingModel
+
+class JournalTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.nlp = spacy.blank("nb")
+        self.texts = [f"Pasient {i} heter Ola Olsen ." for i in range(10)]
+        doc_bin = spacy.tokens.DocBin()
+        for text in self.texts:
+            doc = self.nlp.make_doc(text)
+            doc.set_ents([doc.char_span(text.index('Ola'), len(text) - 2, 'PER')])
+            doc_bin.add(doc)
+        self.dataset = os.path.join(self.directory.name, 'dataset.spacy')
+        doc_bin.to_disk(self.dataset)
+        self.journal = os.path.join(self.directory.name, 'journal.sqlite3')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def _run(self, mode: str, resume: bool = False, flags: list = []) -> (dict, CountingModel):
+        output = os.path.join(self.directory.name, 'results.json')
+        args = eval.ExperimentArguments().parse_args(['--prompt_path', 'prompts/null.txt', '--mode', mode, '--dataset', self.dataset,
+                                                      '--journalPath', self.journal, '--output', output] + (['--resume'] if resume else []) + flags)
+        model = CountingModel()
+        with unittest.mock.patch('eval.load_model', return_value=model):
+            eval.main(args)
+        with open(output, 'r', encoding='utf8') as results:
+            return json.load(results), model
+
+    def test_example_roundtrip(self):
+        predicted = self.nlp.make_doc("Ola Olsen er 23 år")
+        predicted.set_ents([predicted.char_span(13, 15, 'Age')])
+        example = spacy.training.Example.from_dict(predicted, {'entities': [(0, 3, 'First_Name')]})
+
+        decoded = decode_answer(*encode_answer(example), self.nlp.vocab)
+        self.assertEqual(spacy.scorer.Scorer(self.nlp).score([decoded]), spacy.scorer.Scorer(self.nlp).score([example]))
+        self.assertEqual([(e.text, e.label_) for e in decoded.reference.ents], [('Ola', 'First_Name')])
+
+    def test_resume_skips_journaled_documents(self):
+        for mode in ['replace', 'annotate']:
+            with self.subTest(mode=mode):
+                full, model = self._run(mode)
+                self.assertEqual(len(model.predicted), len(self.texts))
+
+                # Simulate a run interrupted after seven documents
+                with sqlite3.connect(self.journal) as connection:
+                    connection.execute('DELETE FROM predictions WHERE doc_index >= 7')
+                resumed, model = self._run(mode, resume=True)
+
+                self.assertEqual(model.predicted, self.texts[7:])
+                # Only the timings differ
+                self.assertEqual(resumed['perf']['throughput']['documents'], 3)
+                del resumed['perf'], full['perf']
+                self.assertEqual(resumed, full)
+
+    def test_run_without_resume_starts_over(self):
+        self._run('replace')
+        _, model = self._run('replace')
+        self.assertEqual(len(model.predicted), len(self.texts))
+        with sqlite3.connect(self.journal) as connection:
+            self.assertEqual(connection.execute('SELECT COUNT(*) FROM predictions').fetchone()[0], len(self.texts))
+
+    def test_resume_ignores_answers_of_other_settings(self):
+        self._run('replace')
+        _, model = self._run('replace', resume=True, flags=['--constrainToSource'])
+        self.assertEqual(len(model.predicted), len(self.texts))
+        with self.assertRaises(ValueError):
+            self._run('replace', flags=['--scoreOnly', '--promptLookupTokens', '5'])
+
+    def test_resume_with_other_request_settings(self):
+        self._run('replace')
+        _, model = self._run('replace', resume=True, flags=['--maxInFlight', '2', '--openAIKey', 'rotated'])
+        self.assertEqual(model.predicted, [])
+        with self.assertLogs(level='WARNING') as logs:
+            _, model = self._run('replace', resume=True, flags=['--modelName', 'other'])
+        self.assertEqual(len(model.predicted), len(self.texts))
+        self.assertTrue(any('no journaled answers to resume' in line for line in logs.output))
+
+    def test_score_only_rescores_without_the_model(self):
+        nlp = spacy.blank("nb")
+        nlp.add_pipe("ner")
+        with unittest.mock.patch('eval.load_pipeline', return_value=nlp):
+            full, _ = self._run('annotate')
+            with unittest.mock.patch('eval.load_model', side_effect=AssertionError('The model should not be loaded')):
+                rescored, _ = self._run('annotate', flags=['--scoreOnly'])
+                single, _ = self._run('annotate', flags=['--scoreOnly', '--singleClass'])
+        self.assertIsNone(rescored['perf']['throughput'])
+        del rescored['perf'], full['perf']
+        self.assertEqual(rescored, full)
+        # Every variant is scored in the same pass, --singleClass only picks which is reported
+        self.assertEqual(single['variants'], full['variants'])
+        self.assertEqual(single['ents_per_type'], full['variants']['single_class_tokens']['ents_per_type'])
+        self.assertEqual(full['ents_per_type'], full['variants']['per_label']['ents_per_type'])
+        self.assertEqual(list(single['ents_per_type']), ['PHI'])
+
+    def test_sequential_stops_once_interval_is_narrow(self):
+        # The dummy model never finds any PHI, so the F1 of every sample is 0
+        results, model = self._run('replace', flags=['--sequential', '--minDocuments', '4', '--checkEvery', '2'])
+        self.assertEqual(len(model.predicted), 4)
+        self.assertEqual(results['sequential']['documents'], 4)
+        self.assertEqual(results['sequential']['total_documents'], len(self.texts))
+        self.assertEqual(results['sequential']['stopped'], 'targetWidth')
+        self.assertEqual(sorted(self.texts.index(text) for text in model.predicted), results['document_counts']['documents'])
+
+    def test_sequential_stops_at_max_documents(self):
+        results, model = self._run('annotate', flags=['--sequential', '--targetWidth', '0', '--maxDocuments', '3'])
+        self.assertEqual(len(model.predicted), 3)
+        self.assertEqual(results['sequential']['stopped'], 'maxDocuments')
+        self.assertEqual(results['sequential']['target_metric'], 'ents_f')
+
+    def test_check_every_document_at_least(self):
+        with self.assertRaises(ValueError):
+            self._run('replace', flags=['--sequential', '--checkEvery', '0'])
+
+    def test_perf_section(self):
+        trace = os.path.join(self.directory.name, 'trace.json')
+        results, _ = self._run('replace', flags=['--perfTrace', trace])
+        perf = results['perf']
+        self.assertEqual(perf['stages']['eval.predict']['calls'], len(self.texts))
+        self.assertEqual(perf['stages']['eval.score']['calls'], len(self.texts) + 1)
+        self.assertEqual(perf['distributions']['eval.document_latency']['count'], len(self.texts))
+        self.assertEqual(perf['throughput']['documents'], len(self.texts))
+        self.assertEqual(perf['throughput']['tokens'], sum(len(self.nlp.make_doc(text)) for text in self.texts))
+        with open(trace, 'r', encoding='utf8') as trace_file:
+            events = json.load(trace_file)['traceEvents']
+        self.assertEqual(sum(event['name'] == 'eval.predict' for event in events), len(self.texts))
@@ -0,0 +1,85 @@
+import unittest
+
+import io
+import os
+import tempfile
+import urllib.request
+
+from models.utilities.metrics import CONTENT_TYPE, MetricsExporter, Progress, format_duration, openmetrics
+from models.utilities.perf import Recorder
+
+class MetricsTests(unittest.TestCase):
+    def setUp(self):
+        self.recorder = Recorder()
+        with self.recorder.timer('model.request'):
+            pass
+        self.recorder.count('completion_cache.hits', 3)
+        self.recorder.count('completion_cache.misses')
+        self.recorder.count('model.retries', 2)
+        self.recorder.adjust('model.in_flight', 4)
+        for latency in [0.1, 0.2, 0.3]:
+            self.recorder.observe('eval.document_latency', latency)
+
+    def test_openmetrics(self):
+        progress = Progress(10, 2, recorder=self.recorder)
+        progress.update(5)
+        lines = openmetrics(self.recorder, progress).splitlines()
+        self.assertEqual(lines[-1], '# EOF')
+        self.assertIn('deid_documents_done 5', lines)
+        self.assertIn('deid_documents_expected 10', lines)
+        self.assertIn('# TYPE deid_completion_cache_hits counter', lines)
+        self.assertIn('deid_completion_cache_hits_total 3', lines)
+        self.assertIn('deid_model_in_flight 4', lines)
+        self.assertIn('deid_hit_ratio{cache="completion_cache"} 0.75', lines)
+        self.assertIn('deid_stage_calls_total{stage="model.request"} 1', lines)
+        self.assertIn('deid_eval_document_latency{quantile="0.5"} 0.2', lines)
+        self.assertIn('deid_eval_document_latency_count 3', lines)
+        self.assertTrue(any(line.startswith('deid_eta_seconds ') for line in lines))
+        # Every sample belongs to the family declared right before it
+        family = None
+        for line in lines[:-1]:
+            if line.startswith('# TYPE '):
+                family = line.split()[2]
+            elif not line.startswith('#'):
+                self.assertTrue(line.startswith(family), line)
+
+    def test_progress(self):
+        stream = io.StringIO()
+        progress = Progress(4, 1, stream, recorder=self.recorder)
+        self.assertIsNone(progress.rate())
+        self.assertIsNone(progress.eta())
+        progress.update(3)
+        self.assertGreater(progress.rate(), 0)
+        self.assertGreater(progress.eta(), 0)
+        line = progress.line()
+        self.assertTrue(line.startswith('3/4 documents (75%)'), line)
+        self.assertIn('4 in flight', line)
+        self.assertIn('2 retries', line)
+        self.assertIn('cache hits 75%', line)
+        # Not a terminal, so only the final line is written
+        progress.close()
+        self.assertEqual(stream.getvalue().count('\n'), 1)
+
+    def test_format_duration(self):
+        self.assertEqual(format_duration(3725.5), '1:02:05')
+        self.assertEqual(format_duration(None), '?')
+
+    def test_http(self):
+        exporter = MetricsExporter(Progress(10, recorder=self.recorder), port=0, recorder=self.recorder)
+        try:
+            with urllib.request.urlopen(f'http://127.0.0.1:{exporter.port}/metrics') as response:
+                self.assertEqual(response.headers['Content-Type'], CONTENT_TYPE)
+                body = response.read().decode('utf8')
+        finally:
+            exporter.close()
+        self.assertIn('deid_documents_expected 10\n', body)
+        self.assertTrue(body.endswith('# EOF\n'))
+
+    def test_textfile(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'deid.prom')
+            exporter = MetricsExporter(Progress(10, recorder=self.recorder), path=path, interval=60.0, recorder=self.recorder)
+            exporter.close()
+            with open(path, 'r', encoding='utf8') as metrics_file:
+                self.assertIn('deid_model_retries_total 2\n', metrics_file.read())
+            self.assertEqual(os.listdir(directory), ['deid.prom'])
@@ -0,0 +1,77 @@
+import unittest
+
+import os
+import pathlib
+import tempfile
+import unittest.mock
+
+import spacy
+
+import datasets.loaders.n2c2
+
+RECORDS_2006 = """<ROOT>
+<RECORD ID="1">
+<TEXT>
+Patient <PHI TYPE="PATIENT">Ola
+Olsen</PHI> was seen at <PHI TYPE="HOSPITAL">UNN</PHI>.
+</TEXT>
+</RECORD>
+<RECORD ID="2">
+<TEXT>
+Seen by <PHI TYPE="DOCTOR">Kari</PHI> on <PHI TYPE="DATE">12/03</PHI>.
+</TEXT>
+</RECORD>
+</ROOT>
+"""
+
+def document_2014(text: str, tags: list) -> str:
+    elements = ''.join(f'<{label} id="P{i}" start="{start}" end="{end}" TYPE="{label}" />\n' for i, (start, end, label) in enumerate(tags))
+    return f'<?xml version="1.0" encoding="UTF-8" ?>\n<deIdi2b2>\n<TEXT><![CDATA[{text}]]></TEXT>\n<TAGS>\n{elements}</TAGS>\n</deIdi2b2>\n'
+
+class N2C2Tests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.nlp = spacy.blank("en")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_2006_records(self):
+        records = list(datasets.loaders.n2c2.iter_2006_records(RECORDS_2006.splitlines(keepends=True)))
+        self.assertEqual(len(records), 2)
+        text, spans = records[0]
+        self.assertEqual([(text[start:end], label) for start, end, label in spans], [('Ola Olsen', 'PATIENT'), ('UNN', 'HOSPITAL')])
+        self.assertNotIn('\n', text)
+
+        path = pathlib.Path(self.directory.name) / 'records.xml'
+        path.write_text(RECORDS_2006, encoding='utf8')
+        doc_bin = datasets.loaders.n2c2.load_2006_from_file(path, self.nlp)
+        docs = list(doc_bin.get_docs(self.nlp.vocab))
+        self.assertEqual([(ent.text, ent.label_) for ent in docs[1].ents], [('Kari', 'DOCTOR'), ('12/03', 'DATE')])
+
+    def test_2006_patch(self):
+        lines = ['<ROOT>\n'] * (datasets.loaders.n2c2.PATCH_LINE_INDEX + 1)
+        lines[datasets.loaders.n2c2.PATCH_LINE_INDEX - 1] = 'Dr. <PHI TYPE="DOCTOR">Kari<PHI TYPE="DOCTOR">\n'
+        patched = list(datasets.loaders.n2c2.patch_2006_lines(lines))
+        self.assertEqual(patched[datasets.loaders.n2c2.PATCH_LINE_INDEX - 1], 'Dr. <PHI TYPE="DOCTOR">Kari</PHI>\n')
+        self.assertEqual(len(patched), len(lines))
+
+    def test_2014_parallel_matches_serial(self):
+        directory = pathlib.Path(self.directory.name)
+        expected = []
+        for folder in ['training-PHI-Gold-Set1', 'training-PHI-Gold-Set2']:
+            os.makedirs(directory / folder)
+            # Written in reverse, so the order of the files on disk differs from their names
+            for i in reversed(range(5)):
+                text = f"Record {i} of {folder}: Ola Olsen was admitted."
+                start = text.index('Ola')
+                (directory / folder / f'{i:03}.xml').write_text(document_2014(text, [(start, start + 9, 'PATIENT')]), encoding='utf8')
+            expected += [f"Record {i} of {folder}: Ola Olsen was admitted." for i in range(5)]
+
+        with unittest.mock.patch('datasets.loaders.n2c2.CHUNK_SIZE', 2):
+            parallel = datasets.loaders.n2c2.load_2014(self.nlp, directory, 'train', cache_directory=None, workers=2)
+        serial = datasets.loaders.n2c2.load_2014(self.nlp, directory, 'train', cache_directory=None, workers=1)
+        for doc_bin in [parallel, serial]:
+            docs = list(doc_bin.get_docs(self.nlp.vocab))
+            self.assertEqual([doc.text for doc in docs], expected)
+            self.assertEqual({(ent.text, ent.label_) for doc in docs for ent in doc.ents}, {('Ola Olsen', 'PATIENT')})
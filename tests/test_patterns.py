@@ -0,0 +1,48 @@
+import unittest
+
+import random
+import re
+
+from models.utilities.patterns import PatternMatcher, Rule, first_characters, load_rules
+
+class PatternMatcherTests(unittest.TestCase):
+    def setUp(self):
+        self.rules = load_rules()
+        self.matcher = PatternMatcher(self.rules)
+
+    def _separate_passes(self, text: str) -> list:
+        return [(match.start(rule.group), match.end(rule.group), rule.label)
+                for rule in self.rules for match in re.finditer(rule.pattern, text, re.IGNORECASE)]
+
+    def test_matches_separate_passes(self):
+        rng = random.Random(0)
+        words = ["Pasienten", "er", "47", "år", "12.03.2020", "77712345", "+4777712345", "1", ".", "januar", "1985", "010203", "12345", "00", " "]
+        for _ in range(200):
+            text = ' '.join(rng.choice(words) for _ in range(rng.randint(0, 40)))
+            self.assertEqual(self.matcher.matches(text), self._separate_passes(text))
+
+    def test_age_group(self):
+        self.assertEqual(self.matcher.matches("Han er 29 ÅR gammel"), [(7, 9, 'Age')])
+
+    def test_overlapping_rules(self):
+        # Both the phone number and the year rule match inside the number
+        matches = self.matcher.matches("Ring 19202122")
+        self.assertIn((5, 13, 'Phone_Number'), matches)
+        self.assertEqual(matches, self._separate_passes("Ring 19202122"))
+
+    def test_first_characters(self):
+        self.assertEqual(first_characters([r'\+\d{10}', r'(19|20)\d{2}']), r'12\+')
+        self.assertEqual(first_characters([r'a?b', r'(x|y)*z']), 'abxyz')
+        self.assertIsNone(first_characters([r'.a']))
+        self.assertIsNone(first_characters([r'a*']))
+
+    def test_rules_without_known_first_characters(self):
+        rules = [Rule(r'\w*ul', 'Location'), Rule(r'(\d+) år', 'Age', 1)]
+        text = "Tromsø ul 29 år"
+        expected = [(match.start(rule.group), match.end(rule.group), rule.label)
+                    for rule in rules for match in re.finditer(rule.pattern, text, re.IGNORECASE)]
+        self.assertEqual(PatternMatcher(rules).matches(text), expected)
+
+    def test_missing_group(self):
+        with self.assertRaises(ValueError):
+            PatternMatcher([Rule(r'\d+ år', 'Age', 1)])
@@ -0,0 +1,70 @@
+import unittest
+
+import json
+import os
+import tempfile
+import threading
+
+from models.utilities import perf
+from models.utilities.perf import Recorder, summarize
+
+class PerfTests(unittest.TestCase):
+    def test_timers_and_counters(self):
+        recorder = Recorder()
+        for _ in range(3):
+            with recorder.timer('model.request') as timing:
+                pass
+            self.assertGreaterEqual(timing.seconds, 0.0)
+        recorder.count('completion_cache.hits', 3)
+        recorder.count('completion_cache.misses')
+        report = recorder.report()
+        self.assertEqual(report['stages']['model.request']['calls'], 3)
+        self.assertEqual(report['counters'], {'completion_cache.hits': 3, 'completion_cache.misses': 1})
+        self.assertEqual(report['hit_rates'], {'completion_cache': 0.75})
+
+        recorder.reset()
+        self.assertEqual(recorder.report()['stages'], {})
+
+    def test_counts_from_threads(self):
+        recorder = Recorder()
+        def work():
+            for _ in range(1000):
+                recorder.count('model.retries')
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(recorder.counter('model.retries'), 8000)
+
+    def test_recording_per_run(self):
+        runs = [Recorder() for _ in range(4)]
+        def run(recorder):
+            with perf.recording(recorder):
+                for _ in range(100):
+                    perf.count('eval.documents')
+        threads = [threading.Thread(target=run, args=(recorder,)) for recorder in runs]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([recorder.counter('eval.documents') for recorder in runs], [100] * 4)
+        self.assertIs(perf.current(), perf.RECORDER)
+
+    def test_summarize(self):
+        summary = summarize([float(value) for value in range(1, 101)])
+        self.assertEqual(summary['count'], 100)
+        self.assertEqual(summary['mean'], 50.5)
+        self.assertEqual((summary['p50'], summary['p90'], summary['p99'], summary['max']), (50.0, 90.0, 99.0, 100.0))
+        self.assertEqual(summarize([]), {'count': 0})
+
+    def test_trace(self):
+        recorder = Recorder(trace=True)
+        with recorder.timer('eval.predict'):
+            pass
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'trace.json')
+            recorder.write_trace(path)
+            with open(path, 'r', encoding='utf8') as trace_file:
+                events = json.load(trace_file)['traceEvents']
+        self.assertEqual([(event['name'], event['ph']) for event in events], [('eval.predict', 'X')])
@@ -0,0 +1,73 @@
+import unittest
+
+import random
+
+import models.utilities.perf
+from models.utilities.projection import _diff, project_spans, source_annotations
+from models.utilities.tags import parse_tags
+
+EXPECTED_TAGS = ['First_Name', 'Last_Name', 'Location', 'Age', 'Date']
+SOURCE = "Pasienten Ola  Olsen er 47 år og bor i Tromsø ."
+
+def _project(annotated: str):
+    parsed = parse_tags(annotated, EXPECTED_TAGS)
+    projection = project_spans(parsed.text, SOURCE, parsed.annotations)
+    return [(SOURCE[start:end], label) for start, end, label in projection.spans], projection.projected, projection.dropped
+
+class ProjectionTests(unittest.TestCase):
+    def test_aligned_text_is_unchanged(self):
+        spans = [(10, 13, 'First_Name')]
+        self.assertEqual(project_spans(SOURCE, SOURCE, spans), (spans, 1, 0))
+
+    def test_whitespace_punctuation_and_typos(self):
+        spans, projected, dropped = _project("Pasienten <First_Name>Ola</First_Name> <Last_Name>Olssen</Last_Name> er <Age>47</Age> år, og bor i <Location>Tromsø</Location>.")
+        self.assertEqual(spans, [('Ola', 'First_Name'), ('Olsen', 'Last_Name'), ('47', 'Age'), ('Tromsø', 'Location')])
+        self.assertEqual((projected, dropped), (4, 0))
+
+    def test_dropped_words_and_rewritten_entities(self):
+        spans, _, _ = _project("<First_Name>Ola</First_Name> er <Age>47 år</Age> og bor i <Location>Oslo</Location> .")
+        self.assertEqual(spans, [('Ola', 'First_Name'), ('47 år', 'Age'), ('Tromsø', 'Location')])
+
+    def test_invented_text_is_dropped(self):
+        spans, projected, dropped = _project("Pasienten er <Age>47</Age> år . <Date>I går</Date> kom han .")
+        self.assertEqual(spans, [('47', 'Age')])
+        self.assertEqual((projected, dropped), (1, 1))
+
+    def test_source_annotations(self):
+        models.utilities.perf.reset()
+        aligned = source_annotations("Pasienten <First_Name>Ola</First_Name>  Olsen er <Age>47</Age> år og bor i Tromsø .", SOURCE, EXPECTED_TAGS)
+        self.assertEqual(aligned, [(10, 13, 'First_Name'), (24, 26, 'Age')])
+        self.assertEqual(models.utilities.perf.report()['counters'], {})
+
+        misaligned = source_annotations("Pasienten <First_Name>Ola</First_Name> Olsen er <Age>47</Age> år, og bor i <Location>Oslo", SOURCE, EXPECTED_TAGS)
+        self.assertEqual(misaligned, [(10, 13, 'First_Name'), (24, 26, 'Age')])
+        self.assertEqual(models.utilities.perf.report()['counters'],
+                         {'model.malformed_tags': 1, 'model.misaligned': 1, 'model.projected_spans': 2, 'model.dropped_spans': 0})
+
+    def test_long_texts_with_scattered_changes(self):
+        rng = random.Random(0)
+        words = [rng.choice(['Pasienten', 'er', 'innlagt', 'på', 'og', 'med', 'Ola', 'Olsen', '47', 'år', '.', ',']) for _ in range(5000)]
+        returned_words = [word + 'x' if rng.random() < 0.01 else word for word in words]
+        spans, position = [], 0
+        for word in returned_words:
+            if rng.random() < 0.05:
+                spans.append((position, position + len(word), 'Age'))
+            position += len(word) + 1
+        returned, source = ' '.join(returned_words), ' '.join(words)
+        projection = project_spans(returned, source, spans)
+        self.assertEqual(projection.dropped, 0)
+        for (start, end, _), (mapped_start, mapped_end, _) in zip(spans, projection.spans):
+            self.assertEqual(source[mapped_start:mapped_end], returned[start:end].removesuffix('x'))
+
+    def test_diff_opcodes(self):
+        rng = random.Random(1)
+        for _ in range(200):
+            a = [rng.choice('abcd') for _ in range(rng.randint(0, 80))]
+            b = [token for token in a if rng.random() > 0.2] + [rng.choice('abcde') for _ in range(rng.randint(0, 3))]
+            position = (0, 0)
+            for tag, i1, i2, j1, j2 in _diff(a, b):
+                self.assertEqual((i1, j1), position)
+                if tag == 'equal':
+                    self.assertEqual(a[i1:i2], b[j1:j2])
+                position = (i2, j2)
+            self.assertEqual(position, (len(a), len(b)))
@@ -1,11 +1,15 @@
 import unittest
 
 import re
+import unittest.mock
+
 import spacy
+import spacy.tokens
 import string2string
 import string2string.alignment
 
 import models.utilities.tags
+import scoring.alignment
 import scoring.replacement
 
 class ReplaceAccuracyTests(unittest.TestCase):
@@ -81,4 +85,35 @@ class ReplaceAccuracyTests(unittest.TestCase):
         self.assertEqual(results['tn'], 9)
         self.assertEqual(results['fp'], 0)
         self.assertEqual(results['fn'], 0)
-        self.assertEqual(results['insertions'], 1)
\ No newline at end of file
+        self.assertEqual(results['insertions'], 1)
+    
+    def test_anchored_matches_full(self):
+        # A document long enough for the Scorer to align it with the anchored aligner, with
+        # every word different so it has anchors, and a rewritten stretch too long for one
+        # score matrix, so the gap around it is split with Hirschberg's algorithm
+        words = [f"ord{i}" for i in range(scoring.replacement.ANCHORED_THRESHOLD + 1000)]
+        source = self.nlp.make_doc(" ".join(words))
+        source.set_ents([spacy.tokens.Span(source, i, i + 1, "PER") for i in range(7, len(words), 31)])
+        target = []
+        for i, word in enumerate(words):
+            if 500 <= i < 1600:
+                target.append(f"omskrevet{i}")
+            elif source[i].ent_type_:
+                target.append("<PER>")
+            elif i % 97 == 0:
+                continue
+            elif i % 89 == 0:
+                target += [word, "ekstra"]
+            else:
+                target.append(word)
+        target = " ".join(target)
+
+        with unittest.mock.patch('scoring.alignment._hirschberg', wraps=scoring.alignment._hirschberg) as hirschberg:
+            anchored = scoring.replacement.align_answer(source, target, anchored=True)
+        self.assertEqual(anchored, scoring.replacement.align_answer(source, target))
+        self.assertEqual(anchored['rewrites'], 1100)
+
+        anchors = scoring.alignment.find_anchors(*scoring.alignment.intern_tokens(source.text.split(), target.split()))
+        self.assertGreater(len(anchors), 10)
+        # One call for each gap between the anchors, and more for the splits
+        self.assertGreater(hirschberg.call_count, len(anchors) + 1)
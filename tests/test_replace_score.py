@@ -14,6 +14,14 @@ class ReplaceScoreTests(unittest.TestCase):
     def setUp(self):
         self.nlp = spacy.load("nb_core_news_sm")
         self.scorer = scoring.replacement.Scorer(self.nlp)
+        # Ten documents for the tests which score many at once, with answers
+        # alternating between a wrong and a right replacement
+        self.docbin = spacy.tokens.DocBin()
+        for i in range(10):
+            source = self.nlp.make_doc("The quick brown fox jumps over the lazy dog")
+            source.set_ents([source.char_span(4, 9, "ADJ")]) # "quick"
+            self.docbin.add(source)
+        self.answers = ["The <ADJ> brown fox jumps over the lazy" if i % 2 else "The quick brown fox jumps over the <ADJ> dog" for i in range(10)]
     
     def test_perfect_phi(self):
         source = self.nlp.make_doc("The quick brown fox jumps over the lazy dog")
@@ -27,4 +35,38 @@ class ReplaceScoreTests(unittest.TestCase):
         
         self.assertAlmostEqual(results['precision'], 1.0)
         self.assertAlmostEqual(results['recall'], 1.0)
-        self.assertAlmostEqual(results['f1'], 1.0)
\ No newline at end of file
+        self.assertAlmostEqual(results['f1'], 1.0)
+    
+    def test_parallel_matches_serial(self):
+        parallel = scoring.replacement.Scorer(self.nlp, workers=2, chunk_size=3)
+        self.assertEqual(parallel.score(self.docbin, self.answers), self.scorer.score(self.docbin, self.answers))
+    
+    def test_incremental_matches_batch(self):
+        answers = ["The <ADJ> brown fox jumps over the lazy dog" if i < 5 else "The quick brown fox jumps over the dog" for i in range(10)]
+        incremental = scoring.replacement.Scorer(self.nlp, chunk_size=5)
+        docs = list(self.docbin.get_docs(self.nlp.vocab))
+        for doc, answer in zip(docs[:5], answers[:5]):
+            incremental.add(doc, answer)
+        self.assertAlmostEqual(incremental.scores(wait=False)['recall'], 1.0)
+        for doc, answer in zip(docs[5:], answers[5:]):
+            incremental.add(doc, answer)
+        self.assertEqual(incremental.scores(), self.scorer.score(self.docbin, answers))
+    
+    def test_score_on_its_own(self):
+        first = self.scorer.score(self.docbin, self.answers)
+        self.assertEqual(self.scorer.score(self.docbin, self.answers), first)
+        self.assertEqual(len(self.scorer.document_counts()['counts']), 10)
+        with self.assertRaises(ValueError):
+            self.scorer.score(self.docbin, self.answers[:9])
+    
+    def test_document_counts_add_up_to_scores(self):
+        scorer = scoring.replacement.Scorer(self.nlp, workers=2, chunk_size=3)
+        results = scorer.score(self.docbin, self.answers)
+        document_counts = scorer.document_counts()
+        self.assertEqual(len(document_counts['counts']), 10)
+        self.assertEqual(document_counts['counts'][0], [0, 7, 1, 1, 0, 0, 0, 9])
+        totals = [sum(column) for column in zip(*document_counts['counts'])]
+        length = totals[document_counts['columns'].index('length')]
+        for name, total in zip(document_counts['columns'], totals):
+            if name != 'length':
+                self.assertAlmostEqual(results.get(name, 0.0), total / length)
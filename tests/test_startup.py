@@ -0,0 +1,38 @@
+import unittest
+
+import json
+import subprocess
+import sys
+import unittest.mock
+
+import eval
+import datasets.loaders.cache
+
+PIPELINE = 'nb_core_news_sm'
+
+class StartupTests(unittest.TestCase):
+    def test_tokenizer_matches_pipeline(self):
+        tokenizer = eval.load_pipeline(PIPELINE)
+        full = eval.load_pipeline(PIPELINE, full=True)
+        self.assertEqual(tokenizer.pipe_names, [])
+        texts = ["Pasienten (47 år) ble innlagt 12.03.2020 på UNN i Tromsø, tlf. +47 777 12 345.",
+                 "Dr. Olsen, f.eks. kl. 14:30: se https://example.org/notat?id=3 og ola@example.org!"]
+        for text in texts:
+            self.assertEqual([t.text_with_ws for t in tokenizer.make_doc(text)], [t.text_with_ws for t in full.make_doc(text)])
+        # The datasets tokenized by either are the same cached datasets
+        self.assertEqual(datasets.loaders.cache.tokenizer_fingerprint(tokenizer), datasets.loaders.cache.tokenizer_fingerprint(full))
+
+    def test_only_the_tokenizer_is_loaded(self):
+        # The pipeline is never loaded by spaCy, only its tokenizer settings are read
+        with unittest.mock.patch('spacy.load', side_effect=AssertionError('The pipeline should not be loaded')):
+            tokenizer = eval.load_pipeline(PIPELINE)
+        self.assertEqual(tokenizer.pipe_names, [])
+        self.assertEqual(tokenizer.vocab.vectors.shape[0], 0)
+        self.assertIn('ner', eval.load_pipeline(PIPELINE, full=True).pipe_names)
+
+    def test_eval_does_not_import_model_backends(self):
+        # The backends are only imported by load_model, for the model which is run
+        backends = ['transformers', 'string2string', 'replicate']
+        imported = subprocess.run([sys.executable, '-c', f'import sys, json, eval; print(json.dumps([m for m in {backends!r} if m in sys.modules]))'],
+                                  capture_output=True, text=True, check=True)
+        self.assertEqual(json.loads(imported.stdout.splitlines()[-1]), [])
@@ -0,0 +1,104 @@
+import unittest
+
+import json
+import os
+import random
+import tempfile
+
+import compare_runs
+
+import scoring.stats
+
+LABELS = ['First_Name', 'Last_Name', 'Age']
+
+def _annotate_results(rng: random.Random, documents: int, tp_rate: float, labels=LABELS) -> dict:
+    counts = []
+    for _ in range(documents):
+        row = []
+        for _ in labels:
+            entities = rng.randint(0, 4)
+            tp = sum(rng.random() < tp_rate for _ in range(entities))
+            row.append([tp, rng.randint(0, 1), entities - tp])
+        counts.append(row)
+    return {'document_counts': {'labels': labels, 'columns': ['tp', 'fp', 'fn'], 'counts': counts, 'documents': list(range(documents))}}
+
+def _replace_results(rng: random.Random, documents: int) -> dict:
+    counts = []
+    for _ in range(documents):
+        length = rng.randint(10, 50)
+        tp, fp, fn = rng.randint(0, 3), rng.randint(0, 2), rng.randint(0, 3)
+        counts.append([tp, length - tp - fp - fn, fp, fn, rng.randint(0, 1), rng.randint(0, 1), rng.randint(0, 2), length])
+    return {'document_counts': {'columns': ['tp', 'tn', 'fp', 'fn', 'removals', 'rewrites', 'insertions', 'length'],
+                                'counts': counts, 'documents': list(range(documents))}}
+
+class StatsTests(unittest.TestCase):
+    def test_point_estimates_match_scores(self):
+        counts = scoring.stats.load_counts(_annotate_results(random.Random(0), 50, 0.7))
+        tp, fp, fn = counts.counts.sum(axis=(0, 1))
+        scores = scoring.stats.point_estimates(counts)
+        self.assertAlmostEqual(scores['ents_p'], tp / (tp + fp))
+        self.assertAlmostEqual(scores['ents_r'], tp / (tp + fn))
+
+        counts = scoring.stats.load_counts(_replace_results(random.Random(0), 50))
+        totals = dict(zip(counts.columns, counts.counts.sum(axis=0)))
+        scores = scoring.stats.point_estimates(counts)
+        self.assertAlmostEqual(scores['precision'], totals['tp'] / (totals['tp'] + totals['fp']))
+        self.assertAlmostEqual(scores['removals'], totals['removals'] / totals['length'])
+
+    def test_interval_contains_estimate(self):
+        counts = scoring.stats.load_counts(_annotate_results(random.Random(1), 200, 0.7))
+        samples = scoring.stats.bootstrap(counts, resamples=2000)
+        estimates = scoring.stats.point_estimates(counts)
+        for name, estimate in estimates.items():
+            low, high = scoring.stats.confidence_interval(samples[name])
+            self.assertLessEqual(low, estimate, name)
+            self.assertGreaterEqual(high, estimate, name)
+
+    def test_identical_runs_are_not_different(self):
+        results = _replace_results(random.Random(2), 100)
+        counts = scoring.stats.load_counts(results)
+        comparison = scoring.stats.compare(counts, counts, resamples=500)
+        for name, row in comparison.items():
+            self.assertEqual(row['p'], 1.0, name)
+            self.assertEqual(row['difference_ci'], (0.0, 0.0), name)
+
+    def test_better_run_is_significant(self):
+        worse = scoring.stats.load_counts(_annotate_results(random.Random(3), 300, 0.5))
+        better = scoring.stats.load_counts(_annotate_results(random.Random(3), 300, 0.9))
+        comparison = scoring.stats.compare(worse, better, resamples=1000)
+        self.assertLess(comparison['ents_r']['p'], 0.01)
+        self.assertGreater(comparison['ents_r']['difference_ci'][0], 0.0)
+
+    def test_pairs_documents_and_labels(self):
+        a = _annotate_results(random.Random(4), 20, 0.7)
+        b = _annotate_results(random.Random(5), 30, 0.7, labels=['Age', 'Location'])
+        b['document_counts']['documents'] = list(range(10, 40))
+        a, b = scoring.stats.pair_counts(scoring.stats.load_counts(a), scoring.stats.load_counts(b))
+        self.assertEqual(a.documents.tolist(), list(range(10, 20)))
+        self.assertEqual(a.labels, LABELS + ['Location'])
+        self.assertEqual(b.labels, a.labels)
+        self.assertEqual(b.counts[:, :2].sum(), 0)
+
+    def test_resamples_in_batches(self):
+        # The resamples are drawn in several batches (see scoring.stats.BATCH_ELEMENTS), and
+        # timed in benchmarks/suite.py (stats.bootstrap)
+        counts = scoring.stats.load_counts(_annotate_results(random.Random(6), 1000, 0.7))
+        samples = scoring.stats.bootstrap(counts, resamples=10000)
+        again = scoring.stats.bootstrap(counts, resamples=10000)
+        self.assertEqual(set(samples), set(scoring.stats.point_estimates(counts)))
+        for name, values in samples.items():
+            self.assertEqual(values.shape, (10000,), name)
+            self.assertTrue(((values >= 0.0) & (values <= 1.0)).all(), name)
+            # The same seed draws the same resamples
+            self.assertTrue((values == again[name]).all(), name)
+
+    def test_compare_runs_without_counts(self):
+        with tempfile.TemporaryDirectory() as directory:
+            paths = [os.path.join(directory, name) for name in ('old.json', 'new.json')]
+            for path, result in zip(paths, [{'ents_f': 0.5}, _annotate_results(random.Random(7), 10, 0.7)]):
+                with open(path, 'w', encoding='utf8') as result_file:
+                    json.dump(result, result_file)
+            args = compare_runs.CompareArguments().parse_args(paths)
+            with self.assertRaises(SystemExit) as exit:
+                compare_runs.main(args)
+        self.assertIn('no per-document counts', str(exit.exception.code))
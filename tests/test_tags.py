@@ -0,0 +1,47 @@
+import unittest
+
+from models.utilities.tags import MalformedTag, list_annotations, parse_tags, remove_tags
+
+EXPECTED_TAGS = ['First_Name', 'Last_Name', 'Location', 'Age', 'Date']
+
+class ParseTagsTests(unittest.TestCase):
+    def test_matches_regular_expressions(self):
+        for annotated in ["Ola <First_Name>Ola</First_Name> <Last_Name>Olsen</Last_Name> er <Age>47</Age> år .",
+                          "Innlagt <Date>3. mai</Date> på <Health_Care_Unit>St. Olavs</Health_Care_Unit> .",
+                          "Ingen tagger her.",
+                          "<Age></Age>tom"]:
+            parsed = parse_tags(annotated, EXPECTED_TAGS)
+            self.assertEqual(parsed.text, remove_tags(annotated))
+            self.assertEqual(parsed.annotations, list_annotations(annotated, EXPECTED_TAGS))
+            self.assertEqual(parsed.malformed, [])
+
+    def test_all_tags_without_expected_tags(self):
+        parsed = parse_tags("<Foo>a</Foo> <Age>1</Age>")
+        self.assertEqual(parsed.annotations, [(0, 1, 'Foo'), (2, 3, 'Age')])
+
+    def test_nested(self):
+        annotated = "<Location>St. <First_Name>Olav</First_Name> Hospital</Location>"
+        parsed = parse_tags(annotated, EXPECTED_TAGS)
+        self.assertEqual(parsed.text, "St. Olav Hospital")
+        self.assertEqual(parsed.annotations, [(0, 17, 'Location')])
+        self.assertEqual(parsed.malformed, [MalformedTag(14, 'First_Name', 'nested')])
+
+    def test_unclosed_and_unopened(self):
+        annotated = "<Age>47 år</Date> og <First_Name>Ola</First_Name>"
+        parsed = parse_tags(annotated, EXPECTED_TAGS)
+        self.assertEqual(parsed.text, "47 år og Ola")
+        self.assertEqual(parsed.annotations, [(9, 12, 'First_Name')])
+        self.assertEqual(parsed.malformed, [MalformedTag(0, 'Age', 'unclosed'), MalformedTag(10, 'Date', 'unopened')])
+
+    def test_closing_an_outer_tag_closes_the_inner_ones(self):
+        parsed = parse_tags("<Location>a <Age>b</Location> c", EXPECTED_TAGS)
+        self.assertEqual(parsed.text, "a b c")
+        self.assertEqual(parsed.annotations, [(0, 3, 'Location')])
+        self.assertEqual(parsed.malformed, [MalformedTag(12, 'Age', 'unclosed')])
+
+    def test_stray_angle_brackets_are_text(self):
+        annotated = "CRP <5 og a<b, <Age>5 < 6</Age> <>"
+        parsed = parse_tags(annotated, EXPECTED_TAGS)
+        self.assertEqual(parsed.text, "CRP <5 og a<b, 5 < 6 <>")
+        self.assertEqual(parsed.annotations, [(15, 20, 'Age')])
+        self.assertEqual(parsed.malformed, [])